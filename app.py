@@ -1,25 +1,67 @@
+import time
+
+script_started = time.perf_counter()
+
 import streamlit as st
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 import asyncio
-from main import image_parser_agent, latex_generator_agent, math_classifier_agent, solution_generator_agent, Runner
-import tempfile
-from PIL import Image
-import io
 import base64
-import requests
+import metrics
+from models import FusedOutput, JobStatus, ProblemResult
 from urllib.parse import urlparse
-import agentops
 
-load_dotenv()
+# Streamlit re-executes this script on every interaction. Process-wide resources
+# (environment, telemetry, agents, caches) are built once with st.cache_resource, and
+# heavy imports (the Agents SDK, agentops, requests) only happen when first needed.
+
+@st.cache_resource
+def load_environment():
+    """Read .env and start AgentOps once per process"""
+    load_dotenv()
+    if os.getenv("AGENTOPS_API_KEY"):
+        import agentops
+        agentops.init(os.getenv("AGENTOPS_API_KEY"))
+
+@st.cache_resource
+def load_pipeline():
+    """Import the agents and build the text pipeline and result cache once per process"""
+    from main import text_pipeline, result_cache
+    return text_pipeline, result_cache
 
-agentops.init(os.getenv("AGENTOPS_API_KEY"))
+@st.cache_resource
+def load_history():
+    """Open the conversion history (and apply its retention policy) once per process"""
+    import history  # loads Pillow and numpy, so only once the script is running
+    return history.History() if history.DEFAULT_HISTORY_PATH else None
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+@st.cache_resource
+def run_times():
+    """Script run durations shared by all sessions: the first (cold) run and the latest rerun"""
+    return {"cold_start": None, "last_rerun": None, "reruns": 0}
 
 st.set_page_config(page_title="LaTeX Image Parser", layout="wide")
+load_environment()
+
+# With AGENTEX_API_URL set, the app is a thin client of the HTTP service (server.py)
+# instead of running the pipelines in the Streamlit script thread
+API_URL = os.getenv("AGENTEX_API_URL")
+
+if API_URL:
+    text_pipeline = result_cache = None
+else:
+    text_pipeline, result_cache = load_pipeline()
+    import vision
+    import segmentation
+    import fastpath
+    import katex
+    import scheduler
+
+conversion_history = load_history()
+if conversion_history is not None:
+    import history
+
+STAGES = list(FusedOutput.model_fields)
 
 st.title("LaTeX Image Parser")
 st.markdown("Upload an image with mathematical content or provide an image URL to get LaTeX code.")
@@ -37,30 +79,276 @@ if "math_classification" not in st.session_state:
     st.session_state.math_classification = None
 if "math_solution" not in st.session_state:
     st.session_state.math_solution = None
+if "problems" not in st.session_state:
+    st.session_state.problems = []
+if "result" not in st.session_state:
+    st.session_state.result = None
+if "history_keys" not in st.session_state:
+    st.session_state.history_keys = []  # (source, history key) of the result or of each problem
+
+# One event loop per session, reused across reruns, so the pooled OpenAI client
+# (one per loop, see clients.py) keeps its connections between interactions
+def run_async(coroutine):
+    if "event_loop" not in st.session_state:
+        st.session_state.event_loop = asyncio.new_event_loop()
+    return st.session_state.event_loop.run_until_complete(coroutine)
+
+# Image preprocessing options applied before upload to the Vision API
+st.sidebar.subheader("Image preprocessing")
+preprocess_options = {
+    "grayscale": st.sidebar.checkbox("Convert to grayscale", value=False),
+    "enhance_contrast": st.sidebar.checkbox("Increase contrast", value=False),
+}
+# Worksheets are split into one region per problem, each parsed and solved concurrently
+segment_pages = st.sidebar.checkbox("Split worksheets into separate problems", value=False)
+
+# Stream partial results into the page as they are generated instead of waiting for every agent
+stream_results = st.sidebar.checkbox("Stream results as they are generated", value=True)
+
+# Stages answered by one structured-output call instead of an agent plus its tool call
+direct_stages = st.sidebar.multiselect(
+    "Direct structured output for", STAGES, default=[],
+    help="Skips the agent's tool call and its extra model round trip",
+)
+stage_modes = {stage: "direct" if stage in direct_stages else "agent" for stage in STAGES}
+
+# One call for LaTeX, classification and solution; only parts that fail validation are recomputed
+fused_call = st.sidebar.checkbox("Fuse LaTeX, classification and solution into one call", value=False)
+pipeline_options = {"modes": stage_modes, "fused": fused_call}
+
+# Only LaTeX is computed on submit; classification and solution are computed when their
+# result tab is opened. A fused call fills every stage at once, so then all run up front.
+submit_options = {**pipeline_options, "stages": STAGES if fused_call else ["latex"]}
+
+# Run the agents on a text, rendering LaTeX and solution steps as they arrive when streaming
+async def process_text(text):
+    if not stream_results:
+        return await text_pipeline.run(text, **submit_options)
+
+    st.subheader("Live Results")
+    latex_placeholder = st.empty()
+    classification_placeholder = st.empty()
+    steps_placeholder = st.empty()
+    steps_container = steps_placeholder.container()
+    async for event in text_pipeline.stream(text, **submit_options):
+        if event.kind == "error":
+            st.warning(f"{event.stage} failed: {event.data}")
+        elif event.stage == "latex":
+            latex_code = event.data if event.kind == "partial" else event.data.latex_code
+            latex_placeholder.code(latex_code, language="latex")
+        elif event.stage == "classification":
+            classification_placeholder.markdown(
+                f"**Type:** {event.data.math_type} · **Difficulty:** {event.data.difficulty_level}"
+            )
+        elif event.stage == "solution" and event.kind == "partial":
+            steps_container = steps_placeholder.container()  # a retry replaces the steps so far
+        elif event.stage == "solution" and event.kind == "step":
+            steps_container.markdown(f"**Step {event.data['index'] + 1}:** {event.data['text']}")
+        elif event.stage == "pipeline":
+            result = event.data
+    return result
 
-# Function to call Vision API directly
-def call_vision_api(image_url):
+# Parse a prepared image (through the result cache) and run the agents on its text in one event loop
+async def process_image(prepare):
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Describe this math problem in detailed english to later generate latex code."},
-                        {"type": "image_url", "image_url": {"url": image_url}}
-                    ]
-                }
-            ],
-            max_tokens=1000
-        )
-        return response.choices[0].message.content
+        image_url, cache_payload, prepared = await prepare
+        if prepared:
+            st.caption(f"Image upload: {prepared.summary()}")
+        if stream_results:
+            vision_placeholder = st.empty()
+            vision_response = ""
+            async for delta in vision.stream_cached_vision_api(image_url, cache_payload, result_cache):
+                vision_response += delta
+                vision_placeholder.markdown(vision_response)
+            vision_placeholder.empty()
+        else:
+            vision_response = await vision.cached_vision_api(image_url, cache_payload, result_cache)
     except Exception as e:
         st.session_state.error = f"Vision API error: {str(e)}"
         raise e
+    st.session_state.vision_response = vision_response
+
+    # Show the Vision API response
+    st.subheader("Vision API Response")
+    st.text_area("Raw Vision Response", vision_response, height=150)
+
+    return await process_text(vision_response)
+
+# Segment a worksheet and solve every problem concurrently
+async def process_worksheet(parse):
+    problems = await parse
+    st.caption(f"Found {len(problems)} problem(s) on the page")
+    return problems
+
+# Store per-problem results in session state in place of a single result
+def store_problems(problems):
+    st.session_state.result = None
+    st.session_state.problems = problems
+    st.session_state.parsed_text = ""
+    st.session_state.latex_code = ""
+    st.session_state.math_classification = None
+    st.session_state.math_solution = None
+    errors = [f"problem {p.index + 1} {stage}: {error}" for p in problems for stage, error in p.errors.items()]
+    if errors:
+        st.session_state.error = "Agent processing error: " + "; ".join(errors)
+
+# Send a request to the HTTP service and poll its job until it finishes
+def remote_process(payload):
+    import requests
+
+    body = {**submit_options, **preprocess_options, "segment": segment_pages, **payload}
+    response = requests.post(f"{API_URL}/v1/process", json=body, timeout=120)
+    while response.status_code == 202:
+        time.sleep(1)
+        response = requests.get(API_URL + response.headers["Location"], timeout=30)
+    if response.status_code == 429:
+        raise RuntimeError("The service is busy, please retry in a moment")
+    if response.status_code in (400, 413):
+        raise RuntimeError(f"The service rejected the request: {response.json()['error']}")
+    if response.status_code != 502:  # a failed job, reported below
+        response.raise_for_status()
+    job = JobStatus.model_validate(response.json())
+    if job.status == "failed":
+        raise RuntimeError(job.error)
+    return job.result
+
+# Each input runs on the HTTP service when configured, otherwise in this script
+def run_upload(image_bytes):
+    if API_URL:
+        return remote_process({"image_base64": base64.b64encode(image_bytes).decode("ascii")})
+    with metrics.request():
+        if segment_pages:
+            return run_async(process_worksheet(segmentation.parse_worksheet(
+                image_bytes, text_pipeline, result_cache, submit_options, **preprocess_options
+            )))
+        return run_async(process_image(vision.prepare_image_bytes(image_bytes, **preprocess_options)))
+
+def run_url(image_url):
+    if API_URL:
+        return remote_process({"image_url": image_url})
+    with metrics.request():
+        if segment_pages:
+            return run_async(process_worksheet(segmentation.parse_worksheet_url(
+                image_url, text_pipeline, result_cache, submit_options, **preprocess_options
+            )))
+        return run_async(process_image(vision.prepare_image_url(image_url, **preprocess_options)))
+
+def run_text(text):
+    if API_URL:
+        return remote_process({"text": text})
+    with metrics.request():
+        return run_async(process_text(text))
+
+# Compute the stages a stored result is missing from its text, without parsing the input again
+def complete_result(result, stages):
+    missing = [stage for stage in stages if getattr(result, stage) is None]
+    if not missing:
+        return result
+    if API_URL:
+        return result.merged(remote_process({"text": result.text, "stages": missing}), missing)
+    with metrics.request():
+        return run_async(text_pipeline.extend(result, missing, **pipeline_options))
+
+# Compute a stage of the current result when its tab is opened (once; retries are explicit)
+def ensure_stage(stage, retry_key):
+    result = st.session_state.result
+    if result is None or getattr(result, stage) is not None:
+        return
+    if stage in result.errors and not st.button("Retry", key=retry_key):
+        return
+    st.session_state.error = ""
+    with st.spinner(f"Computing {stage}..."):
+        try:
+            store_pipeline_result(complete_result(result, [stage]))
+            update_history()
+        except Exception as e:
+            st.error(f"Error computing {stage}: {str(e)}")
+
+# Store either a single result or per-problem results
+def store_result(result):
+    if isinstance(result, list):
+        store_problems(result)
+    else:
+        store_pipeline_result(result)
+
+# Store a PipelineResult in session state, keeping whatever stages succeeded
+def store_pipeline_result(result):
+    st.session_state.result = result
+    st.session_state.problems = []
+    st.session_state.parsed_text = result.text
+    st.session_state.latex_code = result.latex.latex_code if result.latex else ""
+    st.session_state.math_classification = result.classification
+    st.session_state.math_solution = result.solution
+    if result.errors:
+        st.session_state.error = "Agent processing error: " + "; ".join(
+            f"{stage}: {error}" for stage, error in result.errors.items()
+        )
+
+# Record the stored result, or each stored problem, in the conversion history under its input
+def remember(source, payload, image_bytes=None):
+    if conversion_history is None:
+        return
+    problems = st.session_state.problems
+    if problems:
+        st.session_state.history_keys = [("worksheet", history.input_hash(payload, p.index)) for p in problems]
+    else:
+        st.session_state.history_keys = [(source, history.input_hash(payload))]
+    for index in range(len(st.session_state.history_keys)):
+        box = problems[index].box if problems else None
+        update_history(index, history.make_thumbnail(image_bytes, box) if image_bytes else None)
+
+# Save the stored result (or problem ``index``) again, e.g. after a stage was computed on demand
+def update_history(index=0, thumbnail=None):
+    if conversion_history is None or index >= len(st.session_state.history_keys):
+        return
+    source, key = st.session_state.history_keys[index]
+    result = st.session_state.problems[index] if st.session_state.problems else st.session_state.result
+    conversion_history.save(result, source, key, thumbnail)
+
+# Show a recorded conversion as the current result, without calling any model
+def open_entry(entry):
+    result = conversion_history.load(entry.id)
+    if result is None:
+        st.warning("This conversion is no longer in the history")
+        return
+    st.session_state.error = ""
+    store_pipeline_result(result)
+    st.session_state.history_keys = [(entry.source, entry.input_hash)]
+
+# Show the recorded problems of a worksheet as the current result
+def open_worksheet(entries):
+    problems = [conversion_history.load(entry.id, ProblemResult) for entry in entries]
+    kept = [(entry, problem) for entry, problem in zip(entries, problems) if problem is not None]
+    if not kept:
+        st.warning("This conversion is no longer in the history")
+        return
+    st.session_state.error = ""
+    store_problems([problem.model_copy(update={"index": index}) for index, (_, problem) in enumerate(kept)])
+    st.session_state.history_keys = [(entry.source, entry.input_hash) for entry, _ in kept]
+
+# Offer the recorded result of an input that was converted before, whole or as a worksheet
+def offer_previous(payload, button_key):
+    if conversion_history is None:
+        return
+    entries = conversion_history.find_page(history.input_hash(payload))
+    if not entries:
+        return
+    st.info(f"This input was already converted on {format_time(entries[0].created_at)}.")
+    if st.button("Show previous result", key=button_key):
+        if entries[0].source == "worksheet":
+            open_worksheet(entries)
+        else:
+            open_entry(entries[0])
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
 
 # Tab 1: Upload Image
-tab1, tab2, tab3 = st.tabs(["Upload Image", "Image URL", "Text Input"])
+tab1, tab2, tab3, *history_tab = st.tabs(
+    ["Upload Image", "Image URL", "Text Input"] + (["History"] if conversion_history else []),
+    key="input_tab",
+    on_change="rerun",
+)
 
 with tab1:
     uploaded_file = st.file_uploader("Choose an image file", type=["jpg", "jpeg", "png"])
@@ -68,62 +356,16 @@ with tab1:
     if uploaded_file is not None:
         # Display the uploaded image
         st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
+        offer_previous(uploaded_file.getvalue(), "previous_upload")
         
         if st.button("Process Uploaded Image", key="process_upload"):
             st.session_state.error = ""
             with st.spinner("Processing image..."):
                 try:
-                    # Save the uploaded file to a temporary file with proper extension
-                    file_extension = os.path.splitext(uploaded_file.name)[1].lower()
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
-                        tmp_file.write(uploaded_file.getvalue())
-                        tmp_path = tmp_file.name
-                    
-                    try:
-                        # For local files, we need to create a data URL
-                        with open(tmp_path, "rb") as image_file:
-                            encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-                        
-                        mime_type = f"image/{file_extension[1:]}"  # Remove the dot from extension
-                        img_url = f"data:{mime_type};base64,{encoded_string}"
-                        
-                        # Call Vision API directly
-                        vision_response = call_vision_api(img_url)
-                        st.session_state.vision_response = vision_response
-                        
-                        # Show the Vision API response
-                        st.subheader("Vision API Response")
-                        st.text_area("Raw Vision Response", vision_response, height=150)
-                        
-                        # Process with agents
-                        async def process_with_agents():
-                            try:
-                                # Use the vision response as input to latex_generator_agent
-                                latex_result = await Runner.run(latex_generator_agent, vision_response)
-                                st.session_state.latex_code = latex_result.final_output.latex_code
-                                st.session_state.parsed_text = vision_response  # Set parsed text to the vision response
-                                
-                                # Additional insights with new agents
-                                classification_result = await Runner.run(math_classifier_agent, vision_response)
-                                st.session_state.math_classification = classification_result.final_output
-                                
-                                solution_result = await Runner.run(solution_generator_agent, vision_response)
-                                st.session_state.math_solution = solution_result.final_output
-                                
-                            except Exception as e:
-                                st.session_state.error = f"Agent processing error: {str(e)}"
-                                raise e
-                        
-                        # Run the async function
-                        asyncio.run(process_with_agents())
-                        
-                    except Exception as e:
-                        st.session_state.error = f"Error during image processing: {str(e)}"
-                        raise e
-                    finally:
-                        # Clean up temporary file
-                        if os.path.exists(tmp_path):
-                            os.unlink(tmp_path)
+                    # Shrink the image in memory, call Vision API (cached by image bytes),
+                    # then process with agents concurrently
+                    store_result(run_upload(uploaded_file.getvalue()))
+                    remember("upload", uploaded_file.getvalue(), uploaded_file.getvalue())
                     
                     if not st.session_state.error:
                         st.success("Processing complete!")
@@ -148,40 +390,16 @@ with tab2:
                 st.warning("Please enter a valid image URL")
         except Exception:
             st.warning("Could not load image from URL")
+        offer_previous(image_url.encode("utf-8"), "previous_url")
         
         if st.button("Process Image URL", key="process_url"):
             st.session_state.error = ""
             with st.spinner("Processing image..."):
                 try:
-                    # Call Vision API directly
-                    vision_response = call_vision_api(image_url)
-                    st.session_state.vision_response = vision_response
-                    
-                    # Show the Vision API response
-                    st.subheader("Vision API Response")
-                    st.text_area("Raw Vision Response", vision_response, height=150)
-                    
-                    # Process with agents
-                    async def process_with_agents():
-                        try:
-                            # Use the vision response as input to latex_generator_agent
-                            latex_result = await Runner.run(latex_generator_agent, vision_response)
-                            st.session_state.latex_code = latex_result.final_output.latex_code
-                            st.session_state.parsed_text = vision_response  # Set parsed text to the vision response
-                            
-                            # Additional insights with new agents
-                            classification_result = await Runner.run(math_classifier_agent, vision_response)
-                            st.session_state.math_classification = classification_result.final_output
-                            
-                            solution_result = await Runner.run(solution_generator_agent, vision_response)
-                            st.session_state.math_solution = solution_result.final_output
-                            
-                        except Exception as e:
-                            st.session_state.error = f"Agent processing error: {str(e)}"
-                            raise e
-                    
-                    # Run the async function
-                    asyncio.run(process_with_agents())
+                    # Download and shrink the image, call Vision API (cached by image bytes),
+                    # then process with agents concurrently
+                    store_result(run_url(image_url))
+                    remember("url", image_url.encode("utf-8"))
                     
                     if not st.session_state.error:
                         st.success("Processing complete!")
@@ -194,32 +412,16 @@ with tab2:
 with tab3:
     st.markdown("Enter your mathematical expression or description directly:")
     user_text_input = st.text_area("Mathematical Text", height=150)
+    if user_text_input.strip():
+        offer_previous(user_text_input, "previous_text")
     
     if st.button("Generate LaTeX", key="process_text"):
         st.session_state.error = ""
         with st.spinner("Generating LaTeX..."):
             try:
-                # Process with latex generator agent
-                async def process_text_with_agent():
-                    try:
-                        # Use the user text as input to latex_generator_agent
-                        latex_result = await Runner.run(latex_generator_agent, user_text_input)
-                        st.session_state.latex_code = latex_result.final_output.latex_code
-                        st.session_state.parsed_text = user_text_input  # Set parsed text to the user input
-                        
-                        # Additional insights with new agents
-                        classification_result = await Runner.run(math_classifier_agent, user_text_input)
-                        st.session_state.math_classification = classification_result.final_output
-                        
-                        solution_result = await Runner.run(solution_generator_agent, user_text_input)
-                        st.session_state.math_solution = solution_result.final_output
-                        
-                    except Exception as e:
-                        st.session_state.error = f"Agent processing error: {str(e)}"
-                        raise e
-                
-                # Run the async function
-                asyncio.run(process_text_with_agent())
+                # Process with agents concurrently
+                store_result(run_text(user_text_input))
+                remember("text", user_text_input)
                 
                 if not st.session_state.error:
                     st.success("LaTeX generation complete!")
@@ -228,12 +430,111 @@ with tab3:
                 st.error(f"Error generating LaTeX: {str(e)}")
                 st.session_state.error = str(e)
 
+# Tab 4: Conversion history, searched only while the tab is open
+if history_tab and history_tab[0].open:
+    with history_tab[0]:
+        col1, col2, col3, col4 = st.columns([3, 2, 2, 2])
+        filters = {
+            "query": col1.text_input("Search", placeholder="Text, LaTeX, concepts or solution"),
+            "concept": col2.text_input("Concept"),
+            "math_type": col3.selectbox(
+                "Math type", [""] + conversion_history.math_types(), format_func=lambda value: value or "Any"
+            ),
+            "difficulty": col4.selectbox(
+                "Difficulty", ["", "easy", "medium", "hard"], format_func=lambda value: value or "Any"
+            ),
+        }
+        # Keyset pagination: the cursors of the pages up to the current one, reset by a new search
+        if st.session_state.get("history_filters") != filters:
+            st.session_state.history_filters = filters
+            st.session_state.history_cursors = [None]
+        cursors = st.session_state.history_cursors
+        page = conversion_history.search(**filters, cursor=cursors[-1])
+
+        if not page.entries:
+            st.info("No conversions match these filters." if any(filters.values()) else "No conversions yet.")
+        for entry in page.entries:
+            with st.container(border=True):
+                thumbnail_col, text_col, open_col = st.columns([1, 6, 1])
+                if entry.thumbnail:
+                    thumbnail_col.image(entry.thumbnail)
+                text_col.markdown(entry.text[:300])
+                if entry.latex_code:
+                    text_col.code(entry.latex_code[:300], language="latex")
+                text_col.caption(" · ".join(filter(None, [
+                    format_time(entry.created_at), entry.math_type, entry.difficulty_level, ", ".join(entry.concepts)
+                ])))
+                if open_col.button("Open", key=f"history_open_{entry.id}"):
+                    open_entry(entry)
+
+        newer_col, older_col = st.columns(2)
+        if len(cursors) > 1 and newer_col.button("Newer", key="history_newer"):
+            cursors.pop()
+            st.rerun()
+        if page.next_cursor and older_col.button("Older", key="history_older"):
+            cursors.append(page.next_cursor)
+            st.rerun()
+
+# Cache, model usage and validation statistics of the pipelines running in this process
+if not API_URL:
+    st.sidebar.caption(
+        f"Result cache: {result_cache.stats['hits']} hits / {result_cache.stats['misses']} misses "
+        f"({result_cache.hit_rate():.0%} hit rate)"
+    )
+    st.sidebar.caption(
+        f"LaTeX fast path: served {fastpath.stats['served']} of "
+        f"{fastpath.stats['served'] + fastpath.stats['fallback']} requests ({fastpath.served_fraction():.0%})"
+    )
+    st.sidebar.caption(
+        f"Model usage: {metrics.registry.total('agentex_model_calls_total'):.0f} calls, "
+        f"est. ${metrics.registry.total('agentex_cost_usd_total'):.4f}"
+    )
+    throttle = scheduler.scheduler.stats()
+    st.sidebar.caption(
+        f"Rate limiter: {sum(throttle['waiting'].values())} waiting, "
+        f"{sum(throttle['throttle_wait_seconds'].values()):.1f}s throttled, {throttle['rate_limited']} rate limited"
+    )
+    st.sidebar.caption(
+        f"KaTeX validation: {katex.stats['passed']} passed, {katex.stats['repaired']} repaired, "
+        f"{katex.stats['failed']} failed"
+    )
+
 # Display results
 if st.session_state.error:
     st.error(f"Error: {st.session_state.error}")
 
+for problem in st.session_state.problems:
+    with st.expander(f"Problem {problem.index + 1}", expanded=problem.index == 0):
+        st.markdown(problem.text)
+        if problem.latex:
+            st.code(problem.latex.latex_code, language="latex")
+            st.latex(problem.latex.latex_code)
+        if problem.classification:
+            st.markdown(
+                f"**Type:** {problem.classification.math_type} · "
+                f"**Difficulty:** {problem.classification.difficulty_level}"
+            )
+        if problem.solution:
+            for i, step in enumerate(problem.solution.solution_steps):
+                st.markdown(f"**Step {i+1}:** {step}")
+            st.markdown(f"**Final Answer:** {problem.solution.final_answer}")
+        # Classification and solution are only computed on request, per problem
+        if (problem.classification is None or problem.solution is None) and st.button(
+            "Classify and solve", key=f"solve_problem_{problem.index}"
+        ):
+            with st.spinner("Solving..."):
+                try:
+                    st.session_state.problems[problem.index] = complete_result(problem, ["classification", "solution"])
+                    update_history(problem.index)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Error solving problem {problem.index + 1}: {str(e)}")
+
 if st.session_state.parsed_text or st.session_state.latex_code:
-    results_tab1, results_tab2, results_tab3 = st.tabs(["LaTeX Output", "Math Classification", "Step-by-Step Solution"])
+    # Tabs track which one is open, so a stage is only computed once its tab is shown
+    results_tab1, results_tab2, results_tab3 = st.tabs(
+        ["LaTeX Output", "Math Classification", "Step-by-Step Solution"], key="result_tab", on_change="rerun"
+    )
     
     # Tab 1: LaTeX Output
     with results_tab1:
@@ -262,6 +563,8 @@ if st.session_state.parsed_text or st.session_state.latex_code:
     
     # Tab 2: Math Classification
     with results_tab2:
+        if results_tab2.open:
+            ensure_stage("classification", "retry_classification")
         if st.session_state.math_classification:
             st.subheader("Mathematical Classification")
             
@@ -282,6 +585,8 @@ if st.session_state.parsed_text or st.session_state.latex_code:
     
     # Tab 3: Step-by-Step Solution
     with results_tab3:
+        if results_tab3.open:
+            ensure_stage("solution", "retry_solution")
         if st.session_state.math_solution:
             st.subheader("Solution Approach")
             
@@ -295,4 +600,21 @@ if st.session_state.parsed_text or st.session_state.latex_code:
             st.markdown("### Explanation:")
             st.markdown(st.session_state.math_solution.explanation)
         else:
-            st.info("No solution data available yet. Process a mathematical problem to see step-by-step solutions.")
\ No newline at end of file
+            st.info("No solution data available yet. Process a mathematical problem to see step-by-step solutions.")
+
+# Script run time: the first run in this process includes the imports and agent setup
+run_seconds = time.perf_counter() - script_started
+times = run_times()
+if times["cold_start"] is None:
+    times["cold_start"] = run_seconds
+    run_kind = "cold_start"
+else:
+    times["last_rerun"] = run_seconds
+    times["reruns"] += 1
+    run_kind = "rerun"
+metrics.registry.set_gauge("agentex_app_run_seconds", {"kind": run_kind}, run_seconds)
+metrics.log_event("app_run", kind=run_kind, seconds=round(run_seconds, 4))
+st.sidebar.caption(
+    f"App: cold start {times['cold_start']:.2f}s"
+    + (f", last rerun {times['last_rerun']:.2f}s ({times['reruns']} reruns)" if times["reruns"] else "")
+)
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from main import text_pipeline, result_cache
+import vision
+import fastpath
+import katex
+import metrics
+import scheduler
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+PAYLOAD_KEYS = ("image_url", "image_path", "text")
+
+
+def iter_inputs(source):
+    """Lazily yield work items from a folder of images or a JSONL manifest.
+
+    Manifest lines are objects with an optional ``id`` and one of ``image_url``,
+    ``image_path`` or ``text``. Folder items use their relative path as id. A line
+    that is not such an object becomes an item with an ``error`` naming the line,
+    so one bad line fails on its own instead of stopping every run over the manifest.
+    """
+    source = Path(source)
+    if source.is_dir():
+        for path in sorted(source.rglob("*")):
+            if path.suffix.lower() in IMAGE_EXTENSIONS:
+                yield {"id": str(path.relative_to(source)), "image_path": str(path)}
+        return
+
+    with open(source, encoding="utf-8") as manifest:
+        for line_number, line in enumerate(manifest, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {"id": f"line-{line_number}", "error": f"Line {line_number} is not valid JSON: {e}"}
+                continue
+            if not isinstance(item, dict):
+                yield {"id": f"line-{line_number}", "error": f"Line {line_number} is not a JSON object"}
+                continue
+            item["id"] = str(item.get("id", f"line-{line_number}"))
+            if not any(key in item for key in PAYLOAD_KEYS):
+                item["error"] = f"Line {line_number} needs one of 'image_url', 'image_path' or 'text'"
+            yield item
+
+
+def load_checkpoint(path):
+    """Return the ids of items already finished by a previous run"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as checkpoint:
+        return {line.rstrip("\n") for line in checkpoint if line.strip()}
+
+
+async def item_text(item):
+    """Resolve a work item to the text the agents consume, calling the Vision API if needed.
+
+    Returns (text, PreprocessedImage or None).
+    """
+    if "text" in item:
+        return item["text"], None
+    if "image_path" in item:
+        return await vision.parse_image_bytes(Path(item["image_path"]).read_bytes(), result_cache)
+    if "image_url" in item:
+        return await vision.parse_image_url(item["image_url"], result_cache)
+    raise ValueError("Item needs one of 'text', 'image_path' or 'image_url'")
+
+
+async def process_item(item, queue_wait=0.0, fused=False):
+    if "error" in item:
+        return {"id": item["id"], "errors": {"manifest": item["error"]}}
+    with metrics.request(item["id"], queue_wait) as request:
+        try:
+            text, prepared = await item_text(item)
+        except Exception as e:
+            return {"id": item["id"], "errors": {"vision": str(e)}}
+        result = await text_pipeline.run(text, fused=item.get("fused", fused))
+    record = {"id": item["id"], **result.model_dump()}
+    if prepared:
+        record["image_bytes"] = {"before": prepared.bytes_before, "after": prepared.bytes_after}
+    summary = request.summary()
+    record["usage"] = {key: summary[key] for key in ("input_tokens", "output_tokens", "cost_usd")}
+    return record
+
+
+async def run_batch(source, output_path, concurrency=8, checkpoint_path=None, fused=False):
+    """Process every input with at most ``concurrency`` items in flight.
+
+    Each result is appended to ``output_path`` as one JSONL line as soon as it
+    completes. Ids of items that finished without errors are appended to the
+    checkpoint file, so an interrupted run skips them when restarted; failed
+    items are retried. ``fused`` runs the text stages as one call unless an item
+    sets its own ``"fused"`` field. Model calls use the scheduler's batch lane, so
+    interactive requests go first.
+    """
+    with scheduler.lane("batch"):
+        return await _run_batch(source, output_path, concurrency, checkpoint_path, fused)
+
+
+async def _run_batch(source, output_path, concurrency, checkpoint_path, fused):
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+    done = load_checkpoint(checkpoint_path)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"processed": 0, "failed": 0, "skipped": 0}
+
+    with open(output_path, "a", encoding="utf-8") as output, open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+
+        async def worker():
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                item, enqueued_at = entry
+                record = await process_item(item, time.perf_counter() - enqueued_at, fused)
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                if record["errors"]:
+                    counts["failed"] += 1
+                else:
+                    checkpoint.write(item["id"] + "\n")
+                    checkpoint.flush()
+                counts["processed"] += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+
+        # Feed the bounded queue as workers drain it, so huge inputs are never fully loaded
+        for item in iter_inputs(source):
+            if item["id"] in done:
+                counts["skipped"] += 1
+                continue
+            await queue.put((item, time.perf_counter()))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a folder of images or a JSONL manifest to LaTeX in bulk.")
+    parser.add_argument("source", help="Folder of images, or JSONL manifest with image_url/image_path/text per line")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Maximum items processed at once")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--fused", action="store_true", help="Fill LaTeX, classification and solution with one call")
+    args = parser.parse_args()
+
+    counts = asyncio.run(run_batch(args.source, args.output, args.concurrency, args.checkpoint, args.fused))
+    print(
+        f"Processed {counts['processed']} items ({counts['failed']} failed), "
+        f"skipped {counts['skipped']} already finished"
+    )
+    print(f"LaTeX fast path served {fastpath.served_fraction():.0%} of LaTeX requests")
+    print(
+        f"KaTeX validation: {katex.stats['passed']} passed, {katex.stats['repaired']} repaired, "
+        f"{katex.stats['failed']} failed"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+from main import text_pipeline, result_cache
+from batch import iter_inputs
+from clients import get_async_client
+import direct
+import fastpath
+import katex
+import metrics
+from models import ImageParser, PipelineResult
+import vision
+
+# Offline mode for large back-catalog conversions through the OpenAI Batch API: inputs
+# are compiled into JSONL request files, submitted, and the result files are ingested
+# back into models.py objects. Batch requests cost half as much and have no latency
+# requirement, at the price of finishing within the completion window (up to 24h).
+#
+# Stages are chained across batches: the vision requests of image items go first, and
+# their texts feed the LaTeX, classification and solution requests of the second batch.
+# Text stages use the structured-output requests of direct.py, since the Batch API
+# cannot run an agent's tool loop. Everything lives in a work directory, so a job can
+# be started and then advanced by later runs (e.g. nightly with --no-wait):
+#
+#   state.json                      submitted batches and their status per phase
+#   items.jsonl                     every input item with its text, or its pending vision key
+#   <phase>.requests.jsonl          request lines, custom_id "<item id>#<stage>"
+#   <phase>.<n>.output.jsonl        downloaded result (and .errors.jsonl) files
+#   texts.jsonl, text.cached.jsonl  phase 2 inputs, and stage outputs that needed no request
+
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+BATCH_DISCOUNT = 0.5  # Batch API price relative to synchronous requests
+POLL_INTERVAL = float(os.getenv("AGENTEX_BATCH_POLL_INTERVAL", "60"))
+# Batch API limits per input file
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class DuplicateItemIds(ValueError):
+    pass
+
+
+def check_unique_ids(source):
+    """Raise DuplicateItemIds if two inputs share an id: results are matched back by custom_id"""
+    seen, duplicates = set(), []
+    for item in iter_inputs(source):
+        if item["id"] in seen and item["id"] not in duplicates:
+            duplicates.append(item["id"])
+        seen.add(item["id"])
+    if duplicates:
+        shown = ", ".join(repr(item_id) for item_id in duplicates[:10])
+        more = f" and {len(duplicates) - 10} more" if len(duplicates) > 10 else ""
+        raise DuplicateItemIds(f"Item ids must be unique in {source}; duplicated: {shown}{more}")
+
+
+def custom_id(item_id, stage):
+    return f"{item_id}#{stage}"
+
+
+def split_custom_id(value):
+    item_id, _, stage = value.rpartition("#")
+    return item_id, stage
+
+
+def request_line(item_id, stage, body):
+    return {"custom_id": custom_id(item_id, stage), "method": "POST", "url": ENDPOINT, "body": body}
+
+
+def stage_body(stage, text):
+    """Structured-output request for a text stage, as direct.run would send it"""
+    agent = text_pipeline.agents[stage]
+    return {
+        "model": agent.model,
+        "messages": direct.build_messages(agent, text),
+        "response_format": direct.response_format(agent.output_type),
+    }
+
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as lines:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_result_line(line):
+    """(item id, stage, model, content, usage, error) of one Batch API output or error line"""
+    item_id, stage = split_custom_id(line["custom_id"])
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    usage = body.get("usage") or {}
+    model = body.get("model")
+    if line.get("error") or response.get("status_code") != 200:
+        error = line.get("error") or body.get("error") or {}
+        return item_id, stage, model, None, usage, error.get("message") or f"status {response.get('status_code')}"
+    message = body["choices"][0]["message"]
+    if message.get("refusal"):
+        return item_id, stage, model, None, usage, f"Model refused: {message['refusal']}"
+    return item_id, stage, model, message.get("content") or "", usage, None
+
+
+class BatchJob:
+    """A resumable chain of Batch API jobs (vision, then text stages) kept in ``workdir``.
+
+    ``state.json`` records the batches submitted for each phase, so running the job
+    again resumes polling where it stopped instead of submitting the requests twice.
+    """
+
+    def __init__(self, workdir, stages=None, poll_interval=POLL_INTERVAL):
+        self.workdir = Path(workdir)
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        self.stages = text_pipeline.resolve_stages(stages)
+        self.poll_interval = poll_interval
+        self.state = json.loads(self.path("state.json").read_text()) if self.path("state.json").exists() else {}
+        self.state.setdefault("phases", {})
+
+    def path(self, name):
+        return self.workdir / name
+
+    def save(self):
+        temporary = self.path("state.json.tmp")
+        temporary.write_text(json.dumps(self.state, indent=2))
+        temporary.replace(self.path("state.json"))
+
+    async def run(self, source, output_path, wait=True):
+        """Advance the job as far as possible; returns the counts once done, else None"""
+        if self.state.get("done"):
+            return self.state["counts"]
+        for phase, compile_phase in (("vision", lambda: self.compile_vision(source)), ("text", self.compile_text)):
+            if phase not in self.state["phases"]:
+                await compile_phase()
+                self.state["phases"][phase] = {"batches": [], "submitted": False}
+                self.save()
+            if not self.state["phases"][phase]["submitted"]:
+                await self.submit(phase)
+            if not await self.finish(phase, wait):
+                return None
+        counts = await self.ingest(output_path)
+        self.state.update(done=True, counts=counts)
+        self.save()
+        return counts
+
+    async def compile_vision(self, source):
+        """Write items.jsonl and the vision requests of images without a cached parse"""
+        check_unique_ids(source)
+        with open(self.path("items.jsonl"), "w", encoding="utf-8") as items, \
+                open(self.path("vision.requests.jsonl"), "w", encoding="utf-8") as requests:
+            for item in iter_inputs(source):
+                row = {"id": item["id"]}
+                try:
+                    if "error" in item:
+                        raise ValueError(item["error"])
+                    if "text" in item:
+                        row["text"] = item["text"]
+                    else:
+                        if "image_path" in item:
+                            prepared = vision.prepare_image_bytes(Path(item["image_path"]).read_bytes())
+                        elif "image_url" in item:
+                            prepared = vision.prepare_image_url(item["image_url"])
+                        else:
+                            raise ValueError("Item needs one of 'text', 'image_path' or 'image_url'")
+                        image_url, cache_payload, _ = await prepared
+                        key, cached = vision.cached_vision(cache_payload, result_cache)
+                        if cached is not None:
+                            row["text"] = cached.text
+                        else:
+                            row["vision_key"] = key
+                            requests.write(json.dumps(request_line(item["id"], "vision", vision.request_body(image_url))) + "\n")
+                except Exception as e:
+                    row["error"] = str(e) or type(e).__name__
+                items.write(json.dumps(row) + "\n")
+
+    async def compile_text(self):
+        """Collect every item's text (from the input or the vision batch) and write the stage requests"""
+        parsed = {}
+        for line in self.result_lines("vision"):
+            item_id, _, _, content, _, error = parse_result_line(line)
+            parsed[item_id] = (content, error)
+
+        with open(self.path("texts.jsonl"), "w", encoding="utf-8") as texts, \
+                open(self.path("text.cached.jsonl"), "w", encoding="utf-8") as cached_outputs, \
+                open(self.path("text.requests.jsonl"), "w", encoding="utf-8") as requests:
+            for row in read_jsonl(self.path("items.jsonl")):
+                if "vision_key" in row:
+                    content, error = parsed.get(row["id"], (None, self.missing_reason("vision")))
+                    if error is None and content.strip():
+                        row["text"] = content
+                        result_cache.set(row["vision_key"], ImageParser(is_valid=True, text=content))
+                    else:
+                        row["error"] = error or "empty vision response"
+                texts.write(json.dumps({key: row[key] for key in ("id", "text", "error") if key in row}) + "\n")
+                if "text" not in row:
+                    continue
+
+                for stage in self.stages:
+                    output = result_cache.get(text_pipeline.cache_key(stage, row["text"], "direct"))
+                    if output is None and stage == "latex" and text_pipeline.fast_path:
+                        output = fastpath.try_convert(row["text"])
+                    if output is not None:
+                        cached_outputs.write(json.dumps({"id": row["id"], "stage": stage, "output": output.model_dump()}) + "\n")
+                    else:
+                        requests.write(json.dumps(request_line(row["id"], stage, stage_body(stage, row["text"]))) + "\n")
+
+    async def submit(self, phase):
+        """Upload ``<phase>.requests.jsonl`` in files within the Batch API limits and start a batch for each.
+
+        State is saved after every batch, so resuming an interrupted submission skips
+        the files that were already sent.
+        """
+        client = get_async_client()
+        entry = self.state["phases"][phase]
+        for index, content in enumerate(self.chunks(self.path(f"{phase}.requests.jsonl"))):
+            if index < len(entry["batches"]):
+                continue
+            upload = await client.files.create(file=(f"{phase}.{index}.jsonl", content), purpose="batch")
+            batch = await client.batches.create(
+                input_file_id=upload.id,
+                endpoint=ENDPOINT,
+                completion_window=COMPLETION_WINDOW,
+                metadata={"job": self.workdir.name, "phase": phase},
+            )
+            entry["batches"].append(
+                {"id": batch.id, "input_file_id": upload.id, "status": batch.status, "downloaded": False}
+            )
+            self.save()
+        entry["submitted"] = True
+        self.save()
+
+    @staticmethod
+    def chunks(path):
+        """Request file contents split at MAX_BATCH_REQUESTS lines or MAX_BATCH_BYTES"""
+        lines, size = [], 0
+        with open(path, "rb") as requests:
+            for line in requests:
+                if lines and (len(lines) >= MAX_BATCH_REQUESTS or size + len(line) > MAX_BATCH_BYTES):
+                    yield b"".join(lines)
+                    lines, size = [], 0
+                lines.append(line)
+                size += len(line)
+        if lines:
+            yield b"".join(lines)
+
+    async def finish(self, phase, wait=True):
+        """Poll the phase's batches and download their results; False if still running and not waiting"""
+        client = get_async_client()
+        for index, entry in enumerate(self.state["phases"][phase]["batches"]):
+            # A batch can be final as soon as it is created (e.g. failed validation), so
+            # downloading is tracked separately from the status
+            while not entry.get("downloaded"):
+                batch = await client.batches.retrieve(entry["id"])
+                if batch.status in FINAL_STATUSES:
+                    for kind, file_id in (("output", batch.output_file_id), ("errors", batch.error_file_id)):
+                        if file_id:
+                            content = await client.files.content(file_id)
+                            self.path(f"{phase}.{index}.{kind}.jsonl").write_bytes(content.content)
+                    entry.update(status=batch.status, downloaded=True)
+                    self.save()
+                elif not wait:
+                    return False
+                else:
+                    await asyncio.sleep(self.poll_interval)
+        return True
+
+    def result_lines(self, phase):
+        for index in range(len(self.state["phases"][phase]["batches"])):
+            for kind in ("output", "errors"):
+                yield from read_jsonl(self.path(f"{phase}.{index}.{kind}.jsonl"))
+
+    def missing_reason(self, phase):
+        statuses = {entry["status"] for entry in self.state["phases"][phase]["batches"]} - {"completed"}
+        return f"no result (batch {', '.join(sorted(statuses))})" if statuses else "no result in the batch output"
+
+    async def ingest(self, output_path):
+        """Turn the result files into PipelineResults and write one JSONL record per item"""
+        results, usage = {}, {}
+        for row in read_jsonl(self.path("texts.jsonl")):
+            results[row["id"]] = PipelineResult(text=row.get("text", ""))
+            if "error" in row:
+                results[row["id"]].errors["vision"] = row["error"]
+            usage[row["id"]] = {"input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+
+        for row in read_jsonl(self.path("text.cached.jsonl")):
+            output_type = text_pipeline.agents[row["stage"]].output_type
+            setattr(results[row["id"]], row["stage"], output_type.model_validate(row["output"]))
+
+        for phase in ("vision", "text"):
+            for line in self.result_lines(phase):
+                item_id, stage, model, content, tokens, error = parse_result_line(line)
+                item_usage = usage[item_id]
+                item_usage["input_tokens"] += tokens.get("prompt_tokens", 0)
+                item_usage["output_tokens"] += tokens.get("completion_tokens", 0)
+                item_usage["cost_usd"] += BATCH_DISCOUNT * metrics.estimate_cost(
+                    model, tokens.get("prompt_tokens", 0), tokens.get("completion_tokens", 0)
+                )
+                if phase == "text":
+                    await self.ingest_stage(results[item_id], stage, content, error)
+
+        requested = {(item_id, stage) for item_id, stage in map(split_custom_id, self.requested_ids("text"))}
+        counts = {"items": len(results), "failed": 0}
+        with open(output_path, "a", encoding="utf-8") as output:
+            for item_id, result in results.items():
+                for stage in self.stages:
+                    if getattr(result, stage) is None and stage not in result.errors and (item_id, stage) in requested:
+                        result.errors[stage] = self.missing_reason("text")
+                if result.errors:
+                    counts["failed"] += 1
+                usage[item_id]["cost_usd"] = round(usage[item_id]["cost_usd"], 8)
+                output.write(json.dumps({"id": item_id, **result.model_dump(), "usage": usage[item_id]}) + "\n")
+        return counts
+
+    async def ingest_stage(self, result, stage, content, error):
+        """Validate one stage response into its models.py type and cache it like a direct-mode result"""
+        if error is None:
+            try:
+                output = text_pipeline.agents[stage].output_type.model_validate_json(content)
+            except ValueError as e:
+                error = f"invalid {stage}: {e}"
+        if error is not None:
+            result.errors[stage] = error
+            return
+        if stage == "latex" and text_pipeline.validate_latex:
+            output = await katex.validate_and_repair(output)
+        result_cache.set(text_pipeline.cache_key(stage, result.text, "direct"), output)
+        setattr(result, stage, output)
+
+    def requested_ids(self, phase):
+        for line in read_jsonl(self.path(f"{phase}.requests.jsonl")):
+            yield line["custom_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert inputs to LaTeX in bulk through the OpenAI Batch API.")
+    parser.add_argument("source", help="Folder of images, or JSONL manifest with image_url/image_path/text per line")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("-w", "--workdir", default="batch_job", help="Directory holding the job's files and state")
+    parser.add_argument(
+        "--stages", type=lambda value: value.split(","), default=None,
+        help="Comma-separated text stages to request (default: latex,classification,solution)",
+    )
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="Seconds between status checks")
+    parser.add_argument(
+        "--no-wait", action="store_true",
+        help="Submit or check the current phase and exit; run again later to continue",
+    )
+    args = parser.parse_args()
+    try:
+        job = BatchJob(args.workdir, args.stages, args.poll_interval)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        counts = asyncio.run(job.run(args.source, args.output, wait=not args.no_wait))
+    except DuplicateItemIds as e:
+        parser.error(str(e))
+    if counts is None:
+        phase = next(phase for phase in ("text", "vision") if phase in job.state["phases"])
+        print(f"Waiting for the {phase} batch; run the same command again later to continue")
+    else:
+        print(f"Wrote {counts['items']} items to {args.output} ({counts['failed']} with errors)")
+
+
+if __name__ == "__main__":
+    main()
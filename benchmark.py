@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+# End-to-end benchmark against the local fake API (fake_openai.py), runnable offline:
+#
+#     python benchmark.py --latency 0.2 --token-delay 0.005 --requests 50 --concurrency 1,4,16
+#
+# Reports per-stage and end-to-end latency percentiles, throughput per concurrency
+# level and peak memory for single, concurrent and batch workloads, and compares the
+# API calls, tokens and latency of the agent, direct and fused execution modes. The backend must
+# be chosen before the app modules are imported, so they are imported in main().
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    if not values:
+        return {}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p90": percentile(values, 0.90),
+        "p99": percentile(values, 0.99),
+        "mean": sum(values) / len(values),
+    }
+
+
+def sample_image():
+    """A small worksheet-like PNG so the vision stage has real bytes to preprocess"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (1200, 900), "white")
+    draw = ImageDraw.Draw(image)
+    for row in range(6):
+        draw.text((100, 100 + row * 120), f"{row + 1}) x^2 + {row + 2}x - 4 = 0", fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class Workloads:
+    def __init__(self, pipeline, vision, cache, image_bytes, image_parser=None):
+        self.pipeline = pipeline
+        self.vision = vision
+        self.cache = cache
+        self.image_bytes = image_bytes
+        self.image_parser = image_parser
+
+    async def request(self, index, samples):
+        """One image through vision and all text stages, recording per-stage latency"""
+        started = time.perf_counter()
+        text, _ = await self.vision.parse_image_bytes(self.image_bytes, self.cache)
+        samples.setdefault("vision", []).append(time.perf_counter() - started)
+
+        result = await self.pipeline.run(f"{text} (request {index})")
+        for stage, seconds in result.timings.items():
+            samples.setdefault(stage, []).append(seconds)
+        samples.setdefault("end_to_end", []).append(time.perf_counter() - started)
+        if result.errors:
+            samples.setdefault("errors", []).append(1)
+
+    async def mode_request(self, index, samples, mode):
+        """The CLI flow (image parser, then the text stages) with every stage in ``mode``.
+
+        ``fused`` parses the image directly and fills the text stages with one call.
+        """
+        from agents import Runner
+        import direct
+        from clients import agent_run_config
+
+        started = time.perf_counter()
+        image_url, _, _ = await self.vision.prepare_image_bytes(self.image_bytes)
+        if mode in ("direct", "fused"):
+            parsed = await direct.run(self.image_parser, direct.image_content(image_url), "image_parser")
+        else:
+            parsed = (await Runner.run(self.image_parser, image_url, run_config=agent_run_config())).final_output
+        samples.setdefault("image_parser", []).append(time.perf_counter() - started)
+
+        modes = {stage: "agent" if mode == "fused" else mode for stage in self.pipeline.agents}
+        result = await self.pipeline.run(f"{parsed.text} (request {index})", modes=modes, fused=mode == "fused")
+        for stage, seconds in result.timings.items():
+            samples.setdefault(stage, []).append(seconds)
+        samples.setdefault("end_to_end", []).append(time.perf_counter() - started)
+        if result.errors:
+            samples.setdefault("errors", []).append(1)
+
+    async def run(self, requests, concurrency, mode=None):
+        samples = {}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(index):
+            async with semaphore:
+                if mode is None:
+                    await self.request(index, samples)
+                else:
+                    await self.mode_request(index, samples, mode)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(index) for index in range(requests)))
+        elapsed = time.perf_counter() - started
+        return samples, elapsed
+
+
+def measure(function):
+    """Run ``function``; returns (its result, wall seconds, peak traced bytes)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    outcome = function()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return outcome, elapsed, peak
+
+
+def report_row(name, samples, elapsed, requests, peak):
+    row = {
+        "workload": name,
+        "requests": requests,
+        "elapsed_s": elapsed,
+        "throughput_rps": requests / elapsed if elapsed else 0.0,
+        "peak_traced_memory_mb": peak / 2**20,
+        "errors": len(samples.get("errors", [])),
+        "latency_s": {stage: summarize(values) for stage, values in samples.items() if stage != "errors"},
+    }
+    print(f"\n== {name}: {requests} requests in {elapsed:.2f}s "
+          f"({row['throughput_rps']:.2f} req/s, peak {row['peak_traced_memory_mb']:.1f} MB, {row['errors']} errors)")
+    for stage, stats in row["latency_s"].items():
+        if stats:
+            print(f"   {stage:<15} p50 {stats['p50'] * 1000:8.1f} ms   p90 {stats['p90'] * 1000:8.1f} ms   "
+                  f"p99 {stats['p99'] * 1000:8.1f} ms")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark on the local fake OpenAI API.")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per workload")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake API latency per call (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--cassette", help="Replay recorded responses from this JSONL cassette")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--modes", default="agent,direct,fused", help="Execution modes to compare (empty to skip)")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    import fake_openai
+
+    server = fake_openai.start_server(fake_openai.FakeServerConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        cassette=args.cassette,
+        seed=args.seed,
+    ))
+    os.environ["AGENTEX_BACKEND"] = "local"
+    os.environ["AGENTEX_LOCAL_URL"] = server.base_url
+    os.environ["AGENTEX_CACHE_PATH"] = ""  # never read or pollute the on-disk result cache
+
+    import batch
+    import main as app_main
+    import metrics
+    import vision
+    from cache import ResultCache
+    from pipeline import TextPipeline
+
+    # Caches and the local LaTeX fast path would hide the model calls being measured
+    pipeline = TextPipeline(
+        app_main.latex_generator_agent,
+        app_main.math_classifier_agent,
+        app_main.solution_generator_agent,
+        fast_path=False,
+    )
+    workloads = Workloads(
+        pipeline, vision, ResultCache(path=None, max_entries=0), sample_image(), app_main.image_parser_agent
+    )
+    report = {"config": vars(args), "workloads": []}
+
+    (samples, elapsed), _, peak = measure(lambda: asyncio.run(workloads.run(args.requests, 1)))
+    report["workloads"].append(report_row("single (sequential)", samples, elapsed, args.requests, peak))
+
+    for level in levels:
+        (samples, elapsed), _, peak = measure(lambda: asyncio.run(workloads.run(args.requests, level)))
+        report["workloads"].append(report_row(f"concurrent x{level}", samples, elapsed, args.requests, peak))
+
+    for mode in filter(None, args.modes.split(",")):
+        calls_before = server.request_count
+        tokens_before = metrics.registry.total("agentex_input_tokens_total")
+        (samples, elapsed), _, peak = measure(lambda: asyncio.run(workloads.run(args.requests, 1, mode)))
+        row = report_row(f"{mode} mode (sequential)", samples, elapsed, args.requests, peak)
+        row["api_calls_per_request"] = (server.request_count - calls_before) / args.requests
+        row["input_tokens_per_request"] = (metrics.registry.total("agentex_input_tokens_total") - tokens_before) / args.requests
+        print(f"   API calls per request: {row['api_calls_per_request']:.1f}, "
+              f"input tokens per request: {row['input_tokens_per_request']:.0f}")
+        report["workloads"].append(row)
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = os.path.join(directory, "manifest.jsonl")
+        with open(manifest, "w", encoding="utf-8") as handle:
+            for index in range(args.requests):
+                handle.write(json.dumps({"id": str(index), "text": f"Solve batch problem {index}: x^2 + 3x - 4 = 0"}) + "\n")
+        output = os.path.join(directory, "results.jsonl")
+        counts, elapsed, peak = measure(
+            lambda: asyncio.run(batch.run_batch(manifest, output, concurrency=max(levels)))
+        )
+        row = report_row(f"batch x{max(levels)}", {}, elapsed, args.requests, peak)
+        row["errors"] = counts["failed"]
+        report["workloads"].append(row)
+
+    report["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\nMax RSS: {report['max_rss_mb']:.1f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from models import ImageParser, LatexOutput, MathClassification, MathSolution
+import similarity
+
+# Result types that may be stored in the cache, looked up by class name on read
+CACHEABLE_MODELS = {
+    model.__name__: model
+    for model in (ImageParser, LatexOutput, MathClassification, MathSolution)
+}
+
+DEFAULT_CACHE_PATH = os.getenv("AGENTEX_CACHE_PATH", ".agentex_cache.sqlite3")
+
+
+def normalize_text(text):
+    """Canonicalize text so retyped inputs (spacing, Unicode symbols) share a cache entry"""
+    return similarity.canonical_text(text)
+
+
+def prompt_version(prompt):
+    """Short content hash of a prompt, so editing a prompt invalidates its entries"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def make_key(stage, payload, model, version):
+    """Content-addressed key for a stage result.
+
+    ``payload`` is either raw image bytes or input text; text is normalized first.
+    """
+    if isinstance(payload, str):
+        payload = normalize_text(payload).encode("utf-8")
+    digest = hashlib.sha256(payload).hexdigest()
+    return f"{stage}:{model}:{version}:{digest}"
+
+
+class ResultCache:
+    """Two-tier cache for model outputs: an in-memory LRU in front of a SQLite store.
+
+    The memory tier evicts by entry count and TTL; the SQLite tier survives process
+    restarts (e.g. Streamlit reloads) and is pruned of expired rows on open.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (expires_at, model)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0}
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+            # Left behind by the removed image near-duplicate index
+            self._db.execute("DROP TABLE IF EXISTS image_fingerprints")
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self._memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT kind, value, expires_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[2] >= now and row[0] in CACHEABLE_MODELS:
+                    value = CACHEABLE_MODELS[row[0]].model_validate_json(row[1])
+                    self._remember(key, row[2], value)
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    return value
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        kind = type(value).__name__
+        if kind not in CACHEABLE_MODELS:
+            raise TypeError(f"Cannot cache values of type {kind}")
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, kind, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, kind, value.model_dump_json(), expires_at),
+                )
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import weakref
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+from agents import RunConfig, OpenAIProvider, set_tracing_disabled
+import metrics
+import scheduler
+
+load_dotenv()
+
+# "openai" talks to the real API; "local" targets a fake_openai.py server so the
+# agents, tools and vision calls run offline (benchmarks, CI)
+BACKEND = os.getenv("AGENTEX_BACKEND", "openai")
+LOCAL_BASE_URL = os.getenv("AGENTEX_LOCAL_URL", "http://127.0.0.1:8765/v1")
+
+if BACKEND == "local":
+    # Trace export would try to reach the real API
+    set_tracing_disabled(True)
+
+# Connection pool and timeout settings, tunable through the environment
+MAX_CONNECTIONS = int(os.getenv("AGENTEX_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AGENTEX_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("AGENTEX_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.getenv("AGENTEX_CONNECT_TIMEOUT", "10"))
+REQUEST_TIMEOUT = float(os.getenv("AGENTEX_REQUEST_TIMEOUT", "120"))
+# SDK retries per request (backoff with jitter, honoring Retry-After); the scheduler
+# additionally pauses every call after a 429
+MAX_RETRIES = int(os.getenv("AGENTEX_MAX_RETRIES", "4"))
+
+# One client per event loop: pooled connections cannot be shared across loops
+_clients = weakref.WeakKeyDictionary()
+
+
+def _build_client():
+    local = BACKEND == "local"
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY") or ("local" if local else None),
+        base_url=LOCAL_BASE_URL if local else None,
+        timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+        max_retries=MAX_RETRIES,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            # Rate-limit gate and priority lanes (scheduler.py); counts SDK retries
+            # against the model call being measured
+            event_hooks={
+                "request": [scheduler.on_request, metrics.on_http_request],
+                "response": [scheduler.on_response],
+            },
+        ),
+    )
+
+
+def get_async_client():
+    """Return the shared AsyncOpenAI client for the running event loop.
+
+    Every tool, agent run and vision call in the same loop reuses one connection
+    pool, so keep-alive connections and TLS sessions survive between calls.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = _build_client()
+    return client
+
+
+def agent_run_config():
+    """RunConfig that makes Runner.run use the shared client instead of building its own.
+
+    The local backend only emulates Chat Completions, so agents use that API there.
+    """
+    return RunConfig(
+        model_provider=OpenAIProvider(openai_client=get_async_client(), use_responses=BACKEND != "local")
+    )
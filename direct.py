@@ -0,0 +1,65 @@
+from agents import AgentOutputSchema
+from clients import get_async_client
+import metrics
+
+# "Direct" execution mode: one structured-output Chat Completions call per stage,
+# using the agent's instructions, model and output type. It replaces the agent turn,
+# the tool call and the tool's own model call with a single request whose JSON is
+# validated against the pydantic model in models.py.
+
+MODES = ("agent", "direct")
+
+
+def response_format(output_type):
+    """Strict json_schema response format for a pydantic output type"""
+    schema = AgentOutputSchema(output_type)
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.name(), "schema": schema.json_schema(), "strict": True},
+    }
+
+
+def build_messages(agent, content):
+    """System prompt from the agent plus the user input (text, or content parts for images)"""
+    return [
+        {"role": "system", "content": agent.instructions},
+        {"role": "user", "content": content},
+    ]
+
+
+def image_content(image_url):
+    return [{"type": "image_url", "image_url": {"url": image_url}}]
+
+
+async def run(agent, content, stage=None):
+    """Fill ``agent.output_type`` with one structured-output call; raises if it does not validate"""
+    async with metrics.instrument(stage or agent.name, agent.model) as call:
+        response = await get_async_client().chat.completions.create(
+            model=agent.model,
+            messages=build_messages(agent, content),
+            response_format=response_format(agent.output_type),
+        )
+        call.add_usage(response.usage)
+    message = response.choices[0].message
+    if getattr(message, "refusal", None):
+        raise ValueError(f"Model refused: {message.refusal}")
+    return agent.output_type.model_validate_json(message.content or "")
+
+
+async def stream(agent, content, stage=None):
+    """Streaming ``run``: yields the JSON text deltas, then the validated output as the last item"""
+    async with metrics.instrument(stage or agent.name, agent.model) as call:
+        response = await get_async_client().chat.completions.create(
+            model=agent.model,
+            messages=build_messages(agent, content),
+            response_format=response_format(agent.output_type),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        parts = []
+        async for chunk in response:
+            call.add_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    yield agent.output_type.model_validate_json("".join(parts))
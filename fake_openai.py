@@ -0,0 +1,511 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from pydantic import BaseModel
+
+# Local stand-in for the OpenAI HTTP API, so the agents, tools and vision calls can
+# run offline (benchmarks, CI). Point clients at it with AGENTEX_BACKEND=local.
+# Responses are synthesized from the request (tool calls for agents with tools,
+# schema-conforming JSON for structured outputs), replayed from a cassette of
+# recorded responses, or recorded from a real upstream API into that cassette. The Files
+# and Batches endpoints are emulated too: a batch answers each JSONL request line like
+# the synchronous endpoint would and completes ``batch_delay`` seconds after creation.
+
+FAKE_VISION_TEXT = (
+    "The image shows a single equation: x squared plus three x minus four equals zero. "
+    "The task is to solve the quadratic equation for x."
+)
+FAKE_JSON_OBJECT = {
+    "math_type": "algebra",
+    "difficulty_level": "easy",
+    "concepts": ["quadratic equations", "factoring"],
+    "description": "A quadratic equation to be solved for x.",
+    "solution_steps": [
+        "Factor the quadratic: (x + 4)(x - 1) = 0.",
+        "Set each factor to zero: x + 4 = 0 or x - 1 = 0.",
+        "Solve each equation: x = -4 or x = 1.",
+    ],
+    "final_answer": "x = -4 or x = 1",
+    "explanation": "The quadratic factors over the integers, so each root comes from one factor.",
+}
+FAKE_STRING_FIELDS = {"latex_code": "x^{2} + 3x - 4 = 0", "text": FAKE_VISION_TEXT}
+
+
+class FakeServerConfig(BaseModel):
+    latency: float = 0.0  # seconds added before every response
+    jitter: float = 0.0  # uniform +/- seconds around latency
+    token_delay: float = 0.0  # seconds between streamed chunks
+    error_rate: float = 0.0  # fraction of requests answered with 429/500
+    retry_after: float = 0.1  # Retry-After seconds sent with injected 429s
+    cassette: str | None = None  # JSONL of recorded responses to replay
+    record: bool = False  # proxy to upstream and append responses to the cassette
+    upstream: str = "https://api.openai.com"
+    upstream_api_key: str | None = None
+    seed: int | None = None
+    batch_delay: float = 0.0  # seconds until a created batch reports "completed"
+
+
+def request_key(path, body):
+    """Stable cassette key for a request: path plus canonical JSON body"""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{path}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(value):
+    return max(1, len(json.dumps(value) if not isinstance(value, str) else value) // 4)
+
+
+def synthesize(schema, defs=None, name=None, text=None):
+    """Build a value that conforms to a JSON schema, using canned content where it helps"""
+    defs = defs or schema.get("$defs", {})
+    if "$ref" in schema:
+        return synthesize(defs[schema["$ref"].split("/")[-1]], defs, name, text)
+    if "anyOf" in schema:
+        return synthesize(schema["anyOf"][0], defs, name, text)
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        return {key: synthesize(value, defs, key, text) for key, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        canned = FAKE_JSON_OBJECT.get(name)
+        if isinstance(canned, list):
+            return canned
+        return [synthesize(schema.get("items", {}), defs, name, text) for _ in range(3)]
+    if kind == "boolean":
+        return True
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "string":
+        if name in FAKE_STRING_FIELDS:
+            return FAKE_STRING_FIELDS[name]
+        if isinstance(FAKE_JSON_OBJECT.get(name), str):
+            return FAKE_JSON_OBJECT[name]
+        return text if text is not None else f"fake {name or 'value'}"
+    return None
+
+
+def message_text(message):
+    content = message.get("content")
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def chat_reply(body):
+    """Decide what the fake model says: (content, tool_calls)"""
+    messages = body.get("messages", [])
+    user_text = next((message_text(m) for m in reversed(messages) if m.get("role") == "user"), "")
+    has_image = any(
+        isinstance(part, dict) and part.get("type") == "image_url"
+        for m in messages if isinstance(m.get("content"), list) for part in m["content"]
+    )
+
+    # Agents with tools call their first tool once before answering
+    tools = body.get("tools") or []
+    if tools and not any(m.get("role") == "tool" for m in messages):
+        function = tools[0]["function"]
+        arguments = synthesize(function.get("parameters", {}), text=user_text)
+        call = {"id": f"call_{random.getrandbits(48):x}", "type": "function",
+                "function": {"name": function["name"], "arguments": json.dumps(arguments)}}
+        return None, [call]
+
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return json.dumps(synthesize(response_format["json_schema"]["schema"], text=user_text)), None
+    if response_format.get("type") == "json_object":
+        return json.dumps(FAKE_JSON_OBJECT), None
+    if has_image:
+        return FAKE_VISION_TEXT, None
+    return user_text, None
+
+
+def chat_completion(body, content, tool_calls):
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    prompt_tokens = estimate_tokens(body.get("messages", []))
+    completion_tokens = estimate_tokens(content or json.dumps(tool_calls))
+    return {
+        "id": f"chatcmpl-fake-{random.getrandbits(48):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def chat_completion_chunks(body, content, tool_calls):
+    """Chat completion as the sequence of chunks sent when stream=True"""
+    base = {
+        "id": f"chatcmpl-fake-{random.getrandbits(48):x}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+    }
+    if tool_calls:
+        deltas = [{"role": "assistant", "tool_calls": [{"index": i, **call} for i, call in enumerate(tool_calls)]}]
+    else:
+        words = (content or "").split(" ")
+        deltas = [{"role": "assistant", "content": ""}]
+        deltas += [{"content": word if i == 0 else " " + word} for i, word in enumerate(words)]
+    for delta in deltas:
+        yield {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls" if tool_calls else "stop"}]}
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield {**base, "choices": [], "usage": chat_completion(body, content, tool_calls)["usage"]}
+
+
+def batch_output_line(line, error_rate, rng):
+    """Answer one Batch API request line as an output file line"""
+    request = json.loads(line)
+    response_id = f"batch_req_fake_{rng.getrandbits(48):x}"
+    if error_rate and rng.random() < error_rate:
+        response = {"status_code": 500, "request_id": response_id,
+                    "body": {"error": {"message": "Internal error (injected)", "type": "server_error"}}}
+    elif request.get("url", "").endswith("/chat/completions"):
+        body = request.get("body", {})
+        response = {"status_code": 200, "request_id": response_id, "body": chat_completion(body, *chat_reply(body))}
+    else:
+        response = {"status_code": 404, "request_id": response_id,
+                    "body": {"error": {"message": f"Unsupported url {request.get('url')}", "type": "invalid_request_error"}}}
+    return {"id": response_id, "custom_id": request.get("custom_id"), "response": response, "error": None}
+
+
+def response_object(body):
+    """Minimal non-streaming Responses API result (used by the parse_image tool)"""
+    text = FAKE_VISION_TEXT
+    input_tokens = estimate_tokens(body.get("input", ""))
+    output_tokens = estimate_tokens(text)
+    return {
+        "id": f"resp_fake_{random.getrandbits(48):x}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "status": "completed",
+        "output": [{
+            "type": "message",
+            "id": f"msg_fake_{random.getrandbits(48):x}",
+            "status": "completed",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            if self.config.token_delay:
+                time.sleep(self.config.token_delay)
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def read_bytes(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def read_body(self):
+        return json.loads(self.read_bytes() or b"{}")
+
+    def send_not_found(self):
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].rstrip("/").split("/")
+        if len(parts) >= 4 and parts[-3] == "files" and parts[-1] == "content" and parts[-2] in self.server.files:
+            data = self.server.files[parts[-2]]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/jsonl")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif parts[-2] == "files" and parts[-1] in self.server.files:
+            self.send_json(200, self.server.file_object(parts[-1]))
+        elif parts[-2] == "batches" and parts[-1] in self.server.batches:
+            self.send_json(200, self.server.batch_object(parts[-1]))
+        else:
+            self.send_not_found()
+
+    def do_POST(self):
+        if self.path.endswith("/files"):
+            self.server.count_request()
+            self.upload_file()
+            return
+        body = self.read_body()
+        config = self.config
+        self.server.count_request()
+
+        if config.latency or config.jitter:
+            time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+
+        if config.error_rate and self.server.random.random() < config.error_rate:
+            if self.server.random.random() < 0.5:
+                self.send_json(429, {"error": {"message": "Rate limit reached (injected)", "type": "rate_limit_error"}},
+                               {"Retry-After": str(config.retry_after)})
+            else:
+                self.send_json(500, {"error": {"message": "Internal error (injected)", "type": "server_error"}})
+            return
+
+        key = request_key(self.path, body)
+        if key in self.server.cassette:
+            self.replay(self.server.cassette[key])
+        elif config.record:
+            self.record(key, body)
+        else:
+            self.synthesize(body)
+
+    def synthesize(self, body):
+        if self.path.endswith("/chat/completions"):
+            content, tool_calls = chat_reply(body)
+            if body.get("stream"):
+                self.send_stream(chat_completion_chunks(body, content, tool_calls))
+            else:
+                self.send_json(200, chat_completion(body, content, tool_calls))
+        elif self.path.endswith("/responses") and not body.get("stream"):
+            self.send_json(200, response_object(body))
+        elif self.path.endswith("/batches"):
+            self.create_batch(body)
+        else:
+            self.send_json(404, {"error": {"message": f"Unsupported path {self.path}", "type": "invalid_request_error"}})
+
+    def upload_file(self):
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("latin-1")
+        message = BytesParser(policy=HTTP).parsebytes(header + self.read_bytes())
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        if "file" not in fields:
+            self.send_json(400, {"error": {"message": "Missing file", "type": "invalid_request_error"}})
+            return
+        purpose = fields["purpose"].get_payload(decode=True).decode("utf-8").strip() if "purpose" in fields else "batch"
+        file_id = self.server.add_file(
+            fields["file"].get_payload(decode=True), fields["file"].get_filename() or "upload.jsonl", purpose
+        )
+        self.send_json(200, self.server.file_object(file_id))
+
+    def create_batch(self, body):
+        input_file = self.server.files.get(body.get("input_file_id"))
+        if input_file is None:
+            self.send_json(400, {"error": {"message": "Unknown input_file_id", "type": "invalid_request_error"}})
+            return
+        lines = [line for line in input_file["content"].decode("utf-8").splitlines() if line.strip()]
+        outputs = [batch_output_line(line, self.config.error_rate, self.server.random) for line in lines]
+        succeeded = [line for line in outputs if line["response"]["status_code"] == 200]
+        failed = [line for line in outputs if line["response"]["status_code"] != 200]
+        batch_id = f"batch_fake_{self.server.random.getrandbits(48):x}"
+
+        def to_file(lines, name):
+            content = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+            return self.server.add_file(content, name, "batch_output") if lines else None
+
+        now = int(time.time())
+        self.server.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body.get("endpoint", "/v1/chat/completions"),
+            "errors": None,
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "in_progress",
+            "output_file_id": to_file(succeeded, f"{batch_id}_output.jsonl"),
+            "error_file_id": to_file(failed, f"{batch_id}_error.jsonl"),
+            "created_at": now,
+            "in_progress_at": now,
+            "expires_at": now + 24 * 3600,
+            "request_counts": {"total": len(outputs), "completed": len(succeeded), "failed": len(failed)},
+            "metadata": body.get("metadata"),
+            "ready_at": time.time() + self.config.batch_delay,
+        }
+        self.send_json(200, self.server.batch_object(batch_id))
+
+    def replay(self, entry):
+        if entry.get("stream"):
+            self.send_stream(entry["chunks"])
+        else:
+            self.send_json(entry["status"], entry["body"])
+
+    def record(self, key, body):
+        response = requests.post(
+            self.config.upstream.rstrip("/") + self.path,
+            json=body,
+            headers={"Authorization": f"Bearer {self.config.upstream_api_key}"},
+            stream=bool(body.get("stream")),
+            timeout=600,
+        )
+        if body.get("stream") and response.ok:
+            chunks = [
+                json.loads(line[len("data: "):])
+                for line in response.iter_lines(decode_unicode=True)
+                if line and line.startswith("data: ") and line != "data: [DONE]"
+            ]
+            entry = {"key": key, "stream": True, "chunks": chunks}
+        else:
+            entry = {"key": key, "status": response.status_code, "body": response.json()}
+        self.server.save(entry)
+        self.replay(entry)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.cassette = {}
+        self.request_count = 0  # POSTs received, including injected errors
+        self.files = {}  # id -> {"content", "filename", "purpose", "created_at"}
+        self.batches = {}  # id -> batch object plus "ready_at"
+        self._lock = threading.Lock()
+        if config.cassette:
+            try:
+                with open(config.cassette, encoding="utf-8") as cassette:
+                    for line in cassette:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self.cassette[entry["key"]] = entry
+            except FileNotFoundError:
+                if not config.record:
+                    raise
+
+    def count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def add_file(self, content, filename, purpose):
+        with self._lock:
+            file_id = f"file-fake-{self.random.getrandbits(48):x}"
+            self.files[file_id] = {
+                "content": content, "filename": filename, "purpose": purpose, "created_at": int(time.time())
+            }
+        return file_id
+
+    def file_object(self, file_id):
+        entry = self.files[file_id]
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(entry["content"]),
+            "created_at": entry["created_at"],
+            "filename": entry["filename"],
+            "purpose": entry["purpose"],
+            "status": "processed",
+        }
+
+    def batch_object(self, batch_id):
+        """The batch as the API reports it: hidden output until ``batch_delay`` has passed"""
+        batch = dict(self.batches[batch_id])
+        ready_at = batch.pop("ready_at")
+        if time.time() < ready_at:
+            batch.update(output_file_id=None, error_file_id=None)
+        else:
+            batch.update(status="completed", completed_at=int(ready_at), finalizing_at=int(ready_at))
+        return batch
+
+    def save(self, entry):
+        with self._lock:
+            self.cassette[entry["key"]] = entry
+            with open(self.config.cassette, "a", encoding="utf-8") as cassette:
+                cassette.write(json.dumps(entry) + "\n")
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Start a fake server on a background thread; returns it (see ``server.base_url``)"""
+    server = FakeOpenAIServer((host, port), config or FakeServerConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake OpenAI API for offline runs and benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- seconds around --latency")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 429/500")
+    parser.add_argument("--cassette", help="JSONL file of recorded responses to replay")
+    parser.add_argument("--record", action="store_true", help="Proxy unknown requests upstream and record them")
+    parser.add_argument("--upstream", default="https://api.openai.com")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Seconds until a batch completes")
+    args = parser.parse_args()
+    if args.record and not args.cassette:
+        parser.error("--record needs --cassette to write to")
+
+    config = FakeServerConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        cassette=args.cassette,
+        record=args.record,
+        upstream=args.upstream,
+        upstream_api_key=os.getenv("OPENAI_API_KEY"),
+        seed=args.seed,
+        batch_delay=args.batch_delay,
+    )
+    server = FakeOpenAIServer((args.host, args.port), config)
+    print(f"Fake OpenAI API listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
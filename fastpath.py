@@ -0,0 +1,299 @@
+import re
+from models import LatexOutput
+
+# Local, deterministic conversion of plain math notation (e.g. "x^2 + 3x - 4 = 0",
+# "sqrt(pi)/2") to LaTeX, so simple expressions skip the LatexGeneratorAgent entirely.
+# Anything the parser does not fully understand - including prose - returns None and
+# the caller falls back to the agent.
+
+MAX_INPUT_LENGTH = 300
+
+GREEK = {
+    "alpha", "beta", "gamma", "delta", "epsilon", "varepsilon", "zeta", "eta", "theta", "vartheta",
+    "iota", "kappa", "lambda", "mu", "nu", "xi", "pi", "rho", "sigma", "tau", "upsilon", "phi",
+    "varphi", "chi", "psi", "omega", "Gamma", "Delta", "Theta", "Lambda", "Xi", "Pi", "Sigma",
+    "Upsilon", "Phi", "Psi", "Omega",
+}
+CONSTANTS = {"inf": r"\infty", "infinity": r"\infty", "infty": r"\infty"}
+FUNCTIONS = {
+    "sin", "cos", "tan", "sec", "csc", "cot", "sinh", "cosh", "tanh", "arcsin", "arccos", "arctan",
+    "ln", "log", "exp", "det", "min", "max", "gcd",
+}
+BIG_OPERATORS = {"sum": r"\sum", "prod": r"\prod", "int": r"\int", "integral": r"\int"}
+# Short words that are English rather than a product of variables like "ac" in "4ac"
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "get", "how", "if", "in",
+    "is", "it", "let", "me", "my", "no", "not", "of", "on", "or", "out", "so", "the", "to", "up",
+    "use", "was", "we", "why", "you",
+}
+RELATIONS = {"=": "=", "==": "=", "<": "<", ">": ">", "<=": r"\leq", ">=": r"\geq", "!=": r"\neq", "≈": r"\approx"}
+
+UNICODE_SYMBOLS = {
+    "π": "pi", "∞": "infinity", "√": "sqrt", "∛": "cbrt", "∑": "sum", "∏": "prod", "∫": "int",
+    "×": "*", "·": "*", "⋅": "*", "÷": "/", "−": "-", "±": "±", "≤": "<=", "≥": ">=", "≠": "!=",
+    "α": "alpha", "β": "beta", "γ": "gamma", "δ": "delta", "ε": "epsilon", "ζ": "zeta", "η": "eta",
+    "θ": "theta", "ι": "iota", "κ": "kappa", "λ": "lambda", "μ": "mu", "ν": "nu", "ξ": "xi",
+    "ρ": "rho", "σ": "sigma", "τ": "tau", "υ": "upsilon", "φ": "phi", "χ": "chi", "ψ": "psi",
+    "ω": "omega", "Γ": "Gamma", "Δ": "Delta", "Θ": "Theta", "Λ": "Lambda", "Ξ": "Xi", "Π": "Pi",
+    "Σ": "Sigma", "Φ": "Phi", "Ψ": "Psi", "Ω": "Omega",
+}
+SCIENTIFIC_LATEX = r"{}\times10^{{{}}}"
+SUPERSCRIPTS = {"⁰": "0", "¹": "1", "²": "2", "³": "3", "⁴": "4", "⁵": "5", "⁶": "6", "⁷": "7", "⁸": "8", "⁹": "9"}
+
+TOKEN_PATTERN = re.compile(
+    r"\s*(?:(?P<sci>(?:\d+(?:\.\d+)?|\.\d+)[eE][-+]?\d+)|(?P<num>\d+(?:\.\d+)?|\.\d+)|(?P<ident>[A-Za-z]+)|(?P<sup>[⁰¹²³⁴⁵⁶⁷⁸⁹]+)"
+    r"|(?P<op>\*\*|<=|>=|!=|==|[-+*/^=<>()\[\],|!_±≈]|[" + re.escape("".join(UNICODE_SYMBOLS)) + r"]))"
+)
+
+stats = {"served": 0, "fallback": 0}
+
+
+class ParseError(ValueError):
+    pass
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None or match.end() == position:
+            raise ParseError(f"Unexpected character {text[position]!r}")
+        position = match.end()
+        if match.group("sci"):
+            # Scientific notation, e.g. 3.5e10 or 1.6e-19, is one number
+            mantissa, exponent = re.split("[eE]", match.group("sci"))
+            tokens.append(("num", SCIENTIFIC_LATEX.format(mantissa, int(exponent))))
+        elif match.group("num"):
+            tokens.append(("num", match.group("num")))
+        elif match.group("ident"):
+            tokens.append(("ident", match.group("ident")))
+        elif match.group("sup"):
+            tokens.append(("op", "^"))
+            tokens.append(("num", "".join(SUPERSCRIPTS[c] for c in match.group("sup"))))
+        else:
+            op = UNICODE_SYMBOLS.get(match.group("op"), match.group("op"))
+            if op == "**":
+                op = "^"
+            tokens.append(("ident" if op.isalpha() else "op", op))
+    return tokens
+
+
+class Node:
+    """A rendered subexpression; ``bare`` omits the outer parentheses of a group"""
+
+    def __init__(self, latex, bare=None):
+        self.latex = latex
+        self.bare = latex if bare is None else bare
+
+
+def parens(inner):
+    if any(command in inner for command in (r"\frac", r"\sum", r"\prod", r"\int")):
+        return rf"\left({inner}\right)"
+    return f"({inner})"
+
+
+class Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, token = self.peek()
+        if kind is None or (value is not None and token != value):
+            raise ParseError(f"Expected {value or 'token'}, got {token!r}")
+        self.position += 1
+        return token
+
+    def accept(self, value):
+        if self.peek() == ("op", value):
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.relation()
+        if self.peek()[0] is not None:
+            raise ParseError(f"Unexpected {self.peek()[1]!r}")
+        return node.latex
+
+    def relation(self):
+        latex = self.additive().latex
+        while self.peek()[0] == "op" and self.peek()[1] in RELATIONS:
+            latex += f" {RELATIONS[self.take()]} {self.additive().latex}"
+        return Node(latex)
+
+    def additive(self):
+        node = self.term()
+        latex = node.latex
+        while self.peek()[0] == "op" and self.peek()[1] in ("+", "-", "±"):
+            op = self.take()
+            latex += " " + (r"\pm" if op == "±" else op) + " " + self.term().latex
+        return Node(latex) if latex != node.latex else node
+
+    def starts_atom(self):
+        kind, token = self.peek()
+        return kind in ("num", "ident") or token in ("(", "[", "|") and kind == "op"
+
+    def term(self):
+        node = self.unary()
+        divided = False
+        while True:
+            if self.accept("*"):
+                node = Node(rf"{node.latex} \cdot {self.unary().latex}")
+                divided = False
+            elif self.accept("/"):
+                node = Node(rf"\frac{{{node.bare}}}{{{self.unary().bare}}}")
+                divided = True
+            elif self.starts_atom() and self.peek() != ("op", "|"):
+                if divided:
+                    # "x/2y" reads as x/(2y) to some and (x/2)y to others; the agent decides
+                    raise ParseError("Implicit product after a division")
+                right = self.power()
+                joiner = r" \cdot " if node.latex[-1].isdigit() and right.latex[0].isdigit() else " "
+                if node.latex[-1].isdigit() and right.latex[0].isalpha():
+                    joiner = ""
+                node = Node(node.latex + joiner + right.latex)
+            else:
+                return node
+
+    def unary(self):
+        if self.accept("-"):
+            operand = self.unary()
+            return Node(f"-{operand.latex}")
+        if self.accept("+"):
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        base = self.postfix()
+        if self.accept("^"):
+            exponent = self.unary()
+            if re.fullmatch(r"[\d.]+\\times10\^\{-?\d+\}", base.latex):
+                base = Node(f"({base.latex})")  # 10^{n} cannot take a second exponent
+            return Node(f"{base.latex}^{{{exponent.bare}}}")
+        return base
+
+    def postfix(self):
+        node = self.atom()
+        while True:
+            if self.accept("!"):
+                node = Node(node.latex + "!")
+            elif self.accept("_"):
+                node = Node(f"{node.latex}_{{{self.atom().bare}}}")
+            else:
+                return node
+
+    def arguments(self):
+        self.take("(")
+        args = [self.relation()]
+        while self.accept(","):
+            args.append(self.relation())
+        self.take(")")
+        return args
+
+    def atom(self):
+        kind, token = self.peek()
+        if kind == "num":
+            return Node(self.take())
+        if kind == "op" and token in ("(", "["):
+            self.take()
+            inner = self.relation().latex
+            self.take(")" if token == "(" else "]")
+            return Node(parens(inner) if token == "(" else f"[{inner}]", inner)
+        if kind == "op" and token == "|":
+            self.take()
+            inner = self.additive().latex
+            self.take("|")
+            return Node(rf"\left|{inner}\right|")
+        if kind == "ident":
+            return self.identifier(self.take())
+        raise ParseError(f"Unexpected {token!r}")
+
+    def identifier(self, name):
+        if len(name) == 1:
+            return Node(name)
+        if name in GREEK:
+            return Node("\\" + name)
+        if name in CONSTANTS:
+            return Node(CONSTANTS[name])
+        if name in ("sqrt", "cbrt", "root"):
+            return self.root(name)
+        if name == "abs":
+            return Node(rf"\left|{self.arguments()[0].latex}\right|")
+        if name in FUNCTIONS:
+            return self.function(name)
+        if name in BIG_OPERATORS:
+            return self.big_operator(name)
+        after_number = self.position >= 2 and self.tokens[self.position - 2][0] == "num"
+        if len(name) <= 3 and name.lower() not in STOPWORDS and after_number:
+            # Implicit product of single-letter variables after a coefficient, e.g. "ac" in
+            # "b^2 - 4ac"; elsewhere short words ("two", "cat") are more likely English
+            return Node(name)
+        # Longer words we do not know are most likely prose
+        raise ParseError(f"Unknown identifier {name!r}")
+
+    def root(self, name):
+        if self.peek() != ("op", "("):
+            arg = self.power()
+            return Node(rf"\sqrt{{{arg.bare}}}" if name == "sqrt" else rf"\sqrt[3]{{{arg.bare}}}")
+        args = self.arguments()
+        if name == "root" and len(args) == 2:
+            return Node(rf"\sqrt[{args[1].latex}]{{{args[0].latex}}}")
+        if len(args) != 1:
+            raise ParseError(f"Wrong number of arguments to {name}")
+        return Node(rf"\sqrt{{{args[0].latex}}}" if name == "sqrt" else rf"\sqrt[3]{{{args[0].latex}}}")
+
+    def function(self, name):
+        latex = "\\" + name
+        if self.accept("_"):
+            latex += f"_{{{self.atom().bare}}}"
+        if self.accept("^"):
+            latex += f"^{{{self.atom().bare}}}"
+        if self.peek() == ("op", "("):
+            args = self.arguments()
+            return Node(latex + parens(", ".join(arg.latex for arg in args)))
+        return Node(f"{latex} {self.power().latex}")
+
+    def big_operator(self, name):
+        args = self.arguments()
+        command = BIG_OPERATORS[name]
+        if command == r"\int":
+            if len(args) == 2:
+                return Node(rf"\int {args[0].latex}\,d{args[1].latex}")
+            if len(args) == 4:
+                return Node(rf"\int_{{{args[2].latex}}}^{{{args[3].latex}}} {args[0].latex}\,d{args[1].latex}")
+        elif len(args) == 4:
+            return Node(rf"{command}_{{{args[1].latex}={args[2].latex}}}^{{{args[3].latex}}} {args[0].latex}")
+        elif len(args) == 3 and "=" in args[1].latex:
+            return Node(rf"{command}_{{{args[1].latex.replace(' = ', '=')}}}^{{{args[2].latex}}} {args[0].latex}")
+        raise ParseError(f"Unsupported form of {name}")
+
+
+def to_latex(text):
+    """Convert a plain math expression to LaTeX, or return None if it cannot be parsed locally"""
+    if not text or len(text) > MAX_INPUT_LENGTH or "\n" in text.strip():
+        return None
+    try:
+        return Parser(tokenize(text)).parse()
+    except ParseError:
+        return None
+
+
+def try_convert(text):
+    """Fast path for the LaTeX stage: a LatexOutput when the text parses locally, else None"""
+    latex_code = to_latex(text)
+    if latex_code is None:
+        stats["fallback"] += 1
+        return None
+    stats["served"] += 1
+    return LatexOutput(latex_code=latex_code, description="Converted locally from plain math notation.")
+
+
+def served_fraction():
+    total = stats["served"] + stats["fallback"]
+    return stats["served"] / total if total else 0.0
@@ -0,0 +1,80 @@
+import json
+from pydantic import ValidationError
+from clients import get_async_client
+import direct
+import metrics
+from models import FusedOutput
+
+# Fused mode: one structured-output call fills LaTeX, classification and solution for
+# the same text, so the input and the system prompts are sent once instead of three
+# times. Each part is validated on its own; the pipeline recomputes only the parts
+# that are missing or invalid.
+
+STAGES = tuple(FusedOutput.model_fields)
+
+
+def instructions(agents):
+    """One system prompt made of each stage agent's instructions, one section per output field"""
+    sections = "\n\n".join(f"## {stage}\n{agents[stage].instructions.strip()}" for stage in STAGES)
+    return (
+        "You complete several tasks for the same user input and answer with one JSON object. "
+        "Fill the field named after each section below by following that section's instructions.\n\n"
+        + sections
+    )
+
+
+def build_request(agents, text, model=None):
+    return {
+        "model": model or agents[STAGES[0]].model,
+        "messages": [
+            {"role": "system", "content": instructions(agents)},
+            {"role": "user", "content": text},
+        ],
+        "response_format": direct.response_format(FusedOutput),
+    }
+
+
+def split(content):
+    """Validate each part of a fused response; returns ({stage: output}, {stage: error})"""
+    try:
+        data = json.loads(content or "")
+    except ValueError as e:
+        return {}, {stage: f"invalid JSON: {e}" for stage in STAGES}
+    if not isinstance(data, dict):
+        return {}, {stage: "response is not a JSON object" for stage in STAGES}
+
+    outputs, errors = {}, {}
+    for stage in STAGES:
+        output_type = FusedOutput.model_fields[stage].annotation
+        try:
+            outputs[stage] = output_type.model_validate(data.get(stage))
+        except ValidationError as e:
+            errors[stage] = f"invalid {stage}: {e.error_count()} validation error(s)"
+    return outputs, errors
+
+
+async def run(agents, text, model=None):
+    """One fused call; returns ({stage: output}, {stage: error}) for the parts that failed"""
+    request = build_request(agents, text, model)
+    async with metrics.instrument("fused", request["model"]) as call:
+        response = await get_async_client().chat.completions.create(**request)
+        call.add_usage(response.usage)
+    return split(response.choices[0].message.content)
+
+
+async def stream(agents, text, model=None):
+    """Streaming ``run``: yields the JSON text deltas, then the (outputs, errors) pair as the last item"""
+    request = build_request(agents, text, model)
+    async with metrics.instrument("fused", request["model"]) as call:
+        response = await get_async_client().chat.completions.create(
+            **request,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        parts = []
+        async for chunk in response:
+            call.add_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    yield split("".join(parts))
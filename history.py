@@ -0,0 +1,311 @@
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from models import HistoryEntry, HistoryPage, PipelineResult
+import similarity
+
+# Durable history of past conversions, so a result can be found again after a refresh
+# instead of being paid for a second time. One SQLite row per input (keyed by a hash of
+# the image bytes or canonical text, plus the problem number for worksheets) holds a
+# thumbnail, the parsed text, the LaTeX, the classification and the full PipelineResult:
+#
+# - math_type, difficulty and concepts are stored lowercased in indexed columns (concepts
+#   in their own table), so filters never scan
+# - an FTS5 index over text, LaTeX, concepts and solution serves free-text search
+# - pages are keyset-paginated on the id, newest first, so page 1000 costs the same as
+#   page 1. Saving an input again gives it a new id, so ids follow recency and every
+#   filter (the FTS rowid, the concept key, the column indexes) is read in that order
+# - entries older than AGENTEX_HISTORY_RETENTION_DAYS, or beyond the newest
+#   AGENTEX_HISTORY_MAX_ROWS, are deleted in small batches when the history is opened and
+#   every PRUNE_INTERVAL saves; the FTS index is then merged and freed pages are returned
+#   to the file system
+#
+#   AGENTEX_HISTORY_PATH             database file, empty to disable the history
+#   AGENTEX_HISTORY_RETENTION_DAYS   default 365, 0 keeps entries forever
+#   AGENTEX_HISTORY_MAX_ROWS         default 1000000, 0 for no limit
+
+DEFAULT_HISTORY_PATH = os.getenv("AGENTEX_HISTORY_PATH", ".agentex_history.sqlite3")
+RETENTION_DAYS = float(os.getenv("AGENTEX_HISTORY_RETENTION_DAYS", "365"))
+MAX_ROWS = int(os.getenv("AGENTEX_HISTORY_MAX_ROWS", "1000000"))
+THUMBNAIL_SIZE = 160
+PAGE_SIZE = 20
+DELETE_BATCH = 5000  # rows per delete transaction, so pruning never blocks writers for long
+PRUNE_INTERVAL = 1000  # saves between two applications of the retention policies
+
+ENTRY_COLUMNS = (
+    "id, created_at, source, input_hash, thumbnail, text, latex_code, math_type, difficulty_level, concepts"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversions (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    input_hash TEXT NOT NULL UNIQUE,
+    thumbnail BLOB,
+    text TEXT NOT NULL,
+    latex_code TEXT NOT NULL,
+    math_type TEXT NOT NULL,
+    difficulty_level TEXT NOT NULL,
+    concepts TEXT NOT NULL,
+    solution TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversions_created ON conversions (created_at);
+CREATE INDEX IF NOT EXISTS conversions_math_type ON conversions (math_type);
+CREATE INDEX IF NOT EXISTS conversions_difficulty ON conversions (difficulty_level);
+CREATE INDEX IF NOT EXISTS conversions_math_type_difficulty ON conversions (math_type, difficulty_level);
+CREATE TABLE IF NOT EXISTS conversion_concepts (
+    concept TEXT NOT NULL,
+    conversion_id INTEGER NOT NULL REFERENCES conversions (id) ON DELETE CASCADE,
+    PRIMARY KEY (concept, conversion_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversion_concepts_id ON conversion_concepts (conversion_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS conversions_fts USING fts5 (
+    text, latex_code, concepts, solution, content='conversions', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS conversions_fts_insert AFTER INSERT ON conversions BEGIN
+    INSERT INTO conversions_fts (rowid, text, latex_code, concepts, solution)
+    VALUES (new.id, new.text, new.latex_code, new.concepts, new.solution);
+END;
+CREATE TRIGGER IF NOT EXISTS conversions_fts_delete AFTER DELETE ON conversions BEGIN
+    INSERT INTO conversions_fts (conversions_fts, rowid, text, latex_code, concepts, solution)
+    VALUES ('delete', old.id, old.text, old.latex_code, old.concepts, old.solution);
+END;
+"""
+
+
+def input_hash(payload, part=None):
+    """Entry key of image bytes, or of canonical text so retyped problems share an entry.
+
+    ``part`` distinguishes the problems of one worksheet image.
+    """
+    if isinstance(payload, str):
+        payload = similarity.canonical_text(payload).encode("utf-8")
+    digest = hashlib.sha256(payload).hexdigest()
+    return digest if part is None else f"{digest}:{part}"
+
+
+def make_thumbnail(image_bytes, box=None, size=THUMBNAIL_SIZE):
+    """Small JPEG of an image (or of the ``box`` region of it), or None if it cannot be decoded"""
+    from PIL import Image
+    from preprocess import open_image
+
+    try:
+        image = open_image(image_bytes).convert("RGB")
+    except Exception:
+        return None
+    if box is not None:
+        image = image.crop(box)
+    image.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=70, optimize=True)
+    return buffer.getvalue()
+
+
+def match_query(query):
+    """FTS5 query matching every word of free text, the last one as a prefix (search as you type)"""
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+
+class History:
+    """SQLite store of past conversions with filtered, full-text and paginated search"""
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH, retention_days=RETENTION_DAYS, max_rows=MAX_ROWS):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # auto_vacuum only takes effect on a new database, before the first table is created
+        self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(SCHEMA)
+        self._saves = 0
+        self.prune()
+
+    def save(self, result, source, key, thumbnail=None):
+        """Record a result under its input's ``key`` (see input_hash), replacing an earlier one; returns its id"""
+        classification = result.classification
+        concepts = sorted({concept.strip().lower() for concept in classification.concepts if concept.strip()}) \
+            if classification else []
+        solution = result.solution
+        row = {
+            "created_at": time.time(),
+            "source": source,
+            "input_hash": key,
+            "thumbnail": thumbnail,
+            "text": result.text,
+            "latex_code": result.latex.latex_code if result.latex else "",
+            "math_type": classification.math_type.strip().lower() if classification else "",
+            "difficulty_level": classification.difficulty_level.strip().lower() if classification else "",
+            "concepts": json.dumps(concepts),
+            "solution": "\n".join([*solution.solution_steps, solution.final_answer]) if solution else "",
+            "result": result.model_dump_json(),
+        }
+        with self._lock, self._db:
+            previous = self._db.execute(
+                "DELETE FROM conversions WHERE input_hash = ? RETURNING thumbnail", (key,)
+            ).fetchone()
+            if thumbnail is None and previous is not None:
+                # keep the thumbnail when an update (e.g. a lazily computed stage) has none
+                row["thumbnail"] = previous[0]
+            entry_id = self._db.execute(
+                f"INSERT INTO conversions ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                tuple(row.values()),
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO conversion_concepts (concept, conversion_id) VALUES (?, ?)",
+                [(concept, entry_id) for concept in concepts],
+            )
+            self._saves += 1
+            due = self._saves % PRUNE_INTERVAL == 0
+        if due:
+            self.prune()
+        return entry_id
+
+    def find(self, key):
+        """The entry recorded for an input's ``key``, or None"""
+        with self._lock:
+            row = self._db.execute(f"SELECT {ENTRY_COLUMNS} FROM conversions WHERE input_hash = ?", (key,)).fetchone()
+        return self._entry(row) if row else None
+
+    def find_page(self, key):
+        """The entries recorded for an input's ``key``: its own, or those of each problem of a worksheet"""
+        with self._lock:
+            # A range on the unique index finds the "<key>:<part>" entries without a scan
+            rows = self._db.execute(
+                f"SELECT {ENTRY_COLUMNS} FROM conversions WHERE input_hash = ? "
+                "OR (input_hash > ? AND input_hash < ?)",
+                (key, f"{key}:", f"{key};"),
+            ).fetchall()
+        entries = [self._entry(row) for row in rows]
+        return sorted(entries, key=lambda entry: int(entry.input_hash.partition(":")[2] or -1))
+
+    def load(self, entry_id, model=PipelineResult):
+        """Full result of an entry as ``model`` (e.g. ProblemResult), or None if it has been deleted"""
+        with self._lock:
+            row = self._db.execute("SELECT result FROM conversions WHERE id = ?", (entry_id,)).fetchone()
+        return model.model_validate_json(row[0]) if row else None
+
+    def search(self, query="", concept="", math_type="", difficulty="", cursor=None, limit=PAGE_SIZE):
+        """One page of entries matching every given filter, newest first.
+
+        ``query`` is free text over the problem, LaTeX, concepts and solution; the
+        other filters match exactly (case-insensitive). Pass the returned
+        ``next_cursor`` to get the following page.
+        """
+        # The most selective filter drives the scan in id order; the others are checked per row
+        conditions, parameters = [], []
+        fts_query = match_query(query or "")
+        if fts_query:
+            source = "conversions_fts JOIN conversions ON conversions.id = conversions_fts.rowid"
+            order = "conversions_fts.rowid"
+            conditions.append("conversions_fts MATCH ?")
+            parameters.append(fts_query)
+        elif concept.strip():
+            source = "conversion_concepts JOIN conversions ON conversions.id = conversion_concepts.conversion_id"
+            order = "conversion_concepts.conversion_id"
+        else:
+            source, order = "conversions", "conversions.id"
+        if concept.strip():
+            conditions.append(
+                "EXISTS (SELECT 1 FROM conversion_concepts WHERE concept = ? AND conversion_id = conversions.id)"
+                if fts_query else "conversion_concepts.concept = ?"
+            )
+            parameters.append(concept.strip().lower())
+        if math_type.strip():
+            conditions.append("math_type = ?")
+            parameters.append(math_type.strip().lower())
+        if difficulty.strip():
+            conditions.append("difficulty_level = ?")
+            parameters.append(difficulty.strip().lower())
+        if cursor:
+            conditions.append(f"{order} < ?")
+            parameters.append(int(cursor))
+        columns = ", ".join(f"conversions.{column.strip()}" for column in ENTRY_COLUMNS.split(","))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {columns} FROM {source} {where} ORDER BY {order} DESC LIMIT ?",
+                (*parameters, limit + 1),
+            ).fetchall()
+        entries = [self._entry(row) for row in rows[:limit]]
+        next_cursor = str(entries[-1].id) if len(rows) > limit else None
+        return HistoryPage(entries=entries, next_cursor=next_cursor)
+
+    def math_types(self, limit=50):
+        """Distinct math types recorded, for filter choices"""
+        # One index seek per distinct value instead of a scan of every row, like a skip scan
+        with self._lock:
+            rows = self._db.execute(
+                "WITH RECURSIVE types (math_type) AS ("
+                "SELECT min(math_type) FROM conversions WHERE math_type > '' "
+                "UNION ALL SELECT (SELECT min(math_type) FROM conversions WHERE math_type > types.math_type) "
+                "FROM types WHERE types.math_type IS NOT NULL"
+                ") SELECT math_type FROM types WHERE math_type IS NOT NULL LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM conversions").fetchone()[0]
+
+    def delete(self, entry_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM conversions WHERE id = ?", (entry_id,))
+
+    def prune(self, now=None):
+        """Apply the retention policies, then compact; returns the number of deleted entries"""
+        now = time.time() if now is None else now
+        cutoffs = []
+        if self.retention_days > 0:
+            cutoffs.append(("created_at < ?", now - self.retention_days * 24 * 3600))
+        if self.max_rows > 0:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT id FROM conversions ORDER BY id DESC LIMIT 1 OFFSET ?", (self.max_rows,)
+                ).fetchone()
+            if row is not None:
+                cutoffs.append(("id <= ?", row[0]))
+
+        deleted = 0
+        for condition, cutoff in cutoffs:
+            while True:
+                with self._lock, self._db:
+                    removed = self._db.execute(
+                        f"DELETE FROM conversions WHERE id IN (SELECT id FROM conversions WHERE {condition} LIMIT ?)",
+                        (cutoff, DELETE_BATCH),
+                    ).rowcount
+                deleted += removed
+                if removed < DELETE_BATCH:
+                    break
+        if deleted:
+            self.compact()
+        return deleted
+
+    def compact(self):
+        """Merge the FTS index segments and return free pages to the file system"""
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT INTO conversions_fts (conversions_fts) VALUES ('optimize')")
+            # executescript steps the pragma to completion; execute would free a single page
+            self._db.executescript("PRAGMA incremental_vacuum;")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.execute("PRAGMA optimize")
+
+    @staticmethod
+    def _entry(row):
+        fields = dict(zip((column.strip() for column in ENTRY_COLUMNS.split(",")), row))
+        fields["concepts"] = json.loads(fields["concepts"])
+        return HistoryEntry(**fields)
@@ -0,0 +1,232 @@
+import re
+from pydantic import BaseModel
+from clients import get_async_client
+import metrics
+from models import LatexOutput
+
+# Offline check that LatexOutput.latex_code will render in KaTeX (st.latex), with a
+# targeted repair that sends only the offending snippet back to the model.
+
+REPAIR_MODEL = "gpt-4o"
+MAX_REPAIR_ROUNDS = 3
+SNIPPET_CONTEXT = 30
+
+# Commands supported by KaTeX (https://katex.org/docs/supported.html), minus the
+# macro-definition commands the LaTeX prompt forbids
+KATEX_COMMANDS = set("""
+alpha beta gamma delta epsilon varepsilon zeta eta theta vartheta iota kappa varkappa lambda mu nu xi
+omicron pi varpi rho varrho sigma varsigma tau upsilon phi varphi chi psi omega Gamma Delta Theta
+Lambda Xi Pi Sigma Upsilon Phi Psi Omega varGamma varDelta varTheta varLambda varXi varPi varSigma
+varUpsilon varPhi varPsi varOmega digamma aleph beth gimel daleth hbar hslash ell wp Re Im partial
+nabla infty emptyset varnothing imath jmath complement eth Finv Game mho
+frac dfrac tfrac cfrac binom dbinom tbinom genfrac over choose sqrt
+sin cos tan cot sec csc sinh cosh tanh coth sech csch arcsin arccos arctan arccot arcsec arccsc
+ln log lg exp lim liminf limsup sup inf max min arg deg det dim gcd hom ker Pr injlim projlim
+operatorname operatornamewithlimits
+sum prod coprod int iint iiint oint oiint oiiint intop smallint bigcup bigcap bigvee bigwedge
+bigoplus bigotimes bigodot biguplus bigsqcup limits nolimits
+left right middle big Big bigg Bigg bigl bigr Bigl Bigr biggl biggr Biggl Biggr bigm Bigm biggm Biggm
+langle rangle lfloor rfloor lceil rceil lvert rvert lVert rVert vert Vert lbrace rbrace lbrack rbrack
+lgroup rgroup ulcorner urcorner llcorner lrcorner backslash uparrow downarrow updownarrow Uparrow
+Downarrow Updownarrow
+pm mp times div cdot cdotp ast star circ bullet oplus ominus otimes oslash odot cap cup uplus sqcap
+sqcup vee wedge lor land setminus smallsetminus wr amalg dagger ddagger diamond triangleleft
+triangleright bigtriangleup bigtriangledown lhd rhd unlhd unrhd ltimes rtimes leftthreetimes
+rightthreetimes intercal dotplus centerdot barwedge veebar curlyvee curlywedge doublebarwedge
+boxplus boxminus boxtimes boxdot divideontimes mod bmod pmod pod
+leq le geq ge neq ne equiv approx approxeq cong sim simeq nsim propto prec succ preceq succeq ll gg
+lll ggg subset supset subseteq supseteq nsubseteq nsupseteq subsetneq supsetneq sqsubset sqsupset
+sqsubseteq sqsupseteq in ni notin owns mid nmid parallel nparallel perp models vdash dashv vDash
+Vdash asymp bowtie smile frown doteq doteqdot leqq geqq leqslant geqslant lesssim gtrsim lessgtr
+gtrless nleq ngeq nless ngtr lneq gneq lneqq gneqq neg lnot not therefore because colon coloneqq
+eqqcolon triangleq
+to gets leftarrow rightarrow leftrightarrow Leftarrow Rightarrow Leftrightarrow longleftarrow
+longrightarrow longleftrightarrow Longleftarrow Longrightarrow Longleftrightarrow mapsto longmapsto
+hookleftarrow hookrightarrow nearrow searrow swarrow nwarrow iff implies impliedby leadsto
+rightleftharpoons leftrightharpoons rightharpoonup rightharpoondown leftharpoonup leftharpoondown
+uparrow downarrow xrightarrow xleftarrow xLeftarrow xRightarrow xleftrightarrow xmapsto
+forall exists nexists top bot angle measuredangle sphericalangle triangle square blacksquare Box
+checkmark flat natural sharp clubsuit diamondsuit heartsuit spadesuit prime backprime degree
+hat widehat check widecheck tilde widetilde bar overline underline vec overrightarrow
+overleftarrow overleftrightarrow dot ddot dddot acute grave breve mathring overbrace underbrace
+overset underset stackrel xrightarrow boxed cancel bcancel xcancel sout not
+mathrm mathit mathbf mathsf mathtt mathcal mathbb mathfrak mathscr mathnormal boldsymbol bm
+textrm textit textbf textsf texttt text textnormal emph rm it bf sf tt cal frak Bbb bold
+displaystyle textstyle scriptstyle scriptscriptstyle
+ldots cdots vdots ddots dots dotsb dotsc dotsi dotsm dotso
+quad qquad enspace thinspace medspace thickspace negthinspace negmedspace negthickspace
+hspace hphantom vphantom phantom space nobreakspace kern mkern mskip hskip
+begin end substack tag notag nonumber label color textcolor colorbox fcolorbox
+Alpha Beta Epsilon Zeta Eta Iota Kappa Mu Nu Omicron Rho Tau Chi thetasym alef alefsym real reals
+image weierp Bbbk R N Z Q C Reals natnums Complex cnums infin exist empty KaTeX LaTeX TeX
+S P dag ddag copyright pounds yen dollar textdollar maltese circledR circledS surd diagup diagdown
+bigstar lozenge blacklozenge blacktriangle blacktriangledown blacktriangleleft blacktriangleright
+vartriangle triangledown vartriangleleft vartriangleright spades hearts clubs diamonds Diamond
+arcctg arctg ch cosec cotg ctg cth sh tg th plim argmax argmin varinjlim varliminf varlimsup
+varprojlim
+lt gt lessapprox gtrapprox lesseqgtr gtreqless lesseqqgtr gtreqqless lessdot gtrdot precsim succsim
+precapprox succapprox preccurlyeq succcurlyeq curlyeqprec curlyeqsucc thicksim thickapprox backsim
+backsimeq bumpeq Bumpeq between pitchfork shortmid shortparallel smallfrown smallsmile Subset Supset
+subseteqq supseteqq trianglelefteq trianglerighteq Vvdash multimap varpropto eqsim eqslantgtr
+eqslantless circeq eqcirc fallingdotseq risingdotseq Doteq coloneq Coloneqq Coloneq Eqqcolon
+dblcolon eqcolon vcentcolon approxcolon ngeqq ngeqslant nleqq nleqslant nprec npreceq nsucc nsucceq
+nshortmid nshortparallel ncong nsubseteqq nsupseteqq ntriangleleft ntrianglelefteq ntriangleright
+ntrianglerighteq nvdash nvDash nVdash nVDash precnapprox precneqq precnsim succnapprox succneqq
+succnsim subsetneqq supsetneqq varsubsetneq varsubsetneqq varsupsetneq varsupsetneqq lnapprox
+gnapprox lnsim gnsim lvertneqq gvertneqq notni origof imageof Join
+Cap Cup doublecap doublecup circledcirc circledast circleddash And bigcirc sdot
+nleftarrow nrightarrow nLeftarrow nRightarrow nleftrightarrow nLeftrightarrow circlearrowleft
+circlearrowright curvearrowleft curvearrowright dashleftarrow dashrightarrow downdownarrows
+downharpoonleft downharpoonright leftarrowtail rightarrowtail leftleftarrows rightrightarrows
+leftrightarrows rightleftarrows Lleftarrow Rrightarrow looparrowleft looparrowright Lsh Rsh
+restriction rightsquigarrow leftrightsquigarrow twoheadleftarrow twoheadrightarrow upharpoonleft
+upharpoonright upuparrows larr rarr lrarr Larr Rarr Lrarr harr Harr lArr rArr lrArr hArr uArr dArr
+uarr darr Uarr Darr xhookleftarrow xhookrightarrow xtwoheadleftarrow xtwoheadrightarrow
+xrightharpoonup xrightharpoondown xleftharpoonup xleftharpoondown xrightleftharpoons
+xleftrightharpoons xlongequal xtofrom xLeftrightarrow
+lang rang llbracket rrbracket lBrace rBrace lmoustache rmoustache lparen rparen
+utilde overleftharpoon overrightharpoon overgroup undergroup overlinesegment underlinesegment
+underleftarrow underrightarrow underleftrightarrow Overrightarrow underbar
+above atop brace brack iddots mathellipsis ldotp
+hline hdashline cr newline raisebox rule hbox vcenter mathstrut strut smash llap rlap clap mathllap
+mathrlap mathclap enskip nobreak allowbreak mathchoice
+tiny scriptsize footnotesize small normalsize large Large LARGE huge Huge
+mathop mathbin mathrel mathopen mathclose mathpunct mathinner mathord pmb textup textmd
+bra ket braket Bra Ket Braket set Set
+""".split())
+
+# Environments KaTeX can render inside display math
+KATEX_ENVIRONMENTS = {
+    "matrix", "pmatrix", "bmatrix", "Bmatrix", "vmatrix", "Vmatrix", "smallmatrix", "array",
+    "cases", "dcases", "rcases", "aligned", "alignedat", "gathered", "split", "subarray",
+    "matrix*", "pmatrix*", "bmatrix*", "Bmatrix*", "vmatrix*", "Vmatrix*", "CD",
+    "align", "align*", "gather", "gather*", "equation", "equation*", "alignat", "alignat*",
+}
+
+FENCE_PATTERN = re.compile(r"^```(?:[\w-]*[ \t]*\n)?(.*?)\n?```$", re.DOTALL)
+TOKEN_PATTERN = re.compile(r"\\(?:[A-Za-z]+|.)|[{}$]|```")
+
+stats = {"passed": 0, "repaired": 0, "failed": 0}
+
+
+class LatexIssue(BaseModel):
+    message: str
+    start: int
+    end: int
+
+
+def validate(latex_code):
+    """Return the KaTeX problems found in ``latex_code`` (empty list if it should render)"""
+    issues = []
+    braces = []  # offsets of open braces
+    environments = []  # (name, offset) of open \begin
+    left_depth = 0
+
+    for match in TOKEN_PATTERN.finditer(latex_code):
+        token, start, end = match.group(), match.start(), match.end()
+        if token == "{":
+            braces.append(start)
+        elif token == "}":
+            if braces:
+                braces.pop()
+            else:
+                issues.append(LatexIssue(message="Unmatched closing brace '}'", start=start, end=end))
+        elif token in ("$", "```"):
+            issues.append(LatexIssue(message=f"Math delimiter or fence {token!r} is not allowed", start=start, end=end))
+        elif token in ("\\begin", "\\end"):
+            name_match = re.match(r"\s*\{([^{}]*)\}", latex_code[end:])
+            if name_match is None:
+                issues.append(LatexIssue(message=f"{token} without an environment name", start=start, end=end))
+                continue
+            name = name_match.group(1)
+            span_end = end + name_match.end()
+            if token == "\\begin":
+                if name not in KATEX_ENVIRONMENTS:
+                    issues.append(LatexIssue(message=f"Environment '{name}' is not supported by KaTeX", start=start, end=span_end))
+                environments.append((name, start))
+            elif environments and environments[-1][0] == name:
+                environments.pop()
+            else:
+                expected = environments[-1][0] if environments else None
+                message = f"\\end{{{name}}} does not match " + (f"\\begin{{{expected}}}" if expected else "any \\begin")
+                issues.append(LatexIssue(message=message, start=start, end=span_end))
+        elif token in ("\\[", "\\]", "\\(", "\\)"):
+            issues.append(LatexIssue(message=f"Display delimiter {token} is not allowed inside st.latex", start=start, end=end))
+        elif token == "\\left":
+            left_depth += 1
+        elif token == "\\right":
+            if left_depth == 0:
+                issues.append(LatexIssue(message="\\right without a matching \\left", start=start, end=end))
+            else:
+                left_depth -= 1
+        elif token[1:].isalpha() and token[1:] not in KATEX_COMMANDS:
+            issues.append(LatexIssue(message=f"Command {token} is not supported by KaTeX", start=start, end=end))
+
+    for start in braces:
+        issues.append(LatexIssue(message="Unclosed brace '{'", start=start, end=start + 1))
+    for name, start in environments:
+        issues.append(LatexIssue(message=f"\\begin{{{name}}} is never closed", start=start, end=start + len(name) + 8))
+    if left_depth:
+        issues.append(LatexIssue(message=f"{left_depth} \\left without a matching \\right", start=0, end=len(latex_code)))
+    return issues
+
+
+def snippet_bounds(latex_code, issue):
+    return max(issue.start - SNIPPET_CONTEXT, 0), min(issue.end + SNIPPET_CONTEXT, len(latex_code))
+
+
+async def repair_snippet(snippet, message):
+    """Ask the model to fix one snippet; only the snippet and the error are sent"""
+    async with metrics.instrument("latex_repair", REPAIR_MODEL) as call:
+        response = await get_async_client().chat.completions.create(
+            model=REPAIR_MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "You fix fragments of LaTeX so they render in KaTeX. Reply with only the corrected "
+                        "fragment, no explanations, no math delimiters and no markdown fences. Keep everything "
+                        "that is not part of the error unchanged."
+                    ),
+                },
+                {"role": "user", "content": f"Error: {message}\nFragment:\n{snippet}"},
+            ],
+            max_tokens=300,
+        )
+        call.add_usage(response.usage)
+    return strip_fences(response.choices[0].message.content)
+
+
+def strip_fences(content):
+    """Model reply without a markdown fence (and its language tag) or inline backticks"""
+    content = content.strip()
+    fenced = FENCE_PATTERN.match(content)
+    return (fenced.group(1) if fenced else content).strip().strip("`")
+
+
+async def validate_and_repair(latex_output):
+    """Validate a LatexOutput and repair failing snippets in place of a full regeneration.
+
+    Counts each result as passed, repaired or failed in ``stats``. An output that
+    still fails after ``MAX_REPAIR_ROUNDS`` is returned unchanged.
+    """
+    latex_code = latex_output.latex_code
+    issues = validate(latex_code)
+    if not issues:
+        stats["passed"] += 1
+        return latex_output
+
+    for _ in range(MAX_REPAIR_ROUNDS):
+        start, end = snippet_bounds(latex_code, issues[0])
+        try:
+            fixed = await repair_snippet(latex_code[start:end], issues[0].message)
+        except Exception:
+            break
+        latex_code = latex_code[:start] + fixed + latex_code[end:]
+        issues = validate(latex_code)
+        if not issues:
+            stats["repaired"] += 1
+            return LatexOutput(latex_code=latex_code, description=latex_output.description)
+
+    stats["failed"] += 1
+    return latex_output
@@ -4,7 +4,16 @@ import os
 from agents import Agent, Runner, trace
 from models import ImageParser, LatexOutput, MathClassification, MathSolution
 from tools import parse_image, classify_math_content, generate_solution
+from pipeline import TextPipeline
+from cache import ResultCache
+from clients import agent_run_config
+import vision
+import direct
+import segmentation
+import metrics
+import routing
 import asyncio
+import argparse
 
 load_dotenv()
 
@@ -107,31 +116,131 @@ solution_generator_agent = Agent(
     model="gpt-4o"
 )
 
-# Example image URL - replace with your actual image URL
-image_url = "https://www.firstforwomen.com/wp-content/uploads/sites/2/2018/02/math-iq-test.jpg?w=750&h=562&crop=1&quality=86&strip=all"
+# Shared result cache (memory LRU backed by SQLite) for vision and agent outputs
+result_cache = ResultCache()
 
+# Runs agents #2-#4 concurrently on the parsed text, each on the model tier routing.py picks
+text_pipeline = TextPipeline(
+    latex_generator_agent,
+    math_classifier_agent,
+    solution_generator_agent,
+    cache=result_cache,
+    router=routing.Router() if routing.ENABLED else None,
+)
 
+# Example image URL - replace with your actual image URL
+image_url = "https://www.firstforwomen.com/wp-content/uploads/sites/2/2018/02/math-iq-test.jpg?w=750&h=562&crop=1&quality=86&strip=all"
 
-async def main():
-    with trace("Deterministic flow"):
-        # Run the agents in sequence
-        parsed_result = await Runner.run(image_parser_agent, image_url)
-        print("Parsed result:", parsed_result.final_output.text)
 
-        # Generate LaTeX code from the parsed text
-        latex_result = await Runner.run(latex_generator_agent, parsed_result.final_output.text)
-        print("Generated LaTeX:", latex_result.final_output.latex_code)
 
-        # Classify the mathematical content
-        classification_result = await Runner.run(math_classifier_agent, parsed_result.final_output.text)
-        print("Math classification:", classification_result.final_output.math_type)
-        print("Difficulty:", classification_result.final_output.difficulty_level)
-        print("Concepts:", classification_result.final_output.concepts)
+async def main(image_url=image_url, stream=True, mode="agent", fused=False, segment=False, stages=None):
+    modes = {stage: mode for stage in text_pipeline.agents}
+    with trace("Deterministic flow"), metrics.request():
+        if segment:
+            await segment_main(image_url, {"modes": modes, "fused": fused, "stages": stages})
+            return
+        if stream:
+            await stream_main(image_url, modes, fused, stages)
+            return
+
+        # Parse the image first; every other stage depends on its text
+        if mode == "direct":
+            parsed = await direct.run(image_parser_agent, direct.image_content(image_url), "image_parser")
+        else:
+            async with metrics.instrument("image_parser", image_parser_agent.model) as call:
+                parsed_result = await Runner.run(image_parser_agent, image_url, run_config=agent_run_config())
+                call.add_usage(parsed_result.context_wrapper.usage)
+            parsed = parsed_result.final_output
+        print("Parsed result:", parsed.text)
+
+        # Generate the requested stages (LaTeX, classification, solution) concurrently
+        result = await text_pipeline.run(parsed.text, modes=modes, fused=fused, stages=stages)
+
+        if result.latex:
+            print("Generated LaTeX:", result.latex.latex_code)
+
+        if result.classification:
+            print("Math classification:", result.classification.math_type)
+            print("Difficulty:", result.classification.difficulty_level)
+            print("Concepts:", result.classification.concepts)
+
+        if result.solution:
+            print("Solution steps:", result.solution.solution_steps)
+            print("Final answer:", result.solution.final_answer)
+
+        for stage, error in result.errors.items():
+            print(f"{stage} failed:", error)
+
+
+# Split a worksheet into problems, then parse and solve them all concurrently
+async def segment_main(image_url, pipeline_options):
+    problems = await segmentation.parse_worksheet_url(image_url, text_pipeline, result_cache, pipeline_options)
+    for problem in problems:
+        print(f"Problem {problem.index + 1} at {problem.box}:", problem.text)
+        if problem.latex:
+            print("  LaTeX:", problem.latex.latex_code)
+        if problem.solution:
+            print("  Final answer:", problem.solution.final_answer)
+        for stage, error in problem.errors.items():
+            print(f"  {stage} failed:", error)
+
+
+# Print the vision text, LaTeX and each solution step as soon as they are generated
+async def stream_main(image_url, modes=None, fused=False, stages=None):
+    prepared_url, cache_payload, _ = await vision.prepare_image_url(image_url)
+    print("Parsed result: ", end="", flush=True)
+    parsed_text = ""
+    async for delta in vision.stream_cached_vision_api(prepared_url, cache_payload, result_cache):
+        parsed_text += delta
+        print(delta, end="", flush=True)
+    print()
+
+    async for event in text_pipeline.stream(parsed_text, modes=modes, fused=fused, stages=stages):
+        if event.kind == "error":
+            print(f"{event.stage} failed:", event.data)
+        elif event.kind == "step":
+            print(f"Solution step {event.data['index'] + 1}:", event.data["text"], flush=True)
+        elif event.kind == "partial" and event.stage == "solution":
+            print("Solution retried, steps so far are replaced:", flush=True)
+        elif event.kind != "done":
+            continue
+        elif event.stage == "latex":
+            print("Generated LaTeX:", event.data.latex_code, flush=True)
+        elif event.stage == "classification":
+            print("Math classification:", event.data.math_type)
+            print("Difficulty:", event.data.difficulty_level)
+            print("Concepts:", event.data.concepts, flush=True)
+        elif event.stage == "solution":
+            print("Final answer:", event.data.final_answer, flush=True)
 
-        # Generate step-by-step solution if applicable
-        solution_result = await Runner.run(solution_generator_agent, parsed_result.final_output.text)
-        print("Solution steps:", solution_result.final_output.solution_steps)
-        print("Final answer:", solution_result.final_output.final_answer)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert an image with mathematical content to LaTeX.")
+    parser.add_argument("image_url", nargs="?", default=image_url, help="Image URL (defaults to an example worksheet)")
+    parser.add_argument("--no-stream", action="store_true", help="Print results only once every stage has finished")
+    parser.add_argument(
+        "--mode", choices=direct.MODES, default="agent",
+        help="'direct' replaces each agent and its tool call with one structured-output call",
+    )
+    parser.add_argument(
+        "--fused", action="store_true",
+        help="Fill LaTeX, classification and solution with one call; failed parts fall back to --mode",
+    )
+    parser.add_argument("--segment", action="store_true", help="Split a worksheet into problems and solve each one")
+    parser.add_argument(
+        "--stages", type=lambda value: value.split(","), default=None,
+        help="Comma-separated stages to compute, e.g. 'latex' (default: latex,classification,solution)",
+    )
+    args = parser.parse_args()
+    try:
+        text_pipeline.resolve_stages(args.stages)
+    except ValueError as e:
+        parser.error(str(e))
+    asyncio.run(main(
+        args.image_url,
+        stream=not args.no_stream,
+        mode=args.mode,
+        fused=args.fused,
+        segment=args.segment,
+        stages=args.stages,
+    ))
@@ -0,0 +1,317 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Built-in instrumentation for every model call: wall time, queue wait, tokens, image
+# bytes, retries and estimated cost, aggregated per stage and per request. Exposed as
+# a Prometheus text file / endpoint and as one JSON log line per call and per request.
+#
+#   AGENTEX_METRICS_LOG   JSON log file, e.g. agentex_metrics.jsonl (off by default)
+#   AGENTEX_METRICS_FILE  Prometheus text file rewritten after every request
+#   AGENTEX_METRICS_PORT  serve /metrics on this port
+#   AGENTEX_METRICS_HOST  address /metrics listens on (default 127.0.0.1, 0.0.0.0 exposes it)
+
+# USD per 1M tokens (input, output)
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+METRICS_LOG = os.getenv("AGENTEX_METRICS_LOG")
+METRICS_FILE = os.getenv("AGENTEX_METRICS_FILE")
+METRICS_PORT = os.getenv("AGENTEX_METRICS_PORT")
+METRICS_HOST = os.getenv("AGENTEX_METRICS_HOST", "127.0.0.1")
+
+logger = logging.getLogger("agentex.metrics")
+logger.propagate = False
+if METRICS_LOG and not logger.handlers:
+    # delay: the file is only created once there is something to log
+    handler = logging.FileHandler(METRICS_LOG, encoding="utf-8", delay=True)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+_current_call = contextvars.ContextVar("agentex_current_call", default=None)
+_current_request = contextvars.ContextVar("agentex_current_request", default=None)
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    input_price, output_price = PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+class CallRecord:
+    """Measurements for one model call; callers fill in usage as it becomes known"""
+
+    def __init__(self, stage, model):
+        self.stage = stage
+        self.model = model
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.image_bytes = 0
+        self.retries = 0
+        self.queue_wait = 0.0
+        self.seconds = 0.0
+        self.status = "ok"
+
+    def add_usage(self, usage):
+        """Accept Chat Completions, Responses or agents SDK usage objects"""
+        if usage is None:
+            return
+        self.input_tokens += getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", 0) or 0
+        self.output_tokens += getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", 0) or 0
+
+    @property
+    def cost(self):
+        return estimate_cost(self.model, self.input_tokens, self.output_tokens)
+
+    def as_dict(self):
+        return {
+            "stage": self.stage,
+            "model": self.model,
+            "status": self.status,
+            "seconds": round(self.seconds, 6),
+            "queue_wait_seconds": round(self.queue_wait, 6),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "image_bytes": self.image_bytes,
+            "retries": self.retries,
+            "cost_usd": round(self.cost, 8),
+        }
+
+
+class RequestRecord:
+    """All calls made on behalf of one user request (one image, text or batch item)"""
+
+    def __init__(self, request_id, queue_wait=0.0):
+        self.request_id = request_id
+        self.queue_wait = queue_wait
+        self.started = time.perf_counter()
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self):
+        stages = {}
+        for call in self.calls:
+            stage = stages.setdefault(call.stage, {
+                "calls": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0, "retries": 0, "cost_usd": 0.0,
+            })
+            stage["calls"] += 1
+            stage["seconds"] += call.seconds
+            stage["input_tokens"] += call.input_tokens
+            stage["output_tokens"] += call.output_tokens
+            stage["retries"] += call.retries
+            stage["cost_usd"] += call.cost
+        return {
+            "event": "request",
+            "request_id": self.request_id,
+            "seconds": round(time.perf_counter() - self.started, 6),
+            "queue_wait_seconds": round(self.queue_wait, 6),
+            "calls": len(self.calls),
+            "input_tokens": sum(call.input_tokens for call in self.calls),
+            "output_tokens": sum(call.output_tokens for call in self.calls),
+            "image_bytes": sum(call.image_bytes for call in self.calls),
+            "retries": sum(call.retries for call in self.calls),
+            "cost_usd": round(sum(call.cost for call in self.calls), 8),
+            "stages": stages,
+        }
+
+
+class Registry:
+    """Process-wide counters, gauges and latency histograms, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.histograms = {}  # labels -> [bucket counts..., sum, count]
+
+    def inc(self, name, labels, value=1.0):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def set_gauge(self, name, labels, value):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, labels, seconds):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def record(self, call):
+        labels = {"stage": call.stage, "model": call.model}
+        self.inc("agentex_model_calls_total", {**labels, "status": call.status})
+        self.inc("agentex_input_tokens_total", labels, call.input_tokens)
+        self.inc("agentex_output_tokens_total", labels, call.output_tokens)
+        self.inc("agentex_image_bytes_total", labels, call.image_bytes)
+        self.inc("agentex_retries_total", labels, call.retries)
+        self.inc("agentex_queue_wait_seconds_total", labels, call.queue_wait)
+        self.inc("agentex_cost_usd_total", labels, call.cost)
+        self.observe(labels, call.seconds)
+
+    def total(self, name):
+        with self._lock:
+            return sum(value for (metric, _), value in self.counters.items() if metric == name)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name in sorted({name for name, _ in self.gauges}):
+                lines.append(f"# TYPE {name} gauge")
+                for (metric, labels), value in sorted(self.gauges.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            if self.histograms:
+                name = "agentex_model_call_seconds"
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(self.histograms.items()):
+                    for bound, count in zip(LATENCY_BUCKETS, histogram):
+                        bucket = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bucket),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+registry = Registry()
+
+
+def _log(payload):
+    if logger.handlers:
+        logger.info(json.dumps({"ts": time.time(), **payload}))
+
+
+def log_event(event, **fields):
+    """Write a structured event (e.g. a routing decision) to the metrics log"""
+    _log({"event": event, **fields})
+
+
+@asynccontextmanager
+async def instrument(stage, model, image_bytes=0, queue_wait=0.0):
+    """Measure one model call. Use the yielded CallRecord to add usage:
+
+        async with metrics.instrument("vision", model) as call:
+            response = await client.chat.completions.create(...)
+            call.add_usage(response.usage)
+    """
+    call = CallRecord(stage, model)
+    call.image_bytes = image_bytes
+    call.queue_wait = queue_wait
+    token = _current_call.set(call)
+    started = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.status = "error"
+        raise
+    finally:
+        call.seconds = time.perf_counter() - started
+        _current_call.reset(token)
+        registry.record(call)
+        request = _current_request.get()
+        if request is not None:
+            request.add(call)
+        _log({"event": "call", "request_id": request.request_id if request else None, **call.as_dict()})
+
+
+@contextmanager
+def request(request_id=None, queue_wait=0.0):
+    """Group every call made inside this block (including concurrent tasks) into one request"""
+    record = RequestRecord(request_id or uuid.uuid4().hex, queue_wait)
+    token = _current_request.set(record)
+    try:
+        yield record
+    finally:
+        _current_request.reset(token)
+        _log(record.summary())
+        if METRICS_FILE:
+            write_prometheus(METRICS_FILE)
+
+
+def current_call():
+    return _current_call.get()
+
+
+async def on_http_request(http_request):
+    """httpx request hook: the OpenAI SDK marks retried requests with x-stainless-retry-count"""
+    call = _current_call.get()
+    retry_count = int(http_request.headers.get("x-stainless-retry-count", "0") or 0)
+    if call is not None and retry_count:
+        call.retries += 1
+
+
+def data_url_bytes(image_url):
+    """Decoded size of a base64 data URL (0 for remote URLs)"""
+    if not image_url.startswith("data:"):
+        return 0
+    encoded = image_url.split(",", 1)[-1]
+    return len(encoded) * 3 // 4 - encoded[-2:].count("=")
+
+
+def write_prometheus(path):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        handle.write(registry.render())
+    os.replace(temporary, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        data = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+_server = None
+
+
+def start_metrics_server(port, host=METRICS_HOST):
+    """Serve the Prometheus text format on http://host:port/metrics (once per process)"""
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+if METRICS_PORT:
+    start_metrics_server(METRICS_PORT)
@@ -1,3 +1,4 @@
+from typing import Any
 from pydantic import BaseModel
 
 class ImageParser(BaseModel):
@@ -17,4 +18,78 @@ class MathClassification(BaseModel):
 class MathSolution(BaseModel):
     solution_steps: list[str]
     final_answer: str
-    explanation: str
\ No newline at end of file
+    explanation: str
+
+# LaTeX, classification and solution for the same text, filled in by one model call
+class FusedOutput(BaseModel):
+    latex: LatexOutput
+    classification: MathClassification
+    solution: MathSolution
+
+class PipelineResult(BaseModel):
+    text: str
+    latex: LatexOutput | None = None
+    classification: MathClassification | None = None
+    solution: MathSolution | None = None
+    errors: dict[str, str] = {}  # stage name -> error message
+    timings: dict[str, float] = {}  # stage name -> seconds
+    fallbacks: dict[str, str] = {}  # stage name -> why its part of a fused call was recomputed
+
+    def merged(self, update, stages):
+        """A copy with the ``stages`` of ``update`` (a later run on the same text) merged in"""
+        return self.model_copy(update={
+            **{stage: getattr(update, stage) for stage in stages},
+            "errors": {**{k: v for k, v in self.errors.items() if k not in stages}, **update.errors},
+            "timings": {**self.timings, **update.timings},
+            "fallbacks": {**self.fallbacks, **update.fallbacks},
+        })
+
+
+# One problem cropped from a worksheet page, in reading order
+class ProblemResult(PipelineResult):
+    index: int
+    box: tuple[int, int, int, int]  # left, top, right, bottom in page pixels
+
+
+class StreamEvent(BaseModel):
+    stage: str  # latex, classification, solution or pipeline
+    kind: str  # partial, step, done or error
+    data: Any = None
+
+
+# A request to the HTTP service (server.py); exactly one of text, image_url and image_base64
+class JobRequest(BaseModel):
+    text: str | None = None
+    image_url: str | None = None
+    image_base64: str | None = None
+    modes: dict[str, str] = {}  # stage -> agent or direct
+    fused: bool = False
+    segment: bool = False  # split a worksheet image into problems
+    stages: list[str] | None = None  # stages to compute; None computes every stage
+    grayscale: bool = False
+    enhance_contrast: bool = False
+
+
+class JobStatus(BaseModel):
+    id: str
+    status: str  # queued, running, done or failed
+    result: PipelineResult | list[ProblemResult] | None = None
+    error: str | None = None
+    submitted_at: float
+    finished_at: float | None = None
+
+class HistoryEntry(BaseModel):
+    id: int
+    created_at: float
+    source: str  # upload, url, text or worksheet
+    input_hash: str
+    thumbnail: bytes | None = None  # small JPEG of the input image
+    text: str
+    latex_code: str = ""
+    math_type: str = ""
+    difficulty_level: str = ""
+    concepts: list[str] = []
+
+class HistoryPage(BaseModel):
+    entries: list[HistoryEntry]
+    next_cursor: str | None = None  # pass to History.search for the following (older) page
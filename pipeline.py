@@ -0,0 +1,540 @@
+import asyncio
+import json
+import time
+from agents import Runner
+from agents.exceptions import ModelBehaviorError
+from openai.types.responses import ResponseCreatedEvent, ResponseTextDeltaEvent
+from cache import make_key, prompt_version
+from clients import agent_run_config
+import direct
+import fastpath
+import fused
+import katex
+import metrics
+import routing
+from models import PipelineResult, StreamEvent
+
+# Stage graph: vision -> text -> {latex, classification, solution}. The vision stage
+# (vision.py) produces the text and each text stage depends only on that text, so any
+# subset of them can be computed now and the rest later from the same text.
+
+# Per-stage timeouts in seconds; None disables the timeout for that stage
+DEFAULT_TIMEOUTS = {
+    "latex": 60.0,
+    "classification": 90.0,
+    "solution": 180.0,
+    "fused": 180.0,  # the single call of fused mode
+}
+# Streamed JSON is re-parsed when a string, list or object closes, and otherwise at
+# most once per this many characters, so long outputs are not re-parsed per delta
+PARTIAL_PARSE_CHARS = 48
+
+
+class TextPipeline:
+    """Runs the LaTeX, classification and solution agents concurrently on the same text.
+
+    Every stage only needs the parsed text, so the wall-clock latency is the slowest
+    stage instead of the sum of all three. A failing or timed-out stage is recorded in
+    ``PipelineResult.errors`` and does not discard the results of the other stages.
+    When a ``ResultCache`` is given, each stage result is looked up by input text,
+    model and prompt before any model call is made. With ``fast_path`` enabled, plain
+    expressions are converted to LaTeX locally and only other input reaches the agent.
+    With ``validate_latex`` enabled, LaTeX is checked against KaTeX and only the
+    offending snippets are sent back to the model for repair.
+    ``modes`` selects per stage between ``"agent"`` (the agent with its tools) and
+    ``"direct"`` (one structured-output call, see direct.py); it can also be
+    overridden per call to ``run`` and ``stream``. With ``fused`` (also per call), the
+    three stages are filled by one model call and only the parts that fail validation
+    are recomputed with their own stage. With a ``router`` (see routing.py), each
+    stage runs on the model tier picked from a local estimate of the input, and
+    small-tier outputs that fail validation are recomputed on the large tier.
+    ``stages`` restricts a call of ``run`` or ``stream`` to some stages; ``extend``
+    later adds the missing ones to a result without redoing the others.
+    """
+
+    def __init__(
+        self,
+        latex_agent,
+        classifier_agent,
+        solution_agent,
+        timeouts=None,
+        cache=None,
+        fast_path=True,
+        validate_latex=True,
+        modes=None,
+        fused=False,
+        router=None,
+    ):
+        self.agents = {
+            "latex": latex_agent,
+            "classification": classifier_agent,
+            "solution": solution_agent,
+        }
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.cache = cache
+        self.fast_path = fast_path
+        self.validate_latex = validate_latex
+        self.modes = self.resolve_modes(modes, {stage: "agent" for stage in self.agents})
+        self.fused = fused
+        self.router = router
+
+    def resolve_modes(self, modes, defaults=None):
+        modes = {**(defaults or self.modes), **(modes or {})}
+        unknown = set(modes) - set(self.agents)
+        if unknown:
+            raise ValueError(f"Unknown stage(s) {sorted(unknown)} in modes; expected some of {tuple(self.agents)}")
+        for stage, mode in modes.items():
+            if mode not in direct.MODES:
+                raise ValueError(f"Unknown mode {mode!r} for stage {stage!r}; expected one of {direct.MODES}")
+        return modes
+
+    def resolve_stages(self, stages=None):
+        """The requested stages in pipeline order; None means every stage"""
+        if stages is None:
+            return list(self.agents)
+        unknown = set(stages) - set(self.agents)
+        if unknown:
+            raise ValueError(f"Unknown stage(s) {sorted(unknown)}; expected some of {tuple(self.agents)}")
+        return [stage for stage in self.agents if stage in stages]
+
+    def _use_fused(self, fused, stages):
+        # The fused call fills every stage, so it only pays off when all of them are requested
+        return (self.fused if fused is None else fused) and len(stages) == len(self.agents)
+
+    def cache_key(self, stage, text, mode="agent", model=None):
+        agent = self.agents[stage]
+        name = stage if mode == "agent" else f"{stage}:{mode}"
+        return make_key(name, text, model or agent.model, prompt_version(agent.instructions))
+
+    def route(self, stage, text):
+        """The router's Route for ``stage``, or None when every stage uses its agent's model"""
+        return self.router.route(stage, text) if self.router is not None else None
+
+    async def _lookup(self, stage, text, mode="agent", model=None):
+        """Result available without calling the stage's agent (fast path or cache), else None"""
+        if stage == "latex" and self.fast_path:
+            local = fastpath.try_convert(text)
+            if local is not None:
+                return await katex.validate_and_repair(local) if self.validate_latex else local
+
+        if self.cache is not None:
+            return self.cache.get(self.cache_key(stage, text, mode, model))
+        return None
+
+    async def _repair(self, stage, output):
+        if stage == "latex" and self.validate_latex:
+            output = await katex.validate_and_repair(output)
+        return output
+
+    def _store(self, stage, text, output, mode="agent", model=None):
+        if self.cache is not None:
+            self.cache.set(self.cache_key(stage, text, mode, model), output)
+
+    async def _finish(self, stage, text, output, mode="agent", model=None):
+        output = await self._repair(stage, output)
+        self._store(stage, text, output, mode, model)
+        return output
+
+    def _agent(self, stage, model=None):
+        agent = self.agents[stage]
+        return agent if model is None or model == agent.model else agent.clone(model=model)
+
+    async def _call(self, stage, text, mode, model=None):
+        agent = self._agent(stage, model)
+        with routing.use_model(agent.model):
+            if mode == "direct":
+                return await direct.run(agent, text, stage)
+            async with metrics.instrument(stage, agent.model) as call:
+                result = await Runner.run(agent, text, run_config=agent_run_config())
+                call.add_usage(result.context_wrapper.usage)
+            return result.final_output
+
+    async def _routed(self, stage, text, mode, route, produce):
+        """Run ``produce(model)`` on the routed model, escalating unusable small-tier output.
+
+        The result is cached under the routed model, so the next lookup for the
+        same input finds it without repeating the escalation.
+        """
+        model = route.model if route else None
+        try:
+            output = await self._repair(stage, await produce(model))
+            failure = None if route is None or routing.acceptable(stage, output) else "output failed validation"
+        except (ModelBehaviorError, ValueError) as e:
+            if route is None or route.escalation is None:
+                raise
+            failure = str(e) or type(e).__name__
+        if failure and route.escalation:
+            escalated = self.router.escalate(route, failure)
+            output = await self._repair(stage, await produce(escalated.model))
+        self._store(stage, text, output, mode, model)
+        return output
+
+    async def _compute(self, stage, text, mode="agent", route=None):
+        return await self._routed(stage, text, mode, route, lambda model: self._call(stage, text, mode, model))
+
+    async def _run_stage(self, stage, text, timeout, mode="agent"):
+        route = self.route(stage, text)
+        output = await self._lookup(stage, text, mode, route.model if route else None)
+        if output is not None:
+            return output
+        return await asyncio.wait_for(self._compute(stage, text, mode, route), timeout=timeout)
+
+    async def _lookup_all(self, text, mode, model=None):
+        """Stages answered by the fast path or the cache, and the stages still missing"""
+        outputs = {}
+        for stage in self.agents:
+            output = await self._lookup(stage, text, mode, model)
+            if output is not None:
+                outputs[stage] = output
+        return outputs, [stage for stage in self.agents if stage not in outputs]
+
+    async def _run_fused(self, text, timeout, result):
+        """Fill every stage from one fused call; failed parts are recorded in ``result.fallbacks``"""
+        route = self.route("fused", text)
+        model = route.model if route else None
+        outputs, missing = await self._lookup_all(text, "fused", model)
+        if not missing:
+            return outputs
+        try:
+            parts, errors = await _timed(
+                "fused", asyncio.wait_for(fused.run(self.agents, text, model), timeout), result.timings
+            )
+        except Exception as e:
+            parts, errors = {}, {stage: _error_message(e, timeout) for stage in missing}
+        for stage in missing:
+            output = await self._fused_part(stage, text, parts, route)
+            if output is not None:
+                outputs[stage] = output
+            else:
+                result.fallbacks[stage] = _fallback_reason(stage, parts, errors)
+        return outputs
+
+    async def _fused_part(self, stage, text, parts, route):
+        """A stage's validated part of a fused response, or None when the stage must fall back"""
+        if stage not in parts:
+            return None
+        output = await self._repair(stage, parts[stage])
+        if route is not None and route.escalation and not routing.acceptable(stage, output):
+            return None
+        self._store(stage, text, output, "fused", route.model if route else None)
+        return output
+
+    async def run(self, text, timeouts=None, modes=None, fused=None, stages=None):
+        timeouts = {**self.timeouts, **(timeouts or {})}
+        modes = self.resolve_modes(modes)
+        stages = self.resolve_stages(stages)
+        result = PipelineResult(text=text)
+
+        if self._use_fused(fused, stages):
+            for stage, output in (await self._run_fused(text, timeouts.get("fused"), result)).items():
+                setattr(result, stage, output)
+            stages = [stage for stage in stages if stage in result.fallbacks]
+
+        outcomes = await asyncio.gather(
+            *(
+                _timed(stage, self._run_stage(stage, text, timeouts.get(stage), modes[stage]), result.timings)
+                for stage in stages
+            ),
+            return_exceptions=True,
+        )
+
+        for stage, outcome in zip(stages, outcomes):
+            if isinstance(outcome, Exception):
+                result.errors[stage] = _error_message(outcome, timeouts.get(stage))
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                setattr(result, stage, outcome)
+        return result
+
+    async def extend(self, result, stages, **options):
+        """Add the ``stages`` missing from ``result`` (a result for the same text) and return it.
+
+        Stages ``result`` already has are not recomputed, so a result can be filled
+        in stage by stage as each is asked for. ``options`` are those of ``run``.
+        """
+        missing = [stage for stage in self.resolve_stages(stages) if getattr(result, stage) is None]
+        if not missing:
+            return result
+        return result.merged(await self.run(result.text, stages=missing, **options), missing)
+
+    async def _stream_stage(self, stage, text, emit, mode="agent", progress=None):
+        route = self.route(stage, text)
+        output = await self._lookup(stage, text, mode, route.model if route else None)
+        progress = progress or _Progress(stage, emit)
+
+        async def produce(model):
+            # Each attempt (a fused fallback, or an escalation) streams from scratch
+            nonlocal progress
+            progress = progress.restart()
+            agent = self._agent(stage, model)
+            with routing.use_model(agent.model):
+                source = direct.stream(agent, text, stage) if mode == "direct" else _stream_agent(agent, stage, text)
+                buffer, final = _PartialJSON(), None
+                async for item in source:
+                    if item is None:
+                        buffer = _PartialJSON()  # a new model turn, e.g. after a tool call
+                        continue
+                    if not isinstance(item, str):
+                        final = item
+                        continue
+                    partial = buffer.feed(item)
+                    if partial is not None:
+                        progress.update(partial)
+            return final
+
+        if output is None:
+            output = await self._routed(stage, text, mode, route, produce)
+
+        progress.done(output)
+        return output
+
+    async def _stream_fused(self, text, emit, timeout, result):
+        """Streaming ``_run_fused``: emits each stage's partial content from the one fused call.
+
+        Returns the stage outputs and the progress of every stage, so a fallback can
+        replace events that were already sent.
+        """
+        route = self.route("fused", text)
+        model = route.model if route else None
+        outputs, missing = await self._lookup_all(text, "fused", model)
+        progress = {stage: _Progress(stage, emit) for stage in missing}
+
+        async def consume():
+            buffer = _PartialJSON()
+            async for item in fused.stream(self.agents, text, model):
+                if not isinstance(item, str):
+                    return item
+                partial = buffer.feed(item)
+                if partial is None:
+                    continue
+                for stage in missing:
+                    if isinstance(partial.get(stage), dict):
+                        progress[stage].update(partial[stage])
+
+        parts, errors = {}, {}
+        if missing:
+            try:
+                parts, errors = await _timed("fused", asyncio.wait_for(consume(), timeout), result.timings)
+            except Exception as e:
+                errors = {stage: _error_message(e, timeout) for stage in missing}
+
+        for stage in self.agents:
+            if stage in missing:
+                output = await self._fused_part(stage, text, parts, route)
+                if output is None:
+                    result.fallbacks[stage] = _fallback_reason(stage, parts, errors)
+                    continue
+                outputs[stage] = output
+            progress.setdefault(stage, _Progress(stage, emit)).done(outputs[stage])
+        return outputs, progress
+
+    async def stream(self, text, timeouts=None, modes=None, fused=None, stages=None):
+        """Like ``run``, but yields StreamEvents as each stage produces content.
+
+        Events are ``partial`` LaTeX as it is generated, one ``step`` per solution
+        step, ``done`` with each stage's final output, and ``error`` for failed
+        stages. The last event is ``pipeline``/``done`` carrying the PipelineResult.
+        In fused mode the events come from the one fused call, followed by those of
+        any stage that falls back. When a stage is retried (a fused fallback, or an
+        escalation to a larger model) after sending content, a ``partial`` event with
+        the empty LaTeX or an empty list of solution steps replaces that content.
+        """
+        timeouts = {**self.timeouts, **(timeouts or {})}
+        modes = self.resolve_modes(modes)
+        stages = self.resolve_stages(stages)
+        queue = asyncio.Queue()
+        result = PipelineResult(text=text)
+
+        async def run_stage(stage, progress=None):
+            try:
+                output = await _timed(stage, asyncio.wait_for(
+                    self._stream_stage(stage, text, queue.put_nowait, modes[stage], progress),
+                    timeout=timeouts.get(stage),
+                ), result.timings)
+                setattr(result, stage, output)
+            except Exception as e:
+                result.errors[stage] = _error_message(e, timeouts.get(stage))
+                queue.put_nowait(StreamEvent(stage=stage, kind="error", data=result.errors[stage]))
+
+        async def run_fused():
+            try:
+                outputs, progress = await self._stream_fused(text, queue.put_nowait, timeouts.get("fused"), result)
+            except Exception as e:
+                for stage in stages:
+                    result.errors[stage] = _error_message(e, timeouts.get("fused"))
+                    queue.put_nowait(StreamEvent(stage=stage, kind="error", data=result.errors[stage]))
+                return
+            for stage, output in outputs.items():
+                setattr(result, stage, output)
+            await asyncio.gather(*(run_stage(stage, progress[stage]) for stage in result.fallbacks))
+
+        if self._use_fused(fused, stages):
+            tasks = [asyncio.create_task(run_fused())]
+        else:
+            tasks = [asyncio.create_task(run_stage(stage)) for stage in stages]
+        finished = asyncio.gather(*tasks)
+        finished.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (event := await queue.get()) is not None:
+                yield event
+            await finished  # stage failures are events; this re-raises anything else
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield StreamEvent(stage="pipeline", kind="done", data=result)
+
+
+class _Progress:
+    """Turns partial stage output into ``partial`` LaTeX and ``step`` events, each sent once"""
+
+    def __init__(self, stage, emit):
+        self.stage = stage
+        self.emit = emit
+        self.latex = ""
+        self.sent_steps = 0
+
+    def update(self, partial):
+        if self.stage == "latex" and partial.get("latex_code", self.latex) != self.latex:
+            self.latex = partial["latex_code"]
+            self.emit(StreamEvent(stage=self.stage, kind="partial", data=self.latex))
+        elif self.stage == "solution":
+            # A step is complete once the model has started the next one
+            steps = partial.get("solution_steps") or []
+            self.send_steps(steps[:-1])
+
+    def send_steps(self, steps):
+        for index in range(self.sent_steps, len(steps)):
+            self.emit(StreamEvent(stage=self.stage, kind="step", data={"index": index, "text": steps[index]}))
+        self.sent_steps = max(self.sent_steps, len(steps))
+
+    def restart(self):
+        """A new progress for another attempt, after replacing what this one sent"""
+        if self.stage == "latex" and self.latex:
+            self.emit(StreamEvent(stage=self.stage, kind="partial", data=""))
+        elif self.stage == "solution" and self.sent_steps:
+            self.emit(StreamEvent(stage=self.stage, kind="partial", data=[]))
+        return _Progress(self.stage, self.emit)
+
+    def done(self, output):
+        if self.stage == "solution":
+            self.send_steps(output.solution_steps)
+        self.emit(StreamEvent(stage=self.stage, kind="done", data=output))
+
+
+async def _stream_agent(agent, stage, text):
+    """Text deltas of a streamed agent run; None marks a new model turn, the final output comes last"""
+    async with metrics.instrument(stage, agent.model) as call:
+        run = Runner.run_streamed(agent, text, run_config=agent_run_config())
+        async for event in run.stream_events():
+            if event.type != "raw_response_event":
+                continue
+            if isinstance(event.data, ResponseCreatedEvent):
+                yield None
+            elif isinstance(event.data, ResponseTextDeltaEvent):
+                yield event.data.delta
+        call.add_usage(run.context_wrapper.usage)
+    yield run.final_output
+
+
+async def _timed(stage, coroutine, timings):
+    started = time.perf_counter()
+    try:
+        return await coroutine
+    finally:
+        timings[stage] = time.perf_counter() - started
+
+
+def _fallback_reason(stage, parts, errors):
+    if stage in errors:
+        return errors[stage]
+    return "output failed validation" if stage in parts else "missing from the fused response"
+
+
+def _error_message(error, timeout):
+    if isinstance(error, asyncio.TimeoutError):
+        return f"timed out after {timeout}s"
+    return str(error) or type(error).__name__
+
+
+class _PartialJSON:
+    """Streamed JSON text, parsed with ``_parse_partial_json`` only when worth it.
+
+    Tracks open strings, lists and objects as deltas arrive, so each delta is scanned
+    once; ``feed`` returns the parsed object when a value was completed or
+    PARTIAL_PARSE_CHARS characters arrived since the last parse, otherwise None.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.closers = []
+        self.in_string = self.escaped = False
+        self.unparsed = 0
+
+    def feed(self, delta):
+        boundary = False
+        for char in delta:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    boundary = True
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.closers.append("}" if char == "{" else "]")
+            elif char in "}]" and self.closers:
+                self.closers.pop()
+                boundary = True
+        self.parts.append(delta)
+        self.unparsed += len(delta)
+        if not boundary and self.unparsed < PARTIAL_PARSE_CHARS:
+            return None
+        self.unparsed = 0
+        text = "".join(self.parts)
+        self.parts = [text]
+        if not self.escaped:
+            # Usually closing what is open is enough; only text ending mid-key or mid-value is trimmed
+            try:
+                parsed = json.loads(text + ('"' if self.in_string else "") + "".join(reversed(self.closers)))
+                return parsed if isinstance(parsed, dict) else {}
+            except ValueError:
+                pass
+        return _parse_partial_json(text)
+
+
+def _parse_partial_json(text):
+    """Best-effort parse of a JSON object that is still being streamed.
+
+    Closes any open string, array and object; if the text ends mid-key or
+    mid-value, trailing characters are dropped until it parses.
+    """
+    for end in range(len(text), 0, -1):
+        candidate = text[:end]
+        closers = []
+        in_string = escaped = False
+        for char in candidate:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "{[":
+                closers.append("}" if char == "{" else "]")
+            elif char in "}]" and closers:
+                closers.pop()
+        if escaped:
+            continue
+        try:
+            parsed = json.loads(candidate + ('"' if in_string else "") + "".join(reversed(closers)))
+        except ValueError:
+            continue
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
@@ -0,0 +1,158 @@
+import io
+import ipaddress
+import socket
+from urllib.parse import urljoin, urlsplit
+from PIL import Image, ImageOps
+from pydantic import BaseModel
+
+# The vision model downsamples large images anyway, so anything above this is wasted upload
+MAX_SIDE = 1600
+# Pixels darker than this (0-255 grayscale) count as content when auto-cropping
+CROP_THRESHOLD = 235
+CROP_PADDING = 16
+# Downloads of image URLs: only public http(s) hosts, at most this many bytes and redirects
+DOWNLOAD_SCHEMES = ("http", "https")
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+MAX_REDIRECTS = 5
+
+
+class UnsafeURL(ValueError):
+    """An image URL the service must not fetch: not http(s), or not a public address"""
+
+
+class PreprocessedImage(BaseModel):
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    bytes_before: int
+    bytes_after: int
+
+    def summary(self):
+        saved = 1 - self.bytes_after / self.bytes_before if self.bytes_before else 0.0
+        return (
+            f"{self.bytes_before / 1024:.0f} KB -> {self.bytes_after / 1024:.0f} KB "
+            f"({saved:.0%} smaller, {self.width}x{self.height})"
+        )
+
+
+def has_alpha(image):
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+
+def open_image(image_bytes):
+    """Decode an image upright, with transparent areas composited onto white.
+
+    Converting to "L" or "RGB" would otherwise drop the alpha channel and turn the
+    transparent background of e.g. screenshots or LaTeX exports black.
+    """
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    if has_alpha(image):
+        image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image.convert("RGBA"))
+    return image
+
+
+def autocrop(image, threshold=CROP_THRESHOLD, padding=CROP_PADDING):
+    """Trim near-white margins around the content, keeping a small border"""
+    mask = ImageOps.invert(image.convert("L")).point(lambda value: 255 if value > 255 - threshold else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(left - padding, 0),
+        max(top - padding, 0),
+        min(right + padding, image.width),
+        min(bottom + padding, image.height),
+    ))
+
+
+def preprocess_image(
+    image_bytes,
+    max_side=MAX_SIDE,
+    crop=True,
+    grayscale=False,
+    enhance_contrast=False,
+    image_format="JPEG",
+    quality=85,
+):
+    """Shrink an image in memory before it is sent to the vision model.
+
+    Applies EXIF orientation, puts transparent images on white, trims margins,
+    downscales so the longest side is at most ``max_side``, optionally converts to
+    grayscale and stretches contrast, and re-encodes as ``image_format``. If the
+    result is not smaller than an opaque input, the original bytes are kept.
+    """
+    image = open_image(image_bytes)
+    image = image.convert("L") if grayscale else image.convert("RGB")
+
+    if crop:
+        image = autocrop(image)
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if enhance_contrast:
+        image = ImageOps.autocontrast(image, cutoff=1)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=quality, optimize=True)
+    data = buffer.getvalue()
+    mime_type = Image.MIME[image_format.upper()]
+
+    original = Image.open(io.BytesIO(image_bytes))
+    # A transparent original is never sent as is: its background depends on the viewer
+    if len(data) >= len(image_bytes) and not has_alpha(original):
+        data, mime_type = image_bytes, Image.MIME.get(original.format, "image/png")
+        image = original
+
+    return PreprocessedImage(
+        data=data,
+        mime_type=mime_type,
+        width=image.width,
+        height=image.height,
+        bytes_before=len(image_bytes),
+        bytes_after=len(data),
+    )
+
+
+def check_url(url):
+    """Raise UnsafeURL unless ``url`` is http(s) and every address of its host is public.
+
+    Keeps URL inputs from reaching loopback, private networks or cloud metadata
+    endpoints (e.g. 169.254.169.254) from the server.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in DOWNLOAD_SCHEMES or not parts.hostname:
+        raise UnsafeURL(f"Only http and https image URLs are supported: {url!r}")
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or 80, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"Cannot resolve {parts.hostname!r}: {e}") from None
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise UnsafeURL(f"{parts.hostname!r} resolves to a non-public address ({address})")
+
+
+def download_image(url, timeout=30, max_bytes=MAX_DOWNLOAD_BYTES):
+    """Fetch a public image URL, checking every redirect and stopping after ``max_bytes``"""
+    import requests  # only URL inputs need it; keeps it out of startup
+
+    for _ in range(MAX_REDIRECTS + 1):
+        check_url(url)
+        with requests.get(url, timeout=timeout, stream=True, allow_redirects=False) as response:
+            if response.is_redirect:
+                url = urljoin(url, response.headers["Location"])
+                continue
+            response.raise_for_status()
+            if int(response.headers.get("Content-Length") or 0) > max_bytes:
+                raise ValueError(f"Image is larger than {max_bytes} bytes")
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > max_bytes:
+                    raise ValueError(f"Image is larger than {max_bytes} bytes")
+            return bytes(data)
+    raise ValueError(f"More than {MAX_REDIRECTS} redirects")
+
@@ -0,0 +1,150 @@
+import contextvars
+import os
+import re
+from contextlib import contextmanager
+from pydantic import BaseModel
+import katex
+import metrics
+
+# Cost/latency-aware model routing. A local heuristic estimates the type and difficulty
+# of the input without a model call; each stage then runs on the small tier when the
+# estimated difficulty allows it, and is escalated to the large tier when the small
+# model's output fails validation. Every decision is logged through metrics.py, so
+# the per-model latency and cost there show what routing saves.
+#
+#   AGENTEX_ROUTING=on           enable routing; off (the default) keeps every stage on
+#                                its agent's model
+#   AGENTEX_SMALL_MODEL / AGENTEX_LARGE_MODEL
+
+ENABLED = os.getenv("AGENTEX_ROUTING", "off").lower() in ("1", "on", "true", "yes")
+TIERS = {
+    "small": os.getenv("AGENTEX_SMALL_MODEL", "gpt-4o-mini"),
+    "large": os.getenv("AGENTEX_LARGE_MODEL", "gpt-4o"),
+}
+# Estimated difficulty levels each stage may run on the small tier
+SMALL_TIER_DIFFICULTIES = {
+    "latex": {"easy", "medium"},
+    "classification": {"easy", "medium"},
+    "solution": {"easy"},
+    "fused": {"easy"},  # the single call of fused mode
+}
+
+TYPE_KEYWORDS = {
+    "calculus": ("integral", "integrate", "derivative", "differentiate", "limit", "lim", "d/dx", "dy/dx", "∫", "∂"),
+    "linear algebra": ("matrix", "determinant", "eigenvalue", "eigenvector", "vector", "pmatrix"),
+    "probability": ("probability", "dice", "die", "coin", "random", "expected value", "variance"),
+    "geometry": ("triangle", "circle", "radius", "area", "perimeter", "polygon", "volume", "angle"),
+    "trigonometry": ("sin", "cos", "tan", "sec", "csc", "cot", "radian"),
+}
+HARD_KEYWORDS = (
+    "prove", "proof", "show that", "induction", "differential equation", "series", "converge", "eigenvalue",
+)
+MATH_SYMBOLS = set("^_/*=<>()[]{}+-√∫∑∏π±≤≥≠∞")
+
+_routed_model = contextvars.ContextVar("agentex_routed_model", default=None)
+
+
+class Estimate(BaseModel):
+    math_type: str
+    difficulty_level: str  # easy, medium or hard
+    score: int
+    length: int
+    symbol_density: float
+
+
+class Route(BaseModel):
+    stage: str
+    tier: str
+    model: str
+    escalation: str | None = None  # model to retry with when validation fails
+    estimate: Estimate
+
+
+def _has_keyword(lowered, keyword):
+    if keyword.isalpha():
+        return re.search(rf"\b{re.escape(keyword)}\b", lowered) is not None
+    return keyword in lowered
+
+
+def estimate(text):
+    """Guess type and difficulty from keywords, symbol density and length (no model call)"""
+    lowered = text.lower()
+    stripped = "".join(text.split())
+    symbol_density = sum(char in MATH_SYMBOLS for char in stripped) / len(stripped) if stripped else 0.0
+
+    math_type = next(
+        (kind for kind, keywords in TYPE_KEYWORDS.items() if any(_has_keyword(lowered, k) for k in keywords)),
+        None,
+    )
+    if math_type is None:
+        math_type = "arithmetic" if not re.search(r"[A-Za-z]", text) else "algebra"
+
+    score = 0
+    score += 2 if len(text) > 200 else 1 if len(text) > 80 else 0
+    score += 1 if symbol_density > 0.25 else 0
+    score += 3 if any(_has_keyword(lowered, k) for k in HARD_KEYWORDS) else 0
+    score += {"calculus": 2, "linear algebra": 2, "probability": 1, "trigonometry": 1}.get(math_type, 0)
+    score += 1 if text.count("=") > 1 else 0
+    score += 1 if len(set(re.findall(r"\b[a-z]\b", text))) > 2 else 0
+    score -= 1 if math_type == "arithmetic" else 0
+
+    difficulty = "easy" if score <= 1 else "medium" if score <= 3 else "hard"
+    return Estimate(
+        math_type=math_type,
+        difficulty_level=difficulty,
+        score=score,
+        length=len(text),
+        symbol_density=round(symbol_density, 3),
+    )
+
+
+class Router:
+    """Picks a model tier per stage from the local estimate and logs each decision"""
+
+    def __init__(self, tiers=None, small_tier_difficulties=None):
+        self.tiers = {**TIERS, **(tiers or {})}
+        self.small_tier_difficulties = small_tier_difficulties or SMALL_TIER_DIFFICULTIES
+
+    def route(self, stage, text):
+        guess = estimate(text)
+        small = guess.difficulty_level in self.small_tier_difficulties.get(stage, set())
+        route = Route(
+            stage=stage,
+            tier="small" if small else "large",
+            model=self.tiers["small" if small else "large"],
+            escalation=self.tiers["large"] if small else None,
+            estimate=guess,
+        )
+        metrics.registry.inc("agentex_route_decisions_total", {"stage": stage, "tier": route.tier})
+        metrics.log_event("route", **route.model_dump())
+        return route
+
+    def escalate(self, route, reason):
+        metrics.registry.inc("agentex_route_escalations_total", {"stage": route.stage})
+        metrics.log_event("escalation", stage=route.stage, model=route.model, escalation=route.escalation, reason=reason)
+        return route.model_copy(update={"tier": "large", "model": route.escalation, "escalation": None})
+
+
+def acceptable(stage, output):
+    """Checks beyond the schema that a small-tier output is usable; failures are escalated"""
+    if stage == "latex":
+        return bool(output.latex_code.strip()) and not katex.validate(output.latex_code)
+    if stage == "classification":
+        return bool(output.math_type.strip())
+    if stage == "solution":
+        return bool(output.solution_steps) and bool(output.final_answer.strip())
+    return True
+
+
+@contextmanager
+def use_model(model):
+    """Make tools called inside this block use the routed ``model``"""
+    token = _routed_model.set(model)
+    try:
+        yield
+    finally:
+        _routed_model.reset(token)
+
+
+def routed_model(default):
+    return _routed_model.get() or default
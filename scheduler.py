@@ -0,0 +1,208 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+# Central gate for every request the OpenAI client sends (agents, tools, vision, repairs),
+# installed as httpx event hooks in clients.py:
+#
+# - token buckets for requests per minute and estimated tokens per minute
+# - priority lanes: an interactive request waiting for capacity always goes before a
+#   batch request, so the app stays responsive while bulk jobs run
+# - a shared cooldown after a 429, honoring Retry-After or else exponential backoff
+#   with jitter, so one rate-limited call pauses every lane instead of each call
+#   hammering the API on its own; the SDK then retries the failed request itself
+#
+#   AGENTEX_RPM / AGENTEX_TPM   limits (0 disables that bucket)
+
+RPM = int(os.getenv("AGENTEX_RPM", "500"))
+TPM = int(os.getenv("AGENTEX_TPM", "300000"))
+LANES = {"interactive": 0, "batch": 1}  # lower goes first
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Token estimate for an image input and for a reply without max_tokens
+IMAGE_TOKENS = 765
+DEFAULT_COMPLETION_TOKENS = 512
+POLL_INTERVAL = 0.05
+
+_lane = contextvars.ContextVar("agentex_lane", default="interactive")
+
+
+class TokenBucket:
+    """Refills ``per_minute`` units per minute, holding at most one minute's worth"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self, amount, now):
+        """Seconds until ``amount`` units are available (0 if they are now)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class Scheduler:
+    def __init__(self, rpm=RPM, tpm=TPM):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._waiting = []  # heap of (lane priority, arrival) entries
+        self._arrivals = itertools.count()
+        self.cooldown_until = 0.0
+        self.consecutive_limits = 0
+        self.depths = {lane: 0 for lane in LANES}
+        self.throttle_wait = {lane: 0.0 for lane in LANES}
+        self.rate_limited = 0
+
+    def _delay(self, tokens, now):
+        delays = [self.cooldown_until - now]
+        if self.requests:
+            delays.append(self.requests.delay(1, now))
+        if self.tokens:
+            delays.append(self.tokens.delay(tokens, now))
+        return max(delays)
+
+    async def acquire(self, tokens, lane=None):
+        """Wait until a request of ``tokens`` estimated tokens may be sent; returns the seconds waited"""
+        lane = lane or _lane.get()
+        entry = (LANES[lane], next(self._arrivals))
+        started = time.monotonic()
+        with self._lock:
+            heapq.heappush(self._waiting, entry)
+            self.depths[lane] += 1
+            metrics.registry.set_gauge("agentex_scheduler_waiting", {"lane": lane}, self.depths[lane])
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    # Only the highest-priority, longest-waiting request may take capacity
+                    delay = self._delay(tokens, now) if self._waiting[0] == entry else POLL_INTERVAL
+                    if delay <= 0:
+                        heapq.heappop(self._waiting)
+                        if self.requests:
+                            self.requests.take(1)
+                        if self.tokens:
+                            self.tokens.take(tokens)
+                        break
+                await asyncio.sleep(min(max(delay, 0.001), POLL_INTERVAL))
+        finally:
+            with self._lock:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                self.depths[lane] -= 1
+                metrics.registry.set_gauge("agentex_scheduler_waiting", {"lane": lane}, self.depths[lane])
+                waited = time.monotonic() - started
+                self.throttle_wait[lane] += waited
+        return waited
+
+    def backoff(self, retry_after=None):
+        """Pause every lane after a 429, for Retry-After or an exponential delay with jitter"""
+        with self._lock:
+            self.rate_limited += 1
+            self.consecutive_limits += 1
+            if retry_after is None:
+                ceiling = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.consecutive_limits - 1))
+                retry_after = random.uniform(ceiling / 2, ceiling)
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        self.consecutive_limits = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "waiting": dict(self.depths),
+                "throttle_wait_seconds": {lane: round(wait, 3) for lane, wait in self.throttle_wait.items()},
+                "rate_limited": self.rate_limited,
+                "cooldown_seconds": round(max(0.0, self.cooldown_until - time.monotonic()), 3),
+            }
+
+
+scheduler = Scheduler()
+
+
+@contextmanager
+def lane(name):
+    """Send every model call made inside this block (including tasks it starts) through ``name``"""
+    if name not in LANES:
+        raise ValueError(f"Unknown lane {name!r}; expected one of {tuple(LANES)}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def estimate_tokens(body):
+    """Rough prompt plus completion tokens for a Chat Completions or Responses request body"""
+    text_chars = 0
+    images = 0
+
+    def walk(value):
+        nonlocal text_chars, images
+        if isinstance(value, dict):
+            if value.get("type") in ("image_url", "input_image"):
+                images += 1
+                return
+            for item in value.values():
+                walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+        elif isinstance(value, str):
+            text_chars += len(value)
+
+    walk(body.get("messages") or body.get("input") or [])
+    walk(body.get("instructions") or "")
+    completion = body.get("max_tokens") or body.get("max_completion_tokens") or body.get("max_output_tokens")
+    return text_chars // 4 + images * IMAGE_TOKENS + (completion or DEFAULT_COMPLETION_TOKENS)
+
+
+async def on_request(http_request):
+    """httpx request hook: wait for rate-limit capacity in the caller's lane"""
+    body = {}
+    # Uploads (e.g. Batch API input files) are streamed multipart bodies with no tokens to estimate
+    if http_request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = json.loads(http_request.content or b"{}")
+        except ValueError:
+            pass
+    current_lane = _lane.get()
+    waited = await scheduler.acquire(estimate_tokens(body) if isinstance(body, dict) else 1, current_lane)
+    metrics.registry.inc("agentex_throttle_wait_seconds_total", {"lane": current_lane}, waited)
+    call = metrics.current_call()
+    if call is not None:
+        call.queue_wait += waited
+
+
+async def on_response(http_response):
+    """httpx response hook: start a shared cooldown on 429"""
+    if http_response.status_code != 429:
+        scheduler.succeeded()
+        return
+    metrics.registry.inc("agentex_rate_limited_total", {})
+    scheduler.backoff(retry_after_seconds(http_response.headers))
+
+
+def retry_after_seconds(headers):
+    for name, scale in (("retry-after-ms", 1000.0), ("retry-after", 1.0)):
+        try:
+            return float(headers[name]) / scale
+        except (KeyError, ValueError):
+            continue
+    return None
@@ -0,0 +1,112 @@
+import asyncio
+import io
+import numpy as np
+from models import ProblemResult
+from preprocess import CROP_THRESHOLD, download_image, open_image
+import vision
+
+# Splits a worksheet photo into one region per problem with projection profiles: blank
+# horizontal bands separate rows of problems, and wide blank vertical bands inside a row
+# separate columns. Each crop is parsed and solved on its own, concurrently, so the
+# vision model sees fewer pixels per call and the page takes as long as its slowest problem.
+
+# Blank bands at least this tall (fraction of page height, and pixels) separate problems
+ROW_GAP_FRACTION = 0.02
+MIN_ROW_GAP = 12
+# Blank bands at least this wide (fraction of page width) separate columns within a row
+COLUMN_GAP_FRACTION = 0.06
+# Regions smaller than this (fraction of page area) are specks or page furniture
+MIN_REGION_FRACTION = 0.002
+REGION_PADDING = 12
+# Pages that split into more regions than this are parsed whole
+MAX_REGIONS = 24
+MAX_PARALLEL_REGIONS = 8
+
+
+def content_mask(image, threshold=CROP_THRESHOLD):
+    """Boolean array, True where a pixel is darker than ``threshold``"""
+    return np.asarray(image.convert("L")) < threshold
+
+
+def runs(profile, min_gap):
+    """(start, end) spans of ``profile`` that hold content, split at blank gaps of ``min_gap`` or more"""
+    filled = np.flatnonzero(profile)
+    if filled.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(filled) > min_gap)
+    starts = np.concatenate(([filled[0]], filled[breaks + 1]))
+    ends = np.concatenate((filled[breaks], [filled[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def find_regions(image, threshold=CROP_THRESHOLD):
+    """Problem bounding boxes (left, top, right, bottom) in reading order"""
+    mask = content_mask(image, threshold)
+    height, width = mask.shape
+    row_gap = max(MIN_ROW_GAP, int(height * ROW_GAP_FRACTION))
+    column_gap = int(width * COLUMN_GAP_FRACTION)
+    min_area = width * height * MIN_REGION_FRACTION
+
+    regions = []
+    for top, bottom in runs(mask.any(axis=1), row_gap):
+        band = mask[top:bottom]
+        for left, right in runs(band.any(axis=0), column_gap):
+            # Tighten the box vertically to the content of this column
+            rows = runs(band[:, left:right].any(axis=1), 0)
+            box = (left, top + rows[0][0], right, top + rows[-1][1])
+            if (box[2] - box[0]) * (box[3] - box[1]) >= min_area:
+                regions.append(box)
+    return regions
+
+
+def pad(box, width, height, padding=REGION_PADDING):
+    left, top, right, bottom = box
+    return (max(left - padding, 0), max(top - padding, 0), min(right + padding, width), min(bottom + padding, height))
+
+
+def segment_image(image_bytes, threshold=CROP_THRESHOLD):
+    """Split a page into problem crops; returns [(box, PNG bytes)], or one whole-page entry"""
+    image = open_image(image_bytes).convert("L")
+    regions = find_regions(image, threshold)
+    if not 1 < len(regions) <= MAX_REGIONS:
+        return [((0, 0, image.width, image.height), image_bytes)]
+
+    crops = []
+    for box in regions:
+        box = pad(box, image.width, image.height)
+        buffer = io.BytesIO()
+        image.crop(box).save(buffer, format="PNG", optimize=True)
+        crops.append((box, buffer.getvalue()))
+    return crops
+
+
+async def parse_problem(index, box, crop_bytes, pipeline, cache, pipeline_options, **options):
+    text = ""
+    try:
+        text, _ = await vision.parse_image_bytes(crop_bytes, cache, **options)
+    except Exception as e:
+        return ProblemResult(index=index, box=box, text=text, errors={"vision": str(e) or type(e).__name__})
+    result = await pipeline.run(text, **pipeline_options)
+    return ProblemResult(index=index, box=box, **result.model_dump())
+
+
+async def parse_worksheet(image_bytes, pipeline, cache, pipeline_options=None, **options):
+    """Segment a page and parse and solve every problem concurrently.
+
+    Returns one ProblemResult per region, in reading order. ``pipeline_options``
+    are passed to ``pipeline.run`` (e.g. ``modes`` or ``fused``) and ``options``
+    to ``preprocess_image`` for each crop.
+    """
+    crops = await asyncio.to_thread(segment_image, image_bytes)
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_REGIONS)
+
+    async def limited(index, box, crop_bytes):
+        async with semaphore:
+            return await parse_problem(index, box, crop_bytes, pipeline, cache, pipeline_options or {}, **options)
+
+    return list(await asyncio.gather(*(limited(index, box, crop) for index, (box, crop) in enumerate(crops))))
+
+
+async def parse_worksheet_url(image_url, pipeline, cache, pipeline_options=None, **options):
+    image_bytes = await asyncio.to_thread(download_image, image_url)
+    return await parse_worksheet(image_bytes, pipeline, cache, pipeline_options, **options)
@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import base64
+import binascii
+import io
+import itertools
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from PIL import Image, UnidentifiedImageError
+from pydantic import ValidationError
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+from main import text_pipeline, result_cache
+import metrics
+import preprocess
+import scheduler
+import segmentation
+import vision
+from models import JobRequest, JobStatus
+
+# ASGI service running the same image, URL and text pipelines as the CLI and the app:
+#
+#   POST /v1/process     run a request and wait for the result (202 + job if it takes too long)
+#   POST /v1/jobs        queue a request, returns 202 with the job id (batch priority)
+#   GET  /v1/jobs/{id}   job status and, once done, its result
+#   GET  /healthz        queue depths, worker counts and rate-limit throttling
+#   GET  /metrics        Prometheus metrics (see metrics.py)
+#
+# Requests go through one bounded queue drained by a fixed worker pool; when the queue
+# is full the service answers 429 instead of piling up work. Synchronous requests use
+# the interactive lane and jobs the batch lane, both in this queue and in the model
+# call scheduler (scheduler.py). Job state lives in the process, so job polling needs
+# sticky routing when several instances are load balanced. Malformed requests (bad JSON,
+# base64 or image, unknown stages, image URLs of private hosts) get 400, bodies over AGENTEX_MAX_BODY_BYTES get 413,
+# and a /v1/process request whose job fails gets 502 with the failed job.
+
+WORKERS = int(os.getenv("AGENTEX_WORKERS", "8"))
+QUEUE_SIZE = int(os.getenv("AGENTEX_QUEUE_SIZE", "64"))
+# Seconds /v1/process waits before handing back a job to poll instead
+SYNC_TIMEOUT = float(os.getenv("AGENTEX_SYNC_TIMEOUT", "60"))
+# Seconds finished jobs are kept for polling
+JOB_TTL = float(os.getenv("AGENTEX_JOB_TTL", "3600"))
+# Largest request body accepted, base64 images included
+MAX_BODY_BYTES = int(os.getenv("AGENTEX_MAX_BODY_BYTES", str(25 * 1024 * 1024)))
+RETRY_AFTER = 1
+
+
+class QueueFull(Exception):
+    pass
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def decode_image(image_base64):
+    """Bytes of a base64 image; raises ValueError unless they decode to an image Pillow can read"""
+    try:
+        # Line breaks are allowed, as in the output of the base64 tool
+        image_bytes = base64.b64decode("".join(image_base64.split()), validate=True)
+    except binascii.Error as e:
+        raise ValueError(f"'image_base64' is not valid base64: {e}") from None
+    try:
+        Image.open(io.BytesIO(image_bytes)).verify()
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise ValueError(f"'image_base64' is not a readable image: {e}") from None
+    return image_bytes
+
+
+async def execute(request, request_id=None, queue_wait=0.0):
+    """Run one JobRequest; returns a PipelineResult, or a list of ProblemResult when segmenting"""
+    options = {"grayscale": request.grayscale, "enhance_contrast": request.enhance_contrast}
+    pipeline_options = {"modes": request.modes, "fused": request.fused, "stages": request.stages}
+    with metrics.request(request_id, queue_wait):
+        if request.text is not None:
+            return await text_pipeline.run(request.text, **pipeline_options)
+
+        if request.image_base64 is not None:
+            image_bytes = base64.b64decode(request.image_base64)  # checked by read_job_request
+            if request.segment:
+                return await segmentation.parse_worksheet(
+                    image_bytes, text_pipeline, result_cache, pipeline_options, **options
+                )
+            text, _ = await vision.parse_image_bytes(image_bytes, result_cache, **options)
+        elif request.segment:
+            return await segmentation.parse_worksheet_url(
+                request.image_url, text_pipeline, result_cache, pipeline_options, **options
+            )
+        else:
+            text, _ = await vision.parse_image_url(request.image_url, result_cache, **options)
+        return await text_pipeline.run(text, **pipeline_options)
+
+
+class JobQueue:
+    """Bounded priority job queue with a fixed pool of worker tasks"""
+
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, job_ttl=JOB_TTL):
+        self.queue = asyncio.PriorityQueue(maxsize=queue_size)
+        self.arrivals = itertools.count()
+        self.depths = {lane: 0 for lane in scheduler.LANES}
+        self.worker_count = workers
+        self.job_ttl = job_ttl
+        self.jobs = {}  # id -> JobStatus
+        self.done = {}  # id -> asyncio.Event set when the job finishes
+        self.running = 0
+        self.workers = []
+
+    def start(self):
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def submit(self, request, lane="interactive"):
+        """Queue a JobRequest in ``lane`` and return its JobStatus; raises QueueFull when at capacity"""
+        self.expire()
+        job = JobStatus(id=uuid.uuid4().hex, status="queued", submitted_at=time.time())
+        entry = (scheduler.LANES[lane], next(self.arrivals), lane, job.id, request, time.perf_counter())
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            raise QueueFull(f"Queue is full ({self.queue.maxsize} jobs waiting)") from None
+        self.depths[lane] += 1
+        self.jobs[job.id] = job
+        self.done[job.id] = asyncio.Event()
+        return job
+
+    async def wait(self, job_id, timeout):
+        """Wait up to ``timeout`` seconds for a job; returns its JobStatus either way"""
+        try:
+            await asyncio.wait_for(self.done[job_id].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.jobs[job_id]
+
+    async def worker(self):
+        while True:
+            _, _, lane, job_id, request, enqueued_at = await self.queue.get()
+            self.depths[lane] -= 1
+            job = self.jobs[job_id]
+            job.status = "running"
+            self.running += 1
+            try:
+                with scheduler.lane(lane):
+                    job.result = await execute(request, job_id, time.perf_counter() - enqueued_at)
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e) or type(e).__name__
+            finally:
+                self.running -= 1
+                job.finished_at = time.time()
+                self.done[job_id].set()
+                self.queue.task_done()
+
+    def expire(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+            del self.done[job_id]
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "queued_by_lane": dict(self.depths),
+            "queue_size": self.queue.maxsize,
+            "running": self.running,
+            "workers": self.worker_count,
+            "jobs": len(self.jobs),
+        }
+
+
+jobs = JobQueue()
+
+
+def error(status, message, headers=None):
+    return JSONResponse({"error": message}, status_code=status, headers=headers)
+
+
+async def read_job_request(request):
+    """Parse and check a JobRequest body; returns (JobRequest, None) or (None, error response)"""
+    try:
+        job_request = JobRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        return None, error(400, e.errors(include_url=False, include_context=False, include_input=False))
+    inputs = [job_request.text, job_request.image_url, job_request.image_base64]
+    if sum(value is not None for value in inputs) != 1:
+        return None, error(400, "Provide exactly one of 'text', 'image_url' and 'image_base64'")
+    try:
+        text_pipeline.resolve_modes(job_request.modes)
+        text_pipeline.resolve_stages(job_request.stages)
+        if job_request.image_base64 is not None:
+            await asyncio.to_thread(decode_image, job_request.image_base64)
+    except ValueError as e:
+        return None, error(400, str(e))
+    if job_request.image_url is not None:
+        try:
+            await asyncio.to_thread(preprocess.check_url, job_request.image_url)
+        except preprocess.UnsafeURL as e:
+            return None, error(400, str(e))
+        except ValueError:
+            pass  # unresolvable here; the Vision API is handed the URL instead
+    return job_request, None
+
+
+def submit(job_request, lane):
+    try:
+        return jobs.submit(job_request, lane), None
+    except QueueFull as e:
+        return None, error(429, str(e), {"Retry-After": str(RETRY_AFTER)})
+
+
+def job_response(job, failed_status=200):
+    status = (failed_status if job.status == "failed" else 200) if job.finished_at else 202
+    return JSONResponse(job.model_dump(mode="json"), status_code=status, headers={"Location": f"/v1/jobs/{job.id}"})
+
+
+async def process(request):
+    job_request, failure = await read_job_request(request)
+    if failure:
+        return failure
+    job, failure = submit(job_request, "interactive")
+    if failure:
+        return failure
+    return job_response(await jobs.wait(job.id, SYNC_TIMEOUT), failed_status=502)
+
+
+async def create_job(request):
+    job_request, failure = await read_job_request(request)
+    if failure:
+        return failure
+    job, failure = submit(job_request, "batch")
+    if failure:
+        return failure
+    return job_response(job)
+
+
+async def get_job(request):
+    job = jobs.jobs.get(request.path_params["job_id"])
+    if job is None:
+        return error(404, "Unknown or expired job")
+    return job_response(job)
+
+
+async def health(request):
+    return JSONResponse({"status": "ok", **jobs.stats(), "scheduler": scheduler.scheduler.stats()})
+
+
+async def prometheus(request):
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+class BodySizeLimit:
+    """ASGI middleware answering 413 to request bodies larger than ``max_bytes``"""
+
+    def __init__(self, app, max_bytes=MAX_BODY_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        too_large = error(413, f"Request body is larger than {self.max_bytes} bytes")
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await too_large(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            # Chunked bodies carry no Content-Length, so count what actually arrives
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise BodyTooLarge()
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        except BodyTooLarge:
+            await too_large(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    jobs.start()
+    try:
+        yield
+    finally:
+        await jobs.stop()
+
+
+app = Starlette(
+    routes=[
+        Route("/v1/process", process, methods=["POST"]),
+        Route("/v1/jobs", create_job, methods=["POST"]),
+        Route("/v1/jobs/{job_id}", get_job, methods=["GET"]),
+        Route("/healthz", health, methods=["GET"]),
+        Route("/metrics", prometheus, methods=["GET"]),
+    ],
+    middleware=[Middleware(BodySizeLimit)],
+    lifespan=lifespan,
+)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="HTTP API for the LaTeX image parser.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Jobs processed at once")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Jobs waiting before 429")
+    args = parser.parse_args()
+
+    global jobs
+    jobs = JobQueue(args.workers, args.queue_size)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
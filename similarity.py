@@ -0,0 +1,33 @@
+import re
+import unicodedata
+
+# Retyped problems share cache and history entries: text is canonicalized (Unicode math
+# symbols, superscripts, whitespace and spacing around operators) before it is hashed into
+# a key. Text is only matched exactly after that: in a math problem, a "near" match usually
+# differs in a number.
+#
+# Images are matched by their exact bytes only. Perceptual hashes were tried and dropped:
+# they cannot tell "t = 3" from "t = 4" on a page of text, and any check strict enough to
+# do so also rejects rescaled and re-compressed copies, so near-duplicate images never hit.
+
+SYMBOLS = {
+    "×": "*", "·": "*", "⋅": "*", "∗": "*", "÷": "/", "∕": "/", "−": "-", "–": "-", "—": "-",
+    "≤": "<=", "≥": ">=", "≠": "!=", "≈": "~", "√": "sqrt", "π": "pi", "∞": "inf",
+    "∫": "integral", "∑": "sum", "∏": "prod", "′": "'", "“": '"', "”": '"', "‘": "'", "’": "'",
+}
+SUPERSCRIPTS = dict(zip("⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻⁼⁽⁾ⁿ", "0123456789+-=()n"))
+SUBSCRIPTS = dict(zip("₀₁₂₃₄₅₆₇₈₉₊₋₌₍₎", "0123456789+-=()"))
+OPERATOR_SPACING = re.compile(r"\s*([-+*/^=<>!~(),\[\]{}|_])\s*")
+
+
+def canonical_text(text):
+    """Spelling-independent form of a problem for cache keys: "x² + 3×x" -> "x^2+3*x" """
+    # Superscripts and subscripts first: NFKC would turn "x²" into "x2"
+    text = re.sub(
+        f"[{''.join(SUPERSCRIPTS)}]+", lambda m: "^" + "".join(SUPERSCRIPTS[c] for c in m.group()), text
+    )
+    text = re.sub(f"[{''.join(SUBSCRIPTS)}]+", lambda m: "_" + "".join(SUBSCRIPTS[c] for c in m.group()), text)
+    text = unicodedata.normalize("NFKC", text)
+    text = "".join(SYMBOLS.get(char, char) for char in text)
+    text = OPERATOR_SPACING.sub(r"\1", " ".join(text.split()))
+    return text.strip()
@@ -0,0 +1,40 @@
+import os
+import sys
+from pathlib import Path
+import pytest
+
+# Every test runs against one local fake OpenAI server (fake_openai.py). The modules read
+# their configuration when imported, so the environment is set before any of them is.
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fake_openai  # noqa: E402
+
+SERVER = fake_openai.start_server()
+os.environ.update(
+    OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "test"),
+    AGENTEX_BACKEND="local",
+    AGENTEX_LOCAL_URL=SERVER.base_url,
+    AGENTEX_CACHE_PATH="",
+    AGENTEX_HISTORY_PATH="",
+    AGENTEX_METRICS_LOG="",
+    AGENTEX_ROUTING="off",
+)
+
+
+@pytest.fixture
+def fake_server():
+    """The fake server, with its default configuration restored after the test"""
+    yield SERVER
+    SERVER.config = fake_openai.FakeServerConfig()
+    SERVER.random.seed(None)
+
+
+@pytest.fixture
+def result_cache():
+    """The pipeline's shared result cache, emptied before and after the test"""
+    from main import result_cache
+
+    result_cache.clear()
+    yield result_cache
+    result_cache.clear()
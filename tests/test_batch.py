@@ -0,0 +1,77 @@
+import asyncio
+from PIL import Image
+import batch
+from batch import iter_inputs, run_batch
+from test_batch_api import read_output, write_manifest
+
+
+def test_inputs_from_folder(tmp_path):
+    (tmp_path / "week 1").mkdir()
+    for name in ("b.png", "a.JPG", "week 1/c.webp"):
+        Image.new("RGB", (10, 10)).save(tmp_path / name, format="PNG")
+    (tmp_path / "notes.txt").write_text("not an image")
+    assert [item["id"] for item in iter_inputs(tmp_path)] == ["a.JPG", "b.png", "week 1/c.webp"]
+
+
+def test_inputs_from_manifest(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text('{"text": "x + 1 = 2"}\n\n{"id": "named", "image_url": "https://example.com/a.png"}\n')
+    assert list(iter_inputs(manifest)) == [
+        {"id": "line-1", "text": "x + 1 = 2"},
+        {"id": "named", "image_url": "https://example.com/a.png"},
+    ]
+
+
+def test_malformed_manifest_lines_become_failed_items(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text('{"text": "x = 1"}\n{"text": "x = \n[1, 2]\n{"id": 7, "note": "no payload"}\n')
+    items = list(iter_inputs(manifest))
+    assert items[0] == {"id": "line-1", "text": "x = 1"}
+    assert [item["id"] for item in items] == ["line-1", "line-2", "line-3", "7"]
+    assert "Line 2 is not valid JSON" in items[1]["error"]
+    assert "Line 3 is not a JSON object" in items[2]["error"]
+    assert "Line 4 needs one of" in items[3]["error"]
+
+
+def test_malformed_line_does_not_stop_the_run(tmp_path, fake_server, result_cache):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text('{"id": "broken", "text": \n{"id": "text", "text": "Solve x + 1 = 2"}\n')
+    output = tmp_path / "results.jsonl"
+    for _ in range(2):  # and resuming does not die on it either
+        assert asyncio.run(run_batch(manifest, output))["failed"] == 1
+    records = read_output(output)
+    assert "Line 1 is not valid JSON" in records["line-1"]["errors"]["manifest"]
+    assert not records["text"]["errors"]
+
+
+def test_run_and_resume(tmp_path, fake_server, result_cache):
+    manifest = write_manifest(tmp_path)
+    output = tmp_path / "results.jsonl"
+
+    counts = asyncio.run(run_batch(manifest, output, concurrency=2))
+    assert counts == {"processed": 3, "failed": 1, "skipped": 0}
+    records = read_output(output)
+    assert set(records) == {"image", "text", "missing"}
+    assert records["image"]["latex"] and records["image"]["image_bytes"]["after"] > 0
+    assert records["text"]["solution"]["final_answer"]
+    assert records["text"]["usage"]["input_tokens"] > 0
+    assert "vision" in records["missing"]["errors"]
+    assert set((tmp_path / "results.jsonl.checkpoint").read_text().split()) == {"image", "text"}
+
+    # A restart skips the finished items and retries the failed one
+    counts = asyncio.run(run_batch(manifest, output, concurrency=2))
+    assert counts == {"processed": 1, "failed": 1, "skipped": 2}
+    assert len(output.read_text().splitlines()) == 4
+
+
+def test_items_use_the_batch_lane(tmp_path, fake_server, result_cache, monkeypatch):
+    lanes = []
+
+    async def process_item(item, queue_wait=0.0, fused=False):
+        lanes.append(batch.scheduler._lane.get())
+        return {"id": item["id"], "errors": {}}
+
+    monkeypatch.setattr(batch, "process_item", process_item)
+    asyncio.run(run_batch(write_manifest(tmp_path), tmp_path / "results.jsonl"))
+    assert lanes == ["batch"] * 3
+    assert batch.scheduler._lane.get() == "interactive"
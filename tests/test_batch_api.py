@@ -0,0 +1,118 @@
+import asyncio
+import json
+from openai.resources.batches import AsyncBatches
+from PIL import Image, ImageDraw
+import pytest
+import batch_api
+import fake_openai
+
+
+def write_manifest(tmp_path):
+    image_path = tmp_path / "problem.png"
+    image = Image.new("RGB", (400, 200), "white")
+    ImageDraw.Draw(image).text((50, 80), "x^2 + 3x = 0", fill="black")
+    image.save(image_path)
+    items = [
+        {"id": "image", "image_path": str(image_path)},
+        {"id": "text", "text": "A train travels 60 miles in 1.5 hours. What is its average speed?"},
+        {"id": "missing", "image_path": str(tmp_path / "missing.png")},
+    ]
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("".join(json.dumps(item) + "\n" for item in items))
+    return manifest
+
+
+def read_output(path):
+    return {record["id"]: record for record in map(json.loads, path.read_text().splitlines())}
+
+
+def run_job(workdir, manifest, output, wait=True):
+    job = batch_api.BatchJob(workdir, poll_interval=0.01)
+    return job, asyncio.run(job.run(manifest, output, wait=wait))
+
+
+@pytest.mark.parametrize("batch_delay", [0.0, 0.2])
+def test_results_are_ingested_whether_or_not_batches_finish_at_once(tmp_path, fake_server, result_cache, batch_delay):
+    fake_server.config = fake_openai.FakeServerConfig(batch_delay=batch_delay)
+    output = tmp_path / "results.jsonl"
+    job, counts = run_job(tmp_path / "job", write_manifest(tmp_path), output)
+
+    assert counts == {"items": 3, "failed": 1}
+    records = read_output(output)
+    for item_id in ("image", "text"):
+        assert records[item_id]["errors"] == {}
+        assert records[item_id]["latex"] and records[item_id]["classification"] and records[item_id]["solution"]
+        assert records[item_id]["usage"]["cost_usd"] > 0
+    assert set(records["missing"]["errors"]) == {"vision"}
+    assert all(entry["downloaded"] for phase in job.state["phases"].values() for entry in phase["batches"])
+
+
+def test_no_wait_submits_once_and_resumes(tmp_path, fake_server, result_cache):
+    fake_server.config = fake_openai.FakeServerConfig(batch_delay=0.3)
+    manifest, output = write_manifest(tmp_path), tmp_path / "results.jsonl"
+
+    _, counts = run_job(tmp_path / "job", manifest, output, wait=False)
+    assert counts is None
+    submitted = len(fake_server.batches)
+    _, counts = run_job(tmp_path / "job", manifest, output, wait=False)
+    assert counts is None and len(fake_server.batches) == submitted
+
+    _, counts = run_job(tmp_path / "job", manifest, output)
+    assert counts == {"items": 3, "failed": 1}
+    assert len(fake_server.batches) == submitted + 1  # only the text phase was added
+    # A finished job is not run again
+    assert run_job(tmp_path / "job", manifest, output)[1] == counts
+    assert len(read_output(output)) == 3
+
+
+def test_interrupted_submission_does_not_resubmit(tmp_path, fake_server, result_cache, monkeypatch):
+    monkeypatch.setattr(batch_api, "MAX_BATCH_REQUESTS", 2)
+    manifest, output = write_manifest(tmp_path), tmp_path / "results.jsonl"
+    real_create, created = AsyncBatches.create, []
+
+    async def create_until_interrupted(self, **kwargs):
+        if len(created) == 2:
+            raise RuntimeError("connection lost")
+        created.append(await real_create(self, **kwargs))
+        return created[-1]
+
+    monkeypatch.setattr(AsyncBatches, "create", create_until_interrupted)
+    with pytest.raises(RuntimeError):
+        run_job(tmp_path / "job", manifest, output)
+    monkeypatch.setattr(AsyncBatches, "create", real_create)
+
+    job, counts = run_job(tmp_path / "job", manifest, output)
+    requests = sum(1 for _ in batch_api.read_jsonl(job.path("text.requests.jsonl")))
+    text_batches = job.state["phases"]["text"]["batches"]
+    assert len(text_batches) == -(-requests // 2)
+    assert len({entry["id"] for entry in text_batches}) == len(text_batches)
+    assert counts == {"items": 3, "failed": 1}
+
+
+def test_failed_stage_requests_are_reported_per_stage(tmp_path, fake_server, result_cache, monkeypatch):
+    # Every request inside the batches fails; uploading and creating them still works
+    output_line = fake_openai.batch_output_line
+    monkeypatch.setattr(fake_openai, "batch_output_line", lambda line, _, rng: output_line(line, 1.0, rng))
+    output = tmp_path / "results.jsonl"
+    _, counts = run_job(tmp_path / "job", write_manifest(tmp_path), output)
+
+    assert counts["failed"] == 3
+    records = read_output(output)
+    assert set(records["image"]["errors"]) == {"vision"}
+    assert set(records["text"]["errors"]) == {"latex", "classification", "solution"}
+
+
+def test_custom_ids_round_trip_item_ids_containing_the_separator():
+    assert batch_api.split_custom_id(batch_api.custom_id("scan#12", "latex")) == ("scan#12", "latex")
+
+
+def test_duplicate_ids_fail_before_anything_is_written(tmp_path, fake_server, result_cache):
+    manifest = tmp_path / "manifest.jsonl"
+    # An explicit id can also collide with the default id of another line
+    manifest.write_text('{"id": "a", "text": "x = 1"}\n{"id": "line-3", "text": "x = 2"}\n{"text": "x = 3"}\n'
+                        '{"id": "a", "text": "x = 4"}\n')
+    requests = fake_server.request_count
+    with pytest.raises(batch_api.DuplicateItemIds, match="'line-3', 'a'"):
+        run_job(tmp_path / "job", manifest, tmp_path / "results.jsonl")
+    assert not (tmp_path / "job" / "vision.requests.jsonl").exists()
+    assert fake_server.request_count == requests
@@ -0,0 +1,91 @@
+import asyncio
+import io
+import sqlite3
+from PIL import Image, ImageDraw, ImageFont
+import pytest
+from cache import ResultCache, make_key
+from main import text_pipeline
+from models import ImageParser, LatexOutput
+import vision
+
+LATEX = LatexOutput(latex_code="x^2", description="x squared")
+
+
+def page():
+    image = Image.new("RGB", (600, 200), "white")
+    ImageDraw.Draw(image).text((40, 60), "Solve 2x + 1 = 7", fill="black", font=ImageFont.load_default(size=28))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache.sqlite3")
+
+
+def parse(text):
+    return ImageParser(is_valid=True, text=text)
+
+
+def test_results_survive_reopening(cache_path):
+    ResultCache(cache_path).set("latex:m:v:a", LATEX)
+    reopened = ResultCache(cache_path)
+    assert reopened.get("latex:m:v:a") == LATEX
+    assert reopened.stats["disk_hits"] == 1
+
+
+def test_expired_results_are_misses(cache_path):
+    cache = ResultCache(cache_path, ttl=-1)
+    cache.set("latex:m:v:a", LATEX)
+    assert cache.get("latex:m:v:a") is None
+    assert cache.stats["misses"] == 1
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(None, max_entries=2)
+    for key in "abc":
+        cache.set(key, parse(key))
+    assert cache.get("a") is None
+    assert cache.get("c") == parse("c")
+
+
+def test_only_model_results_are_cached():
+    with pytest.raises(TypeError):
+        ResultCache(None).set("key", {"text": "x"})
+
+
+def test_retyped_text_shares_a_key():
+    assert make_key("latex", "x² + 1 = 0", "m", "v") == make_key("latex", "x^2+1=0", "m", "v")
+    assert make_key("latex", "x^2+1=0", "m", "v") != make_key("latex", "x^2+2=0", "m", "v")
+
+
+def test_clear_empties_both_tiers(cache_path):
+    cache = ResultCache(cache_path)
+    cache.set("latex:m:v:a", LATEX)
+    cache.clear()
+    assert cache.get("latex:m:v:a") is None
+    assert ResultCache(cache_path).get("latex:m:v:a") is None
+
+
+def test_old_image_index_is_dropped(cache_path):
+    db = sqlite3.connect(cache_path)
+    db.execute("CREATE TABLE image_fingerprints (key TEXT PRIMARY KEY, pixels BLOB)")
+    db.commit()
+    ResultCache(cache_path)
+    assert db.execute("SELECT name FROM sqlite_master WHERE name = 'image_fingerprints'").fetchone() is None
+
+
+def test_repeated_inputs_are_served_from_the_cache(fake_server, result_cache):
+    async def convert(image_bytes, text):
+        parsed = await vision.parse_image_bytes(image_bytes, result_cache)
+        return parsed, await text_pipeline.run(text)
+
+    first = asyncio.run(convert(page(), "Solve 2x + 1 = 7"))
+    requests = fake_server.request_count
+    # Same image, and the same text retyped with different spacing
+    second = asyncio.run(convert(page(), "Solve 2x+1=7"))
+    assert fake_server.request_count == requests
+    assert second[0][0] == first[0][0]
+    assert second[1].solution == first[1].solution
+    assert result_cache.stats["hits"] >= 4
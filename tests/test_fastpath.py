@@ -0,0 +1,63 @@
+import pytest
+import fastpath
+from fastpath import to_latex, try_convert
+
+
+@pytest.mark.parametrize(
+    "text, latex",
+    [
+        ("x^2 + 3x - 4 = 0", "x^{2} + 3x - 4 = 0"),
+        ("sqrt(pi)/2", r"\frac{\sqrt{\pi}}{2}"),
+        ("b^2 - 4ac >= 0", r"b^{2} - 4ac \geq 0"),
+        ("x² − 1 ≠ 0", r"x^{2} - 1 \neq 0"),
+        ("|x - 1| < 2", r"\left|x - 1\right| < 2"),
+        ("sin(x)^2 + cos(x)^2 = 1", r"\sin(x)^{2} + \cos(x)^{2} = 1"),
+        ("2e^x", "2e^{x}"),
+        ("2x + 3e", "2x + 3e"),
+    ],
+)
+def test_converts_plain_notation(text, latex):
+    assert to_latex(text) == latex
+
+
+@pytest.mark.parametrize(
+    "text, latex",
+    [
+        ("3.5e10", r"3.5\times10^{10}"),
+        ("c = 3E8", r"c = 3\times10^{8}"),
+        ("q = 1.6e-19", r"q = 1.6\times10^{-19}"),
+        ("6.02e+23 x", r"6.02\times10^{23} x"),
+        ("3.5e10^2", r"(3.5\times10^{10})^{2}"),
+    ],
+)
+def test_scientific_notation_is_one_number(text, latex):
+    assert to_latex(text) == latex
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Find the area of the triangle", "x = ", "f(x", "x $ 2", "line one\nline two", "x + " * 100,
+        "two", "cat", "x + cat", "ac 4",
+    ],
+)
+def test_falls_back_on_what_it_does_not_understand(text):
+    assert to_latex(text) is None
+
+
+@pytest.mark.parametrize("text", ["x/2y", "1/2 x", "(x + 1)/2 (x - 1)"])
+def test_implicit_product_after_division_is_ambiguous(text):
+    assert to_latex(text) is None
+
+
+def test_explicit_operators_after_division():
+    assert to_latex("x/2*y") == r"\frac{x}{2} \cdot y"
+    assert to_latex("2x/3 + y") == r"\frac{2x}{3} + y"
+
+
+def test_try_convert_counts_outcomes(monkeypatch):
+    monkeypatch.setattr(fastpath, "stats", {"served": 0, "fallback": 0})
+    assert try_convert("x + 1 = 2").latex_code == "x + 1 = 2"
+    assert try_convert("Explain why the sky is blue") is None
+    assert fastpath.stats == {"served": 1, "fallback": 1}
+    assert fastpath.served_fraction() == 0.5
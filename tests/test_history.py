@@ -0,0 +1,104 @@
+import io
+import subprocess
+import sys
+from pathlib import Path
+from PIL import Image
+import pytest
+import history
+from history import History, input_hash, make_thumbnail
+from models import LatexOutput, MathClassification, MathSolution, PipelineResult, ProblemResult
+
+
+def result(text, math_type="algebra", concepts=("linear equations",), difficulty="easy"):
+    return PipelineResult(
+        text=text,
+        latex=LatexOutput(latex_code=text, description=""),
+        classification=MathClassification(
+            math_type=math_type, difficulty_level=difficulty, concepts=list(concepts), description=""
+        ),
+        solution=MathSolution(solution_steps=["subtract 1"], final_answer="x = 1", explanation=""),
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    return History(str(tmp_path / "history.sqlite3"))
+
+
+def test_worksheet_problems_are_found_by_page(store):
+    page = b"worksheet image bytes"
+    for index in (0, 1, 2, 10):
+        problem = ProblemResult(index=index, box=(0, index, 10, index + 1), **result(f"problem {index}").model_dump())
+        store.save(problem, "worksheet", input_hash(page, index))
+    store.save(result("other page"), "worksheet", input_hash(b"other page", 0))
+
+    entries = store.find_page(input_hash(page))
+    assert [entry.text for entry in entries] == ["problem 0", "problem 1", "problem 2", "problem 10"]
+    assert store.load(entries[-1].id, ProblemResult).box == (0, 10, 10, 11)
+    assert store.find(input_hash(page)) is None
+
+
+def test_single_entries_are_found_by_page(store):
+    store.save(result("x + 1 = 2"), "text", input_hash("x+1=2"))
+    assert [entry.source for entry in store.find_page(input_hash("x + 1 = 2"))] == ["text"]
+    assert store.find_page(input_hash("x + 2 = 3")) == []
+
+
+def test_saving_again_replaces_and_keeps_thumbnail(store):
+    key = input_hash(b"image")
+    store.save(result("x + 1 = 2"), "upload", key, thumbnail=b"jpeg")
+    other = store.save(result("x + 2 = 3"), "text", input_hash("x + 2 = 3"))
+    # Saved again, the entry is the newest
+    assert store.save(result("x + 1 = 2", math_type="Arithmetic"), "upload", key) > other
+    assert store.count() == 2
+    entry = store.find(key)
+    assert entry.thumbnail == b"jpeg"
+    assert entry.math_type == "arithmetic"
+
+
+def test_search_filters_and_pages(store):
+    for number in range(30):
+        math_type = "geometry" if number % 5 == 0 else "algebra"
+        store.save(result(f"problem number {number}", math_type=math_type), "text", input_hash(f"p{number}"))
+
+    first = store.search(math_type="algebra")
+    assert len(first.entries) == history.PAGE_SIZE
+    second = store.search(math_type="algebra", cursor=first.next_cursor)
+    assert second.next_cursor is None
+    assert len(first.entries) + len(second.entries) == 24
+    # The last word is a prefix, newest first
+    assert [entry.text for entry in store.search(query="number 2", math_type="Geometry").entries] == \
+        ["problem number 25", "problem number 20"]
+    assert len(store.search(query="number 2", concept="Linear Equations").entries) == 11
+    assert store.search(concept="trigonometry").entries == []
+    assert store.math_types() == ["algebra", "geometry"]
+
+
+def test_saves_apply_the_retention_policy(store, monkeypatch):
+    monkeypatch.setattr(history, "PRUNE_INTERVAL", 5)
+    store.max_rows = 3
+    for number in range(4):
+        store.save(result(f"p{number}"), "text", input_hash(f"p{number}"))
+    assert store.count() == 4
+    store.save(result("p4"), "text", input_hash("p4"))
+    assert store.count() == 3
+    assert store.find(input_hash("p0")) is None
+
+
+def test_thumbnail_of_transparent_image_is_white():
+    buffer = io.BytesIO()
+    Image.new("RGBA", (400, 200), (0, 0, 0, 0)).save(buffer, format="PNG")
+    thumbnail = Image.open(io.BytesIO(make_thumbnail(buffer.getvalue())))
+    assert thumbnail.size == (160, 80)
+    assert thumbnail.convert("L").getextrema()[0] > 240
+    assert make_thumbnail(b"not an image") is None
+
+
+def test_opening_the_history_does_not_load_image_libraries(tmp_path):
+    # The app opens the history at startup, also as a thin client of the HTTP service
+    code = "import sys, history; history.History(sys.argv[1]); print(sorted({'PIL', 'numpy'} & set(sys.modules)))"
+    output = subprocess.run(
+        [sys.executable, "-c", code, str(tmp_path / "history.sqlite3")],
+        cwd=Path(history.__file__).parent, capture_output=True, text=True, check=True,
+    ).stdout
+    assert output.strip() == "[]"
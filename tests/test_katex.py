@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+import fastpath
+import katex
+from katex import validate, validate_and_repair
+from models import LatexOutput
+
+
+@pytest.mark.parametrize(
+    "latex_code",
+    [
+        r"\frac{-b \pm \sqrt{b^{2} - 4ac}}{2a}",
+        r"\begin{pmatrix} 1 & 2 \\ 3 & 4 \end{pmatrix}",
+        r"\left( \sum_{k=1}^{n} k \right)^{2}",
+        r"f(x) = \begin{cases} x & x \geq 0 \\ -x & x < 0 \end{cases}",
+        r"\{ x \mid x > 0 \}",
+    ],
+)
+def test_valid_latex_has_no_issues(latex_code):
+    assert validate(latex_code) == []
+
+
+@pytest.mark.parametrize(
+    "latex_code, message",
+    [
+        (r"\frac{1}{2", "Unclosed brace"),
+        (r"x^2}", "Unmatched closing brace"),
+        (r"$x^2$", "delimiter"),
+        (r"\[ x^2 \]", "Display delimiter"),
+        (r"\begin{tikzpicture} \end{tikzpicture}", "not supported by KaTeX"),
+        (r"\begin{matrix} 1 \end{pmatrix}", "does not match"),
+        (r"\begin{cases} x", "never closed"),
+        (r"\left( x", r"without a matching \right"),
+        (r"x \right)", r"without a matching \left"),
+        (r"\newcommand{\R}{\mathbb{R}}", r"Command \newcommand is not supported"),
+    ],
+)
+def test_invalid_latex_is_located(latex_code, message):
+    issues = validate(latex_code)
+    assert issues and message in issues[0].message
+    assert 0 <= issues[0].start < issues[0].end <= len(latex_code)
+
+
+@pytest.mark.parametrize(
+    "latex_code",
+    [
+        r"\begin{array}{c|c} a & b \\ \hline c & d \end{array}",
+        r"a \lt b \gt c",
+        r"\tiny a \scriptsize b \footnotesize c \small d \normalsize e \large f \Large g \LARGE h \huge i \Huge j",
+        r"\mathop{\mathrm{rank}} A",
+        r"\R \subset \C, \N \subset \Z \subset \Q",
+        r"a \newline b \cr c",
+        r"\pmb{x} \circledcirc y",
+    ],
+)
+def test_katex_commands_are_known(latex_code):
+    assert validate(latex_code) == []
+
+
+@pytest.mark.parametrize(
+    "reply", ["```latex\n\\frac{1}{2}\n```", "```\n\\frac{1}{2}\n```", "`\\frac{1}{2}`", " \\frac{1}{2}\n"]
+)
+def test_fences_are_stripped_from_repairs(reply):
+    assert katex.strip_fences(reply) == r"\frac{1}{2}"
+
+
+def test_fast_path_output_validates():
+    for text in ("x^2 + 3x - 4 = 0", "sqrt(pi)/2", "|x - 1| <= 3.5e10", "sum(k^2, k=1, n)"):
+        assert validate(fastpath.to_latex(text)) == []
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    counts = {"passed": 0, "repaired": 0, "failed": 0}
+    monkeypatch.setattr(katex, "stats", counts)
+    return counts
+
+
+def test_only_the_failing_snippet_is_repaired(stats, monkeypatch):
+    sent = []
+
+    async def repair(snippet, message):
+        sent.append((snippet, message))
+        return snippet.replace(r"\dfracc", r"\dfrac")
+
+    monkeypatch.setattr(katex, "repair_snippet", repair)
+    prefix = "y = " + " + ".join(f"x_{{{n}}}" for n in range(20))
+    output = LatexOutput(latex_code=prefix + r" + \dfracc{1}{2}", description="sum")
+    repaired = asyncio.run(validate_and_repair(output))
+
+    assert repaired.latex_code == prefix + r" + \dfrac{1}{2}"
+    assert repaired.description == "sum"
+    snippet, message = sent[0]
+    assert r"\dfracc" in snippet and len(snippet) < len(output.latex_code) // 2
+    assert stats == {"passed": 0, "repaired": 1, "failed": 0}
+
+
+def test_unrepairable_output_is_returned_unchanged(stats, monkeypatch):
+    calls = []
+
+    async def repair(snippet, message):
+        calls.append(snippet)
+        return snippet
+
+    monkeypatch.setattr(katex, "repair_snippet", repair)
+    output = LatexOutput(latex_code=r"\frac{1}{2", description="")
+    assert asyncio.run(validate_and_repair(output)) is output
+    assert len(calls) == katex.MAX_REPAIR_ROUNDS
+    assert stats["failed"] == 1
+
+
+def test_repair_call_goes_to_the_model(fake_server):
+    fixed = asyncio.run(katex.repair_snippet(r"\frac{1}{2", "Unclosed brace '{'"))
+    assert isinstance(fixed, str) and fixed
+    assert not fixed.startswith("`")
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import urllib.request
+from pathlib import Path
+import pytest
+import metrics
+
+REPO = Path(metrics.__file__).parent
+
+
+def run_python(code, cwd, **env):
+    environment = {key: value for key, value in os.environ.items() if not key.startswith("AGENTEX_METRICS")}
+    environment["PYTHONPATH"] = str(REPO)
+    return subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd, env={**environment, **env}, capture_output=True, text=True, check=True
+    ).stdout
+
+
+def test_import_writes_no_log_by_default(tmp_path):
+    run_python("import metrics; metrics.log_event('test')", tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_log_is_opened_on_first_record(tmp_path):
+    code = "import os, metrics; print(os.listdir()); metrics.log_event('test', value=1)"
+    assert run_python(code, tmp_path, AGENTEX_METRICS_LOG="calls.jsonl").strip() == "[]"
+    line = json.loads((tmp_path / "calls.jsonl").read_text())
+    assert line["event"] == "test" and line["value"] == 1
+
+
+def test_request_groups_calls_and_costs():
+    async def calls():
+        with metrics.request("r1") as record:
+            async with metrics.instrument("latex", "gpt-4o-mini") as call:
+                call.input_tokens, call.output_tokens = 1_000_000, 0
+            with pytest.raises(RuntimeError):
+                async with metrics.instrument("solution", "gpt-4o"):
+                    raise RuntimeError("boom")
+        return record
+
+    summary = asyncio.run(calls()).summary()
+    assert summary["calls"] == 2
+    assert summary["cost_usd"] == pytest.approx(0.15)
+    assert set(summary["stages"]) == {"latex", "solution"}
+    assert 'agentex_model_calls_total{model="gpt-4o",stage="solution",status="error"}' in metrics.registry.render()
+
+
+def test_data_url_bytes():
+    assert metrics.data_url_bytes("data:image/png;base64,aGVsbG8=") == 5
+    assert metrics.data_url_bytes("https://example.com/a.png") == 0
+
+
+def test_metrics_server_listens_on_localhost(monkeypatch):
+    monkeypatch.setattr(metrics, "_server", None)
+    server = metrics.start_metrics_server(0)
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import time
+import pytest
+import fake_openai
+import fused
+from fake_openai import FakeServerConfig
+from main import latex_generator_agent, math_classifier_agent, solution_generator_agent
+from models import MathSolution
+import pipeline
+import routing
+from pipeline import TextPipeline
+
+ATTEMPTS = {
+    # The small tier streams three steps but no answer, which fails validation
+    "small-model": MathSolution(solution_steps=["guess", "check", "give up"], final_answer="", explanation=""),
+    "large-model": MathSolution(solution_steps=["x + 1 = 2", "x = 1"], final_answer="x = 1", explanation="Subtract 1."),
+}
+
+
+async def fake_stream_agent(agent, stage, text):
+    output = ATTEMPTS[agent.model]
+    document = output.model_dump_json()
+    yield None
+    for position in range(0, len(document), 8):
+        yield document[position:position + 8]
+    yield output
+
+
+@pytest.fixture
+def routed_pipeline(monkeypatch):
+    monkeypatch.setattr(pipeline, "_stream_agent", fake_stream_agent)
+    router = routing.Router(
+        tiers={"small": "small-model", "large": "large-model"},
+        small_tier_difficulties={stage: {"easy", "medium", "hard"} for stage in routing.SMALL_TIER_DIFFICULTIES},
+    )
+    return TextPipeline(latex_generator_agent, math_classifier_agent, solution_generator_agent, router=router)
+
+
+async def collect(text_pipeline, text):
+    return [event async for event in text_pipeline.stream(text, stages=["solution"])]
+
+
+def test_escalation_replaces_streamed_steps(routed_pipeline):
+    events = [event for event in asyncio.run(collect(routed_pipeline, "Solve x + 1 = 2")) if event.stage == "solution"]
+    kinds = [event.kind for event in events]
+
+    # Steps of the failed attempt, then one event replacing them, then the new attempt's steps from 0
+    reset = kinds.index("partial")
+    assert kinds[:reset] == ["step", "step"]
+    assert events[reset].data == []
+    steps = [event.data for event in events[reset + 1:] if event.kind == "step"]
+    assert steps == [{"index": 0, "text": "x + 1 = 2"}, {"index": 1, "text": "x = 1"}]
+    assert kinds[-1] == "done"
+    assert events[-1].data.final_answer == "x = 1"
+
+
+def test_restart_without_sent_content_emits_nothing():
+    events = []
+    progress = pipeline._Progress("solution", events.append)
+    assert progress.restart().sent_steps == 0
+    assert events == []
+
+    progress = pipeline._Progress("latex", events.append)
+    progress.update(json.loads('{"latex_code": "x^2"}'))
+    restarted = progress.restart()
+    assert [event.data for event in events] == ["x^2", ""]
+    assert restarted.latex == ""
+
+
+@pytest.fixture
+def plain_pipeline():
+    """Every stage reaches the (fake) model: no cache, fast path or LaTeX repair"""
+    return TextPipeline(
+        latex_generator_agent, math_classifier_agent, solution_generator_agent, fast_path=False, validate_latex=False
+    )
+
+
+def failing_stage(monkeypatch, agent):
+    """Make the fake model answer ``agent``'s requests with text that is not its output type"""
+    chat_reply = fake_openai.chat_reply
+
+    def reply(body):
+        if body["messages"][0].get("content") == agent.instructions:
+            return "not json", None
+        return chat_reply(body)
+
+    monkeypatch.setattr(fake_openai, "chat_reply", reply)
+
+
+def test_stages_run_concurrently(fake_server, plain_pipeline):
+    fake_server.config = FakeServerConfig(latency=0.2)
+    started = time.perf_counter()
+    result = asyncio.run(plain_pipeline.run("Solve 2x + 1 = 7"))
+    elapsed = time.perf_counter() - started
+
+    assert result.errors == {}
+    assert result.latex and result.classification and result.solution
+    # Each stage waits out its own model calls; run back to back they would take their sum
+    assert elapsed < 0.8 * sum(result.timings.values())
+
+
+def test_stage_timeout_keeps_the_other_results(fake_server, plain_pipeline):
+    fake_server.config = FakeServerConfig(latency=0.3)
+    result = asyncio.run(plain_pipeline.run("Solve 2x + 1 = 7", timeouts={"solution": 0.1}))
+
+    assert result.errors == {"solution": "timed out after 0.1s"}
+    assert result.solution is None
+    assert result.latex and result.latex.latex_code
+    assert result.classification
+
+
+def test_stage_error_does_not_cancel_the_others(fake_server, plain_pipeline, monkeypatch):
+    failing_stage(monkeypatch, math_classifier_agent)
+    result = asyncio.run(plain_pipeline.run("Solve 2x + 1 = 7"))
+
+    assert set(result.errors) == {"classification"} and result.errors["classification"]
+    assert result.classification is None
+    assert result.latex and result.solution
+
+
+@pytest.mark.parametrize("stage", ["latex", "classification", "solution"])
+def test_direct_mode_makes_one_call_per_stage(fake_server, plain_pipeline, stage):
+    before = fake_server.request_count
+    result = asyncio.run(plain_pipeline.run("Solve 2x + 1 = 7", modes={stage: "direct"}, stages=[stage]))
+
+    assert fake_server.request_count - before == 1
+    assert result.errors == {}
+    output = getattr(result, stage)
+    assert isinstance(output, plain_pipeline.agents[stage].output_type)
+
+
+def test_invalid_fused_section_falls_back_to_its_agent(fake_server, plain_pipeline, monkeypatch):
+    chat_reply = fake_openai.chat_reply
+
+    def reply(body):
+        content, tool_calls = chat_reply(body)
+        if body["messages"][0].get("content") == fused.instructions(plain_pipeline.agents):
+            content = json.dumps({**json.loads(content), "classification": {"difficulty_level": 3}})
+        return content, tool_calls
+
+    monkeypatch.setattr(fake_openai, "chat_reply", reply)
+    result = asyncio.run(plain_pipeline.run("Solve 2x + 1 = 7", fused=True))
+
+    assert set(result.fallbacks) == {"classification"}
+    assert result.fallbacks["classification"].startswith("invalid classification")
+    assert result.errors == {}
+    assert result.latex and result.solution
+    assert result.classification and result.classification.math_type
+    # Only the invalid section was recomputed, by its own stage
+    assert set(result.timings) == {"fused", "classification"}
+
+
+def test_extend_only_calls_the_model_for_missing_stages(fake_server, plain_pipeline):
+    direct = {stage: "direct" for stage in plain_pipeline.agents}
+
+    async def scenario():
+        counts = [fake_server.request_count]
+        result = await plain_pipeline.run("Solve 2x + 1 = 7", modes=direct, stages=["latex"])
+        counts.append(fake_server.request_count)
+        latex = result.latex
+        result = await plain_pipeline.extend(result, ["latex", "solution"], modes=direct)
+        counts.append(fake_server.request_count)
+        result = await plain_pipeline.extend(result, ["latex", "solution"], modes=direct)
+        counts.append(fake_server.request_count)
+        return result, latex, [after - before for before, after in zip(counts, counts[1:])]
+
+    result, latex, calls = asyncio.run(scenario())
+    assert calls == [1, 1, 0]
+    assert result.latex == latex
+    assert result.solution and result.classification is None
+
+
+def test_stream_event_order(fake_server, plain_pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "PARTIAL_PARSE_CHARS", 1)  # every delta, to see the LaTeX grow
+
+    async def scenario():
+        direct = {stage: "direct" for stage in plain_pipeline.agents}
+        return [event async for event in plain_pipeline.stream("Solve 2x + 1 = 7", modes=direct)]
+
+    events = asyncio.run(scenario())
+    assert (events[-1].stage, events[-1].kind) == ("pipeline", "done")
+    result = events[-1].data
+    by_stage = {stage: [event for event in events if event.stage == stage] for stage in plain_pipeline.agents}
+
+    latex = by_stage["latex"]
+    assert [event.kind for event in latex] == ["partial"] * (len(latex) - 1) + ["done"]
+    partials = [event.data for event in latex[:-1]]
+    assert len(partials) > 1 and partials[-1] == result.latex.latex_code
+    assert all(later.startswith(earlier) and later != earlier for earlier, later in zip(partials, partials[1:]))
+
+    solution = by_stage["solution"]
+    assert [event.kind for event in solution] == ["step"] * len(result.solution.solution_steps) + ["done"]
+    assert [event.data for event in solution[:-1]] == [
+        {"index": index, "text": step} for index, step in enumerate(result.solution.solution_steps)
+    ]
+    assert [event.kind for event in by_stage["classification"]] == ["done"]
+
+
+def test_partial_json_is_parsed_at_boundaries():
+    buffer = pipeline._PartialJSON()
+    assert buffer.feed('{"latex_code": "') == {"latex_code": ""}  # the key closed
+    assert buffer.feed("x") is None  # mid-string and short: not re-parsed
+    assert buffer.feed("^2") is None
+    assert buffer.feed('", ') == {"latex_code": "x^2"}
+    assert buffer.feed('"solution_steps": ["a", "b') == {"latex_code": "x^2", "solution_steps": ["a", "b"]}
+    long_step = "c" * pipeline.PARTIAL_PARSE_CHARS
+    assert buffer.feed(long_step)["solution_steps"] == ["a", "b" + long_step]
+
+
+def test_fused_stream_failure_becomes_error_events(fake_server, plain_pipeline, monkeypatch):
+    async def broken(*args):
+        raise RuntimeError("fused response lost")
+
+    monkeypatch.setattr(plain_pipeline, "_stream_fused", broken)
+
+    async def scenario():
+        return [event async for event in plain_pipeline.stream("Solve 2x + 1 = 7", fused=True)]
+
+    events = asyncio.run(scenario())
+    assert [(event.stage, event.kind) for event in events[:-1]] == [
+        (stage, "error") for stage in plain_pipeline.agents
+    ]
+    assert events[-1].data.errors == {stage: "fused response lost" for stage in plain_pipeline.agents}
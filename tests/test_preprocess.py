@@ -0,0 +1,123 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image, ImageDraw
+import pytest
+import preprocess
+from preprocess import UnsafeURL, autocrop, check_url, download_image, open_image, preprocess_image
+
+
+def encode(image, image_format="PNG"):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def text_image(mode, background):
+    image = Image.new(mode, (600, 300), background)
+    ImageDraw.Draw(image).text((250, 140), "x^2 + 1 = 0", fill="black" if mode != "LA" else (0, 255))
+    return image
+
+
+def luminance(data):
+    return np.asarray(Image.open(io.BytesIO(data)).convert("L"), dtype=np.float64)
+
+
+@pytest.mark.parametrize("mode, background", [("RGBA", (0, 0, 0, 0)), ("LA", (0, 0))])
+def test_transparent_background_becomes_white(mode, background):
+    prepared = preprocess_image(encode(text_image(mode, background)))
+    pixels = luminance(prepared.data)
+    assert pixels.mean() > 200  # mostly white, not a black page
+    assert pixels.min() < 100  # the text survived
+    assert prepared.width < 600  # and the transparent margins were cropped
+
+
+def test_palette_image_with_transparency():
+    image = text_image("RGBA", (0, 0, 0, 0)).convert("P", palette=Image.ADAPTIVE)
+    image.info["transparency"] = image.getpixel((0, 0))
+    assert np.asarray(open_image(encode(image)).convert("L")).mean() > 200
+
+
+def test_transparent_original_is_never_kept():
+    tiny = Image.new("RGBA", (4, 4), (0, 0, 0, 0))
+    prepared = preprocess_image(encode(tiny))
+    assert prepared.mime_type == "image/jpeg"
+    assert luminance(prepared.data).mean() > 250
+
+
+def test_opaque_original_is_kept_when_smaller():
+    data = encode(Image.new("L", (4, 4), 255))
+    assert preprocess_image(data).data == data
+
+
+def test_large_images_are_downscaled_and_cropped():
+    image = Image.new("RGB", (4000, 3000), "white")
+    ImageDraw.Draw(image).rectangle((1000, 1000, 3000, 2000), fill="black")
+    prepared = preprocess_image(encode(image, "JPEG"), max_side=800)
+    assert max(prepared.width, prepared.height) <= 800
+    assert prepared.bytes_after < prepared.bytes_before
+
+
+def test_colour_is_kept_unless_grayscale_is_requested():
+    # Noise, so the re-encoded JPEG is smaller than the PNG and is the one returned
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (400, 600, 3), dtype=np.uint8))
+    assert Image.open(io.BytesIO(preprocess_image(encode(image)).data)).mode == "RGB"
+    assert Image.open(io.BytesIO(preprocess_image(encode(image), grayscale=True).data)).mode == "L"
+
+
+def test_autocrop_keeps_blank_images():
+    blank = Image.new("L", (50, 50), 255)
+    assert autocrop(blank).size == (50, 50)
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "file:///etc/passwd", "ftp://example.com/a.png", "http://127.0.0.1:8000/a.png", "http://localhost/a.png",
+        "http://10.0.0.5/a.png", "http://192.168.1.1/a.png", "http://169.254.169.254/latest/meta-data/",
+        "http://[::1]/a.png", "http://[::ffff:127.0.0.1]/a.png", "http://0.0.0.0/a.png",
+    ],
+)
+def test_unsafe_urls_are_not_fetched(url):
+    with pytest.raises(UnsafeURL):
+        download_image(url)
+
+
+class ImageHost(BaseHTTPRequestHandler):
+    """Local stand-in for an image host: /big streams 2 KB, /redirect points at the metadata service"""
+
+    def do_GET(self):
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "http://169.254.169.254/latest/meta-data/")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()  # no Content-Length, so only the streamed byte count can stop it
+        self.wfile.write(b"x" * 2048)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def image_host(monkeypatch):
+    host = ThreadingHTTPServer(("127.0.0.1", 0), ImageHost)
+    threading.Thread(target=host.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{host.server_address[1]}"
+    # The host itself is on loopback; every other URL still goes through the real check
+    monkeypatch.setattr(preprocess, "check_url", lambda url: None if url.startswith(base) else check_url(url))
+    yield base
+    host.shutdown()
+
+
+def test_downloads_stop_at_the_byte_limit(image_host):
+    assert download_image(image_host + "/big", max_bytes=4096) == b"x" * 2048
+    with pytest.raises(ValueError, match="larger than"):
+        download_image(image_host + "/big", max_bytes=1024)
+
+
+def test_redirects_are_checked(image_host):
+    with pytest.raises(UnsafeURL):
+        download_image(image_host + "/redirect")
@@ -0,0 +1,120 @@
+import asyncio
+import time
+import pytest
+from clients import get_async_client
+from fake_openai import FakeServerConfig
+import scheduler
+from scheduler import Scheduler, TokenBucket, estimate_tokens, retry_after_seconds
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(60)  # one per second
+    now = bucket.updated
+    bucket.take(60)
+    assert bucket.delay(1, now) == pytest.approx(1.0)
+    assert bucket.delay(1, now + 1.0) == 0.0
+    assert bucket.delay(1, now + 1000.0) == 0.0
+    assert bucket.tokens == 60
+    # Requests larger than the bucket wait for a full bucket instead of forever
+    bucket.take(60)
+    assert bucket.delay(10_000, now + 1000.0) == pytest.approx(60.0)
+
+
+def test_interactive_lane_goes_before_batch():
+    async def scenario():
+        gate = Scheduler(rpm=600, tpm=0)  # one request per 0.1 s
+        gate.requests.take(600)
+        order = []
+
+        async def request(name, lane):
+            await gate.acquire(1, lane)
+            order.append(name)
+
+        batch = [asyncio.create_task(request(f"batch {number}", "batch")) for number in range(2)]
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(request("interactive", "interactive"))
+        await asyncio.gather(*batch, interactive)
+        return order, gate.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order[0] == "interactive"
+    assert stats["waiting"] == {"interactive": 0, "batch": 0}
+    assert stats["throttle_wait_seconds"]["batch"] > 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        gate = Scheduler(rpm=60, tpm=0)
+        gate.requests.take(60)
+        waiter = asyncio.create_task(gate.acquire(1, "interactive"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return gate
+
+    gate = asyncio.run(scenario())
+    assert gate._waiting == []
+    assert gate.depths["interactive"] == 0
+
+
+def test_backoff_honors_retry_after_and_grows_without_it(monkeypatch):
+    gate = Scheduler(rpm=0, tpm=0)
+    gate.backoff(2.0)
+    assert 1.9 < gate.stats()["cooldown_seconds"] <= 2.0
+
+    gate = Scheduler(rpm=0, tpm=0)
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: high)
+    for _ in range(3):
+        gate.backoff()
+    assert gate.cooldown_until - time.monotonic() == pytest.approx(scheduler.BACKOFF_BASE * 4, abs=0.05)
+    assert gate.rate_limited == 3
+    gate.succeeded()
+    assert gate.consecutive_limits == 0
+
+
+def test_acquire_waits_for_the_cooldown():
+    gate = Scheduler(rpm=0, tpm=0)
+    gate.backoff(0.2)
+    assert asyncio.run(gate.acquire(1, "batch")) >= 0.15
+
+
+def test_estimate_tokens():
+    body = {
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "x" * 400},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64," + "A" * 10_000}},
+        ]}],
+        "max_tokens": 100,
+    }
+    # "user", "text" and the 400 characters, one image, and the completion
+    assert estimate_tokens(body) == (4 + 4 + 400) // 4 + scheduler.IMAGE_TOKENS + 100
+    assert estimate_tokens({"input": "hi"}) == scheduler.DEFAULT_COMPLETION_TOKENS
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds({"retry-after-ms": "250", "retry-after": "1"}) == 0.25
+    assert retry_after_seconds({"retry-after": "3"}) == 3.0
+    assert retry_after_seconds({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) is None
+
+
+def test_unknown_lane_is_rejected():
+    with pytest.raises(ValueError):
+        with scheduler.lane("express"):
+            pass
+
+
+def test_rate_limited_calls_pause_and_retry(fake_server):
+    fake_server.config = FakeServerConfig(error_rate=0.5, retry_after=0.05)
+    fake_server.random.seed(3)
+    limited_before = scheduler.scheduler.rate_limited
+
+    async def calls():
+        client = get_async_client()
+        return await asyncio.gather(*(
+            client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": f"{n}"}])
+            for n in range(6)
+        ))
+
+    responses = asyncio.run(calls())
+    assert all(response.choices for response in responses)
+    assert scheduler.scheduler.rate_limited > limited_before
@@ -0,0 +1,86 @@
+import asyncio
+import io
+from PIL import Image, ImageDraw, ImageFont
+from main import text_pipeline
+import segmentation
+from segmentation import find_regions, parse_worksheet, runs, segment_image
+
+
+def worksheet(problems, size=(1200, 900)):
+    """White page with each text drawn at its (x, y)"""
+    font = ImageFont.load_default(size=28)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for (x, y), text in problems:
+        draw.text((x, y), text, fill="black", font=font)
+    return image
+
+
+def encode(image, image_format="PNG"):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+GRID = [
+    ((60, 80), "1) x + 1 = 2"), ((700, 80), "2) 2x = 8"),
+    ((60, 500), "3) x^2 = 9"), ((700, 500), "4) 3x - 1 = 5"),
+]
+
+
+def test_runs_split_at_gaps():
+    assert runs([0, 1, 1, 0, 0, 0, 1, 0], 2) == [(1, 3), (6, 7)]
+    assert runs([0, 1, 1, 0, 1, 0], 2) == [(1, 5)]
+    assert runs([0, 0], 2) == []
+
+
+def test_regions_in_reading_order():
+    regions = find_regions(worksheet(GRID).convert("L"))
+    assert len(regions) == 4
+    # Row by row, left to right, each box around its own problem
+    for box, ((x, y), _) in zip(regions, GRID):
+        left, top, right, bottom = box
+        assert left <= x + 5 and top <= y + 10 and right > x + 100 and bottom < y + 60
+
+
+def test_single_problem_is_not_split():
+    image_bytes = encode(worksheet([((60, 80), "x + 1 = 2")]))
+    assert segment_image(image_bytes) == [((0, 0, 1200, 900), image_bytes)]
+
+
+def test_too_many_regions_are_parsed_whole(monkeypatch):
+    monkeypatch.setattr(segmentation, "MAX_REGIONS", 3)
+    image_bytes = encode(worksheet(GRID))
+    assert len(segment_image(image_bytes)) == 1
+
+
+def test_transparent_worksheet_is_segmented():
+    page = worksheet(GRID).convert("RGBA")
+    page.putalpha(page.convert("L").point(lambda value: 255 - value))  # text opaque, paper transparent
+    assert len(segment_image(encode(page))) == 4
+
+
+def test_parse_worksheet(fake_server, result_cache):
+    problems = asyncio.run(parse_worksheet(encode(worksheet(GRID)), text_pipeline, result_cache, {"stages": ["latex"]}))
+    assert [problem.index for problem in problems] == [0, 1, 2, 3]
+    assert all(problem.text and problem.latex for problem in problems)
+    assert all(problem.classification is None for problem in problems)
+    assert problems[0].box[0] < problems[1].box[0] and problems[0].box[1] < problems[2].box[1]
+
+
+def test_vision_failure_is_reported_per_problem(fake_server, result_cache, monkeypatch):
+    parse_image_bytes = segmentation.vision.parse_image_bytes
+    calls = []
+
+    async def flaky(crop_bytes, cache, **options):
+        calls.append(crop_bytes)
+        if len(calls) == 2:
+            raise TimeoutError()
+        return await parse_image_bytes(crop_bytes, cache, **options)
+
+    monkeypatch.setattr(segmentation, "MAX_PARALLEL_REGIONS", 1)
+    monkeypatch.setattr(segmentation.vision, "parse_image_bytes", flaky)
+    problems = asyncio.run(parse_worksheet(encode(worksheet(GRID)), text_pipeline, result_cache, {"stages": ["latex"]}))
+    assert problems[1].errors == {"vision": "TimeoutError"}
+    assert problems[1].latex is None
+    assert all(problem.latex and not problem.errors for problem in problems[:1] + problems[2:])
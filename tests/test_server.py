@@ -0,0 +1,111 @@
+import base64
+import io
+from PIL import Image
+import pytest
+from starlette.testclient import TestClient
+import server
+
+
+def png_base64():
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), "white").save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+@pytest.fixture
+def client(fake_server, result_cache, monkeypatch):
+    # Each TestClient runs its own event loop, and asyncio queues bind to the first one
+    monkeypatch.setattr(server, "jobs", server.JobQueue())
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.mark.parametrize("body", [b"{not json", b"\xff\xfe", b""], ids=["syntax", "bytes", "empty"])
+def test_malformed_body_is_a_bad_request(client, body):
+    response = client.post("/v1/process", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+    assert response.json()["error"][0]["type"] in ("json_invalid", "json_type")
+
+
+def test_invalid_field_is_a_bad_request(client):
+    response = client.post("/v1/process", json={"text": "x", "fused": "sometimes"})
+    assert response.status_code == 400
+    assert response.json()["error"][0]["loc"] == ["fused"]
+
+
+@pytest.mark.parametrize(
+    "body, message",
+    [({}, "exactly one"), ({"text": "x", "image_url": "http://example.com/a.png"}, "exactly one"),
+     ({"text": "x", "stages": ["poetry"]}, "Unknown stage"),
+     ({"text": "x", "modes": {"bogus": "agent"}}, "Unknown stage"),
+     ({"image_base64": "not base64!"}, "not valid base64"),
+     ({"image_base64": base64.b64encode(b"plain text").decode()}, "not a readable image"),
+     ({"image_url": "http://169.254.169.254/latest/meta-data/"}, "non-public address"),
+     ({"image_url": "file:///etc/passwd"}, "Only http and https")],
+    ids=["no-input", "two-inputs", "stages", "modes", "base64", "not-an-image", "private-url", "file-url"],
+)
+def test_request_checks(client, body, message):
+    response = client.post("/v1/jobs", json=body)
+    assert response.status_code == 400
+    assert message in response.json()["error"]
+
+
+def test_process_text(client):
+    response = client.post("/v1/process", json={"text": "Solve x + 1 = 2", "modes": {"latex": "direct"}})
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "done"
+    assert job["result"]["text"] == "Solve x + 1 = 2"
+    assert job["result"]["errors"] == {}
+
+
+def test_wrapped_base64_image_is_accepted(client, monkeypatch):
+    async def execute(request, request_id=None, queue_wait=0.0):
+        return None
+
+    monkeypatch.setattr(server, "execute", execute)
+    encoded = png_base64()
+    wrapped = "\n".join(encoded[start:start + 76] for start in range(0, len(encoded), 76))
+    assert client.post("/v1/process", json={"image_base64": wrapped}).status_code == 200
+
+
+def test_failed_process_is_not_ok(client, monkeypatch):
+    async def execute(request, request_id=None, queue_wait=0.0):
+        raise RuntimeError("vision model unavailable")
+
+    monkeypatch.setattr(server, "execute", execute)
+    response = client.post("/v1/process", json={"text": "x + 1 = 2"})
+    assert response.status_code == 502
+    assert response.json()["status"] == "failed"
+    assert response.json()["error"] == "vision model unavailable"
+
+
+def test_oversized_body_is_rejected(fake_server, result_cache, monkeypatch):
+    monkeypatch.setattr(server, "jobs", server.JobQueue())
+    with TestClient(server.BodySizeLimit(server.app, max_bytes=1000)) as limited:
+        assert limited.post("/v1/process", json={"text": "x" * 2000}).status_code == 413
+
+        def chunks():  # no Content-Length
+            yield b'{"text": "'
+            for _ in range(20):
+                yield b"x" * 100
+            yield b'"}'
+
+        response = limited.post("/v1/process", content=chunks(), headers={"Content-Type": "application/json"})
+        assert response.status_code == 413
+        assert limited.post("/v1/process", json={"text": "x + 1 = 2", "stages": ["latex"]}).status_code == 200
+
+
+def test_job_polling(client):
+    response = client.post("/v1/jobs", json={"text": "Solve x + 1 = 2", "stages": ["latex"]})
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    assert response.headers["Location"] == f"/v1/jobs/{job_id}"
+    assert client.get(f"/v1/jobs/{job_id}").status_code in (200, 202)
+    assert client.get("/v1/jobs/unknown").status_code == 404
+
+
+def test_health(client):
+    stats = client.get("/healthz").json()
+    assert stats["status"] == "ok"
+    assert stats["workers"] == server.jobs.worker_count
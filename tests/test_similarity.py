@@ -0,0 +1,21 @@
+import pytest
+from similarity import canonical_text
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("x² + 3×x = 10", "x^2+3*x=10"),
+        ("a₁ − b ≤ 2", "a_1-b<=2"),
+        ("  f( x )  ÷  2 ", "f(x)/2"),
+        ("x⁻¹ ≠ ∞", "x^-1!=inf"),
+        ("What is the area of a circle?", "What is the area of a circle?"),
+    ],
+)
+def test_canonical_text(text, expected):
+    assert canonical_text(text) == expected
+
+
+def test_changed_numbers_stay_distinct():
+    assert canonical_text("t = 3") != canonical_text("t = 4")
+    assert canonical_text("x^2 + 1") != canonical_text("x^2 + 11")
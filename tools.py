@@ -1,28 +1,33 @@
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
+import json
 from models import ImageParser, LatexOutput, MathClassification, MathSolution
 from agents import function_tool
+from clients import get_async_client
+import metrics
+import routing
 
 @function_tool
-def parse_image(image_url: str) -> ImageParser:
-    load_dotenv()
+async def parse_image(image_url: str) -> ImageParser:
+    client = get_async_client()
 
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    model = routing.routed_model("gpt-4o")
 
-    response = client.responses.create(
-        model="gpt-4o",
-        input=[{
-            "role": "user",
-            "content": [
-                {"type": "input_text", "text": "Describe this math problem in detailed english to later generate latex code"},
-                {
-                    "type": "input_image",
-                    "image_url": image_url,
-                },
-            ],
-        }],
-    )
+    async with metrics.instrument(
+        "tool:parse_image", model, image_bytes=metrics.data_url_bytes(image_url)
+    ) as call:
+        response = await client.responses.create(
+            model=model,
+            input=[{
+                "role": "user",
+                "content": [
+                    {"type": "input_text", "text": "Describe this math problem in detailed english to later generate latex code"},
+                    {
+                        "type": "input_image",
+                        "image_url": image_url,
+                    },
+                ],
+            }],
+        )
+        call.add_usage(response.usage)
 
     # Return a proper ImageParser object
     return ImageParser(
@@ -31,28 +36,28 @@ def parse_image(image_url: str) -> ImageParser:
     )
 
 @function_tool
-def classify_math_content(text: str) -> MathClassification:
+async def classify_math_content(text: str) -> MathClassification:
     """Classifies mathematical content by type, difficulty, and identifies key concepts"""
-    load_dotenv()
+    client = get_async_client()
+    model = routing.routed_model("gpt-4o")
     
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-                "role": "system", 
-                "content": "You are a mathematical content classifier. Given a mathematical text or problem, classify it by type, difficulty level, identify key mathematical concepts involved, and provide a brief description."
-            },
-            {"role": "user", "content": text}
-        ],
-        response_format={"type": "json_object"}
-    )
+    async with metrics.instrument("tool:classify_math_content", model) as call:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {
+                    "role": "system", 
+                    "content": "You are a mathematical content classifier. Given a mathematical text or problem, classify it by type, difficulty level, identify key mathematical concepts involved, and provide a brief description."
+                },
+                {"role": "user", "content": text}
+            ],
+            response_format={"type": "json_object"}
+        )
+        call.add_usage(response.usage)
     
     result = response.choices[0].message.content
     
     # Parse JSON and return MathClassification object
-    import json
     data = json.loads(result)
     
     return MathClassification(
@@ -63,32 +68,32 @@ def classify_math_content(text: str) -> MathClassification:
     )
 
 @function_tool
-def generate_solution(text: str) -> MathSolution:
+async def generate_solution(text: str) -> MathSolution:
     """Generates a step-by-step solution for a mathematical problem"""
-    load_dotenv()
-    
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    client = get_async_client()
+    model = routing.routed_model("gpt-4o")
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-                "role": "system", 
-                "content": "You are a mathematics expert. Given a mathematical problem, provide a clear step-by-step solution with detailed explanations."
-            },
-            {"role": "user", "content": text}
-        ],
-        response_format={"type": "json_object"}
-    )
+    async with metrics.instrument("tool:generate_solution", model) as call:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {
+                    "role": "system", 
+                    "content": "You are a mathematics expert. Given a mathematical problem, provide a clear step-by-step solution with detailed explanations."
+                },
+                {"role": "user", "content": text}
+            ],
+            response_format={"type": "json_object"}
+        )
+        call.add_usage(response.usage)
     
     result = response.choices[0].message.content
     
     # Parse JSON and return MathSolution object
-    import json
     data = json.loads(result)
     
     return MathSolution(
         solution_steps=data.get("solution_steps", []),
         final_answer=data.get("final_answer", ""),
         explanation=data.get("explanation", "")
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,118 @@
+import asyncio
+import base64
+from cache import make_key, prompt_version
+from clients import get_async_client
+import metrics
+from models import ImageParser
+from preprocess import UnsafeURL, download_image, preprocess_image
+
+VISION_MODEL = "gpt-4o"
+VISION_PROMPT = "Describe this math problem in detailed english to later generate latex code."
+
+
+def request_body(image_url):
+    """Chat Completions parameters of a vision call (also used for Batch API request lines)"""
+    return {
+        "model": VISION_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": VISION_PROMPT},
+                    {"type": "image_url", "image_url": {"url": image_url}}
+                ]
+            }
+        ],
+        "max_tokens": 1000,
+    }
+
+
+# Function to call Vision API directly
+async def call_vision_api(image_url):
+    async with metrics.instrument("vision", VISION_MODEL, image_bytes=metrics.data_url_bytes(image_url)) as call:
+        response = await get_async_client().chat.completions.create(**request_body(image_url))
+        call.add_usage(response.usage)
+    return response.choices[0].message.content
+
+
+def image_to_data_url(image_bytes, mime_type):
+    """Encode raw image bytes as a data URL the Vision API accepts"""
+    encoded_string = base64.b64encode(image_bytes).decode("utf-8")
+    return f"data:{mime_type};base64,{encoded_string}"
+
+
+def cached_vision(cache_payload, cache):
+    """Cache key of this image (bytes, or URL string) and its cached parse, or None"""
+    key = make_key("vision", cache_payload, VISION_MODEL, prompt_version(VISION_PROMPT))
+    return key, cache.get(key)
+
+
+async def cached_vision_api(image_url, cache_payload, cache):
+    """Call the Vision API unless this image (bytes, or URL string) was already parsed"""
+    key, cached = cached_vision(cache_payload, cache)
+    if cached is not None:
+        return cached.text
+    vision_response = await call_vision_api(image_url)
+    cache.set(key, ImageParser(is_valid=True, text=vision_response))
+    return vision_response
+
+
+async def stream_vision_api(image_url):
+    """Like ``call_vision_api``, but yields the description as text deltas while it is generated"""
+    async with metrics.instrument("vision", VISION_MODEL, image_bytes=metrics.data_url_bytes(image_url)) as call:
+        stream = await get_async_client().chat.completions.create(
+            **request_body(image_url),
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            call.add_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+async def stream_cached_vision_api(image_url, cache_payload, cache):
+    """Streaming ``cached_vision_api``: a cache hit is yielded as a single chunk"""
+    key, cached = cached_vision(cache_payload, cache)
+    if cached is not None:
+        yield cached.text
+        return
+    parts = []
+    async for delta in stream_vision_api(image_url):
+        parts.append(delta)
+        yield delta
+    cache.set(key, ImageParser(is_valid=True, text="".join(parts)))
+
+
+async def prepare_image_bytes(image_bytes, **options):
+    """Preprocess an image for upload; returns (data URL, cache payload, PreprocessedImage)"""
+    prepared = await asyncio.to_thread(preprocess_image, image_bytes, **options)
+    return image_to_data_url(prepared.data, prepared.mime_type), prepared.data, prepared
+
+
+async def prepare_image_url(image_url, **options):
+    """Download and preprocess a remote image; returns (data URL, cache payload, PreprocessedImage).
+
+    Falls back to handing the URL to the Vision API when the download or decoding
+    fails (e.g. hosts that block non-browser clients); the PreprocessedImage is
+    then None. URLs that must not be fetched (see ``preprocess.check_url``) raise UnsafeURL.
+    """
+    try:
+        image_bytes = await asyncio.to_thread(download_image, image_url)
+        return await prepare_image_bytes(image_bytes, **options)
+    except UnsafeURL:
+        raise
+    except Exception:
+        return image_url, image_url, None
+
+
+async def parse_image_bytes(image_bytes, cache, **options):
+    """Shrink an image with ``preprocess_image`` and parse it; returns (text, PreprocessedImage)"""
+    image_url, cache_payload, prepared = await prepare_image_bytes(image_bytes, **options)
+    return await cached_vision_api(image_url, cache_payload, cache), prepared
+
+
+async def parse_image_url(image_url, cache, **options):
+    """Download, preprocess and parse a remote image; returns (text, PreprocessedImage or None)"""
+    image_url, cache_payload, prepared = await prepare_image_url(image_url, **options)
+    return await cached_vision_api(image_url, cache_payload, cache), prepared